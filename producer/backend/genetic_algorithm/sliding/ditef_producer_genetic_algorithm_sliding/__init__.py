@@ -3,6 +3,7 @@ import asyncio
 import click
 import importlib
 import pathlib
+import socket
 import urllib
 
 import ditef_router.api_client
@@ -33,7 +34,11 @@ async def cancel_populations(app: aiohttp.web.Application):
 
 
 async def async_main(**arguments):
-    async with ditef_router.api_client.ApiClient(arguments['router_url'], arguments['connect_timeout'], arguments['initial_retry_timeout'], arguments['maximum_retry_timeout']) as task_api_client:
+    # producers sharing a router are told apart by host and port by default
+    producer_id = arguments['producer_id']
+    if producer_id is None:
+        producer_id = f'{socket.gethostname()}:{arguments["port"]}'
+    async with ditef_router.api_client.ApiClient(arguments['router_url'], arguments['connect_timeout'], arguments['initial_retry_timeout'], arguments['maximum_retry_timeout'], producer_id=producer_id) as task_api_client:
         app = aiohttp.web.Application()
         app['arguments'] = arguments
 
@@ -82,6 +87,7 @@ async def async_main(**arguments):
 @click.option('--initial-retry-timeout', default=1, help='Initial retry timeout in seconds at beginning of back-off')
 @click.option('--maximum-retry-timeout', default=16, help='Upper bound of back-off retry timeout in seconds')
 @click.option('--population-tasks', default=3, help='Number of running tasks per population')
+@click.option('--producer-id', default=None, help='Identifies the producer towards the router which shares the workers fairly between producers, defaults to hostname:port')
 @click.option('--minimum-websocket-interval', default=0.5, help='Shortest interval period in seconds for rate limiting outgoing websocket messages (set to 0 for no limit)')
 @click.argument('router_url', type=str)
 @click.argument('individual_type', type=str)
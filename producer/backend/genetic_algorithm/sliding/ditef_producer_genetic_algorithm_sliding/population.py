@@ -137,15 +137,18 @@ class Population:
 
     async def ensure_minimum_amount_of_members(self):
         while len(self.members) < self.configuration['minimum_amount_of_members']:
-            # too few members, add one random
-            random_individual = importlib.import_module(
-                self.individual_type,
-            ).Individual.random(
-                self.task_api_client,
-                self.configuration,
-                self.state_path,
-            )
-            await self.finalize_new_member_operation(random_individual)
+            # too few members, add random ones and evaluate them in one batch
+            random_individuals = [
+                importlib.import_module(
+                    self.individual_type,
+                ).Individual.random(
+                    self.task_api_client,
+                    self.configuration,
+                    self.state_path,
+                )
+                for _ in range(self.configuration['minimum_amount_of_members'] - len(self.members))
+            ]
+            await self.finalize_new_members_operation(random_individuals)
             self.append_to_history()
             self.algorithm_metric_event.notify()
             self.metric_event.notify()
@@ -157,6 +160,15 @@ class Population:
         await individual.evaluate()
         self.members_event.notify()
 
+    async def finalize_new_members_operation(self, individuals: list):
+        self.members.extend(individuals)
+        self.write_to_file()
+        self.members_event.notify()
+        await importlib.import_module(
+            self.individual_type,
+        ).Individual.evaluate_many(individuals)
+        self.members_event.notify()
+
     def write_to_file(self):
         data = {
             'members': [member.id for member in self.members],
@@ -314,13 +326,13 @@ class Population:
 
     async def run(self):
         try:
-            while True:
-                try:
-                    individual = self.loading_queue.pop(0)
-                    await individual.evaluate()
-                    self.members_event.notify()
-                except IndexError:
-                    break
+            if len(self.loading_queue) > 0:
+                loading_individuals = self.loading_queue
+                self.loading_queue = []
+                await importlib.import_module(
+                    self.individual_type,
+                ).Individual.evaluate_many(loading_individuals)
+                self.members_event.notify()
             while True:
                 await self.ensure_minimum_amount_of_members()
                 await self.random_operation()
@@ -1,4 +1,5 @@
 import copy
+import hashlib
 import pathlib
 import random
 import typing
@@ -87,6 +88,9 @@ class Individual(ditef_producer_shared.genetic_individual.AbstractIndividual):
             # Scalar for computational costs in fitness function (suitable for changing online)
             'computational_cost_factor':
             0.000000005,
+            # Worker requirements of evaluations by minimum computational cost, the requirements of the highest
+            # reached minimum apply (e.g. [[1e8, {'resources': {'cpus': 16, 'memory': 32e9}}]])
+            'evaluation_requirements': [],
             # Path to dataset used for fitting
             'train_dataset':
             'data/HULKs/datasets/ball_detection/positives-v1-train.tfrecord',
@@ -395,17 +399,36 @@ class Individual(ditef_producer_shared.genetic_individual.AbstractIndividual):
         self.write_to_file()
         self.update_event.notify()
 
-    async def evaluate(self):
-        self.evaluation_result = await self.task_api_client.run(
-            'ditef_worker_genetic_individual_neuralnet', {
-                'id': self.id,
-                'genome': self.genome,
-                'configuration': self.configuration
-            })
-        self.evaluation_result['computational_cost'] = self.computational_cost(
-        )
-        self.write_to_file()
-        self.update_event.notify()
+    def evaluation_task(self) -> typing.Tuple[str, typing.Any]:
+        return 'ditef_worker_genetic_individual_neuralnet', {
+            'id': self.id,
+            'genome': self.genome,
+            # shared by all individuals of a population, sent once per worker
+            'configuration': self.task_api_client.blob(self.configuration),
+        }
+
+    def evaluation_cost(self) -> typing.Optional[float]:
+        return self.computational_cost()
+
+    def evaluation_requirements(self) -> typing.Optional[dict]:
+        # large architectures are only evaluated by workers with enough resources
+        computational_cost = self.computational_cost()
+        requirements = None
+        for minimum_computational_cost, minimum_requirements in sorted(self.configuration['evaluation_requirements'], key=lambda entry: entry[0]):
+            if computational_cost >= minimum_computational_cost:
+                requirements = minimum_requirements
+        return requirements
+
+    def evaluation_affinity_key(self) -> typing.Optional[str]:
+        # workers which read the datasets before have them in their page cache
+        return hashlib.sha256('\n'.join((
+            self.configuration['train_dataset'],
+            self.configuration['test_dataset'],
+        )).encode()).hexdigest()
+
+    def set_evaluation_result(self, result):
+        result['computational_cost'] = self.computational_cost()
+        super().set_evaluation_result(result)
 
     def fitness(self) -> typing.Optional[float]:
         if self.evaluation_result is None:
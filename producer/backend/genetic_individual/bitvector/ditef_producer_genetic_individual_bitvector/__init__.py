@@ -95,16 +95,14 @@ class Individual(ditef_producer_shared.genetic_individual.AbstractIndividual):
         self.write_to_file()
         self.update_event.notify()
 
-    async def evaluate(self):
-        self.evaluation_result = {
-            'sum': await self.task_api_client.run(
-                'ditef_worker_genetic_individual_bitvector',
-                self.genome,
-            ),
-        }
-        self.write_to_file()
-        self.update_event.notify()
+    def evaluation_task(self) -> typing.Tuple[str, typing.Any]:
+        return 'ditef_worker_genetic_individual_bitvector', self.genome
+
+    def set_evaluation_result(self, result):
+        super().set_evaluation_result({
+            'sum': result,
+        })
 
     def fitness(self) -> typing.Optional[float]:
-        if self.evaluation_result is not None:
+        if self.evaluation_result is not None and 'exception' not in self.evaluation_result:
             return float(self.evaluation_result['sum'])
@@ -113,19 +113,14 @@ class Individual(ditef_producer_shared.genetic_individual.AbstractIndividual):
         self.write_to_file()
         self.update_event.notify()
 
-    async def evaluate(self):
-        self.evaluation_result = await self.task_api_client.run(
-            'ditef_worker_genetic_individual_string',
-            payload={
-                'genome': self.genome,
-                'target_string': self.configuration['target_string'],
-            },
-        )
-        self.write_to_file()
-        self.update_event.notify()
+    def evaluation_task(self) -> typing.Tuple[str, typing.Any]:
+        return 'ditef_worker_genetic_individual_string', {
+            'genome': self.genome,
+            'target_string': self.configuration['target_string'],
+        }
 
     def fitness(self) -> typing.Optional[float]:
         try:
             return self.evaluation_result['correct_characters'] - abs(self.evaluation_result['length_difference']) * 2
-        except TypeError:
+        except (TypeError, KeyError):
             return None
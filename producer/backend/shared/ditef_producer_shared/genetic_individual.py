@@ -108,9 +108,92 @@ class AbstractIndividual(metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    async def evaluate(self):
+    def evaluation_task(self) -> typing.Tuple[str, typing.Any]:
+        '''Returns task type and payload of the evaluation of this individual'''
         pass
 
+    def evaluation_cost(self) -> typing.Optional[float]:
+        '''Returns the estimated cost of the evaluation of this individual, used
+        by cost-aware scheduling policies of the router'''
+        return None
+
+    def evaluation_requirements(self) -> typing.Optional[dict]:
+        '''Returns the resources and labels a worker needs to evaluate this
+        individual ({"resources": {name: minimum amount}, "labels": [...]}),
+        None if any worker may evaluate it'''
+        return None
+
+    def evaluation_affinity_key(self) -> typing.Optional[str]:
+        '''Returns a key of the data read by the evaluation of this individual
+        (e.g. a dataset), workers which read it before are preferred by the
+        router'''
+        return None
+
+    def store_evaluation_result(self, evaluation_result: dict):
+        '''Stores and publishes the evaluation result (or errors) as is,
+        subclasses transform worker results in set_evaluation_result'''
+        self.evaluation_result = evaluation_result
+        self.write_to_file()
+        self.update_event.notify()
+
+    def set_evaluation_result(self, result):
+        self.store_evaluation_result(result)
+
+    def set_evaluation_error(self, error):
+        '''Stores the errors of an evaluation which failed repeatedly on the
+        workers'''
+        self.store_evaluation_result({'exception': error})
+
+    async def evaluate(self):
+        task_type, payload = self.evaluation_task()
+        try:
+            result = await self.task_api_client.run(
+                task_type,
+                payload,
+                estimated_cost=self.evaluation_cost(),
+                requirements=self.evaluation_requirements(),
+                affinity_key=self.evaluation_affinity_key(),
+            )
+        except ditef_router.api_client.TaskFailedError as error:
+            self.set_evaluation_error(error.error)
+            return
+        self.set_evaluation_result(result)
+
+    @staticmethod
+    async def evaluate_many(individuals: typing.List['AbstractIndividual']):
+        '''Evaluates all individuals with one batch request per task type'''
+
+        individuals_of_task_type = {}
+        for individual in individuals:
+            task_type, payload = individual.evaluation_task()
+            individuals_of_task_type.setdefault(task_type, []).append(
+                (individual, payload),
+            )
+        for task_type, individuals_and_payloads in individuals_of_task_type.items():
+            task_api_client = individuals_and_payloads[0][0].task_api_client
+            async for index, result in task_api_client.run_many(
+                task_type,
+                [payload for _, payload in individuals_and_payloads],
+                estimated_costs=[
+                    individual.evaluation_cost()
+                    for individual, _ in individuals_and_payloads
+                ],
+                requirements=[
+                    individual.evaluation_requirements()
+                    for individual, _ in individuals_and_payloads
+                ],
+                affinity_keys=[
+                    individual.evaluation_affinity_key()
+                    for individual, _ in individuals_and_payloads
+                ],
+            ):
+                if isinstance(result, ditef_router.api_client.TaskFailedError):
+                    individuals_and_payloads[index][0].set_evaluation_error(
+                        result.error)
+                else:
+                    individuals_and_payloads[index][0].set_evaluation_result(
+                        result)
+
     @abc.abstractmethod
     def fitness(self) -> typing.Optional[float]:
         pass
@@ -1,15 +1,20 @@
 import aiohttp.web
 import asyncio
 import click
+import math
+import pathlib
 import socket
+import typing
 
-from .api import Api
+from .api import Api, scheduling_policies
 
 
 async def server(**arguments):
-    app = aiohttp.web.Application()
+    app = aiohttp.web.Application(client_max_size=arguments['max_body_size'])
     api = Api(arguments)
     api.add_routes(app)
+    if arguments['journal'] is not None:
+        await api.restore_from_journal(pathlib.Path(arguments['journal']))
 
     runner = aiohttp.web.AppRunner(app)
     await runner.setup()
@@ -48,18 +53,63 @@ async def server(**arguments):
                 60,
             )
 
-    eternity_event = asyncio.Event()
+    background_tasks_task = asyncio.create_task(api.run_background_tasks())
+
     try:
         print('Listening on', ', '.join(str(site.name)
                                         for site in runner.sites), '...')
-        await eternity_event.wait()
+        # runs until the router is stopped or a background task fails (e.g. journal writes)
+        await background_tasks_task
     finally:
+        background_tasks_task.cancel()
+        try:
+            await background_tasks_task
+        except asyncio.CancelledError:
+            pass
         await runner.cleanup()
 
 
+def parse_producer_weights(context: click.Context, parameter: click.Parameter, values: typing.Tuple[str, ...]) -> typing.Dict[str, float]:
+    '''Converts PRODUCER=WEIGHT values to a dict of producer ID -> weight.'''
+
+    weights = {}
+    for value in values:
+        producer_id, separator, weight = value.rpartition('=')
+        try:
+            weights[producer_id] = float(weight)
+            if separator == '' or not 0 < weights[producer_id] < math.inf:
+                raise ValueError
+        except ValueError:
+            raise click.BadParameter(f'{value} is not PRODUCER=WEIGHT with a positive weight')
+    return weights
+
+
 @click.command()
 @click.option('--host', default='*', help='Hostname to listen on', show_default=True)
 @click.option('--port', default=8080, help='Port of the webserver', show_default=True)
-@click.option('--heartbeat-timeout', default=60, help='Heartbeat timeout in seconds', show_default=True)
+@click.option('--max-body-size', default=1024 * 1024, help='Maximum size in bytes of request bodies (payloads and results)', show_default=True)
+@click.option('--heartbeat-timeout', default=60, help='Heartbeat timeout in seconds of workers not requesting a lease duration', show_default=True)
+@click.option('--min-lease-duration', default=1.0, help='Lower bound in seconds of the lease durations requested by workers (leaseDuration), a lease expires like a heartbeat timeout if it is not renewed by a heartbeat', show_default=True)
+@click.option('--max-lease-duration', default=86400.0, help='Upper bound in seconds of the lease durations requested by workers', show_default=True)
+@click.option('--worker-expiry', default=600, help='Time in seconds after which workers which were not seen are removed from the worker registry', show_default=True)
+@click.option('--max-attempts', default=3, help='Failed attempts (reported errors or missed heartbeats) after which a task is moved to the dead letter tasks', show_default=True)
+@click.option('--scheduling-policy', type=click.Choice(list(scheduling_policies.keys())), default='fifo', help='Order in which pending tasks are assigned to workers: first in first out, highest priority, shortest or longest estimated cost first', show_default=True)
+@click.option('--producer-weight', multiple=True, callback=parse_producer_weights, metavar='PRODUCER=WEIGHT', help='Share of the workers of a producer (given by producerId) relative to other producers with pending tasks of the same task type, producers without weight have weight 1 (may be given multiple times)')
+@click.option('--affinity-delay', default=5.0, help='Time in seconds tasks with an affinity key wait for a worker having the key warm before any worker gets them', show_default=True)
+@click.option('--speculation-budget', default=0.0, help='Maximum extra running time in percent of the running time of all other attempts spent on speculative copies of straggling tasks, copies are handed to idle workers and the first result wins (0 disables speculative execution)', show_default=True)
+@click.option('--speculation-factor', default=2.0, help='Tasks which run this many times longer than the 95th percentile of recent runtimes of their task type are straggling', show_default=True)
+@click.option('--max-pending-tasks', default=0, help='Maximum amount of tasks waiting for a worker, submissions of new tasks are rejected with 503 above (0 is unlimited)', show_default=True)
+@click.option('--max-pending-tasks-per-type', default=0, help='Maximum amount of tasks of one task type waiting for a worker (0 is unlimited)', show_default=True)
+@click.option('--max-pending-bytes', default=0, help='Maximum size in bytes of the payloads of tasks waiting for a worker (0 is unlimited)', show_default=True)
+@click.option('--max-pending-bytes-per-type', default=0, help='Maximum size in bytes of the payloads of tasks of one task type waiting for a worker (0 is unlimited)', show_default=True)
+@click.option('--maximum-retry-after', default=60, help='Upper bound in seconds of the Retry-After of rejected submissions', show_default=True)
+@click.option('--result-ttl', default=3600, help='Time in seconds results of submitted tasks are kept for collection', show_default=True)
+@click.option('--peer', multiple=True, help='URL of a peer router to steal pending tasks from while local workers are idle, results are returned to it (may be given multiple times)')
+@click.option('--peer-status-interval', default=2.0, help='Interval in seconds in which the amounts of pending tasks of peer routers are fetched', show_default=True)
+@click.option('--peer-heartbeat-interval', default=20.0, help='Interval in seconds in which tasks stolen from peer routers are heartbeated, must be below the heartbeat timeout of the peers', show_default=True)
+@click.option('--journal', type=click.Path(dir_okay=False), default=None, help='Path of the write-ahead journal of tasks, blobs and results, restored on startup (journaling is disabled if not given)')
+@click.option('--journal-compaction-interval', default=10000, help='Amount of journal records after which the journal is compacted into a snapshot', show_default=True)
+@click.option('--result-cache-size', default=1024, help='Maximum amount of cached results of finished tasks', show_default=True)
+@click.option('--result-cache-bytes', default=64 * 1024 * 1024, help='Maximum size in bytes of cached results of finished tasks', show_default=True)
 def main(**arguments):
     asyncio.run(server(**arguments))
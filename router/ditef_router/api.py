@@ -1,18 +1,151 @@
 import aiohttp.web
 import asyncio
+import functools
+import hashlib
 import json
+import math
+import pathlib
 import re
+import time
 import typing
 import uuid
-from . import multi_queue
+from . import federation, journal, lease_timeouts, metrics, multi_queue, result_cache, speculation, worker_registry
+
+
+class TaskFailedError(Exception):
+    '''Set on the result future of a task which failed too often, body is the
+    JSON error returned to task producers.'''
+
+    def __init__(self, body: bytes):
+        super().__init__(body)
+        self.body = body
 
 
 class Task:
-    def __init__(self, type: str, result_future: asyncio.Future, payload):
+    def __init__(self, type: str, result_future: asyncio.Future, payload: bytes, key: typing.Tuple[str, str], priority: float = 0, estimated_cost: typing.Optional[float] = None, requirements: typing.Optional[dict] = None, affinity_key: typing.Optional[str] = None, producer_id: typing.Optional[str] = None, origin: typing.Optional[typing.Tuple[str, str]] = None):
         self.type = type
         self.result_future = result_future
         self.payload = payload
+        self.priority = priority
+        self.estimated_cost = estimated_cost
+        # {"resources": {name: minimum amount}, "labels": [...]} a worker has
+        # to satisfy, None if any worker may run the task
+        self.requirements = requirements
+        # identifies data the task reads (e.g. a dataset), workers having it
+        # warm are preferred for affinity_delay seconds
+        self.affinity_key = affinity_key
+        # identifies the submitting producer, pending tasks are shared fairly
+        # between producers, None for anonymous producers
+        self.producer_id = producer_id
+        # (peer router URL, task ID at the peer) of tasks stolen from a peer
+        # router, their results are returned to it
+        self.origin = origin
+        # copy of the task launched because it straggled, both attempts share
+        # the result future
+        self.speculative_copy: typing.Optional[Task] = None
+        # task copied by a speculative copy, None for other tasks
+        self.speculated_task: typing.Optional[Task] = None
         self.task_id: typing.Optional[str] = None
+        # ID of the worker the task is assigned to, None for anonymous workers
+        self.worker_id: typing.Optional[str] = None
+        # seconds a heartbeat renews the lease of the running task for,
+        # negotiated by the worker
+        self.lease_duration: typing.Optional[float] = None
+        # identifies duplicate submissions, (task type, idempotency key or payload hash)
+        self.key = key
+        # amount of producer requests and handles waiting for the result
+        self.subscriber_count = 0
+        # lifecycle timestamps (monotonic clock)
+        self.created_time = time.monotonic()
+        self.queued_time = self.created_time
+        self.assigned_time: typing.Optional[float] = None
+        # JSON errors of failed attempts (reported or missed heartbeat)
+        self.errors: typing.List[bytes] = []
+
+
+# rank of tasks without estimated cost in cost-aware scheduling policies
+def estimated_cost_rank(task: Task) -> float:
+    return 0 if task.estimated_cost is None else task.estimated_cost
+
+
+# scheduling policy -> factory of the queues of pending tasks of a task type
+scheduling_policies = {
+    'fifo': multi_queue.FifoQueue,
+    # highest priority first
+    'priority': lambda: multi_queue.PriorityQueue(lambda task: -task.priority),
+    # shortest job first
+    'sjf': lambda: multi_queue.PriorityQueue(estimated_cost_rank),
+    # longest processing time first
+    'lpt': lambda: multi_queue.PriorityQueue(lambda task: -estimated_cost_rank(task)),
+}
+
+
+json_decoder = json.JSONDecoder()
+json_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def split_json_object(text: str) -> typing.Dict[str, bytes]:
+    '''Splits a JSON object into its undecoded values by their keys, values
+    are passed through as opaque bytes. Raises ValueError if the text is no
+    JSON object.'''
+
+    values = {}
+    index = json_whitespace.match(text).end()
+    if text[index:index + 1] != '{':
+        raise ValueError('Expecting object')
+    index = json_whitespace.match(text, index + 1).end()
+    if text[index:index + 1] == '}':
+        index = json_whitespace.match(text, index + 1).end()
+    else:
+        while True:
+            if text[index:index + 1] != '"':
+                raise ValueError('Expecting property name')
+            key, index = json_decoder.raw_decode(text, index)
+            index = json_whitespace.match(text, index).end()
+            if text[index:index + 1] != ':':
+                raise ValueError("Expecting ':' delimiter")
+            index = json_whitespace.match(text, index + 1).end()
+            # values are validated but not kept decoded
+            _, end = json_decoder.raw_decode(text, index)
+            values[key] = text[index:end].encode()
+            index = json_whitespace.match(text, end).end()
+            delimiter = text[index:index + 1]
+            index = json_whitespace.match(text, index + 1).end()
+            if delimiter == '}':
+                break
+            if delimiter != ',':
+                raise ValueError("Expecting ',' delimiter")
+    if index != len(text):
+        raise ValueError('Extra data')
+    return values
+
+
+def split_json_array(text: str) -> typing.List[bytes]:
+    '''Splits a JSON array into its undecoded values like
+    split_json_object. Raises ValueError if the text is no JSON array.'''
+
+    values = []
+    index = json_whitespace.match(text).end()
+    if text[index:index + 1] != '[':
+        raise ValueError('Expecting array')
+    index = json_whitespace.match(text, index + 1).end()
+    if text[index:index + 1] == ']':
+        index = json_whitespace.match(text, index + 1).end()
+    else:
+        while True:
+            # values are validated but not kept decoded
+            _, end = json_decoder.raw_decode(text, index)
+            values.append(text[index:end].encode())
+            index = json_whitespace.match(text, end).end()
+            delimiter = text[index:index + 1]
+            index = json_whitespace.match(text, index + 1).end()
+            if delimiter == ']':
+                break
+            if delimiter != ',':
+                raise ValueError("Expecting ',' delimiter")
+    if index != len(text):
+        raise ValueError('Extra data')
+    return values
 
 
 class Api:
@@ -20,22 +153,355 @@ class Api:
     def __init__(self, arguments: dict):
         self.arguments = arguments
 
-        # queued tasks from the task producer (not assigned to any worker)
-        self.pending_tasks = multi_queue.MultiQueue()
+        # queued tasks from the task producer (not assigned to any worker),
+        # tasks of a task type are shared between the producers by deficit
+        # round robin and ordered by the scheduling policy per producer
+        self.pending_tasks = multi_queue.MultiQueue(
+            lambda: multi_queue.FairQueue(
+                lambda task: task.producer_id,
+                self.producer_weight,
+                scheduling_policies[self.arguments['scheduling_policy']],
+            ),
+            maxsize=self.arguments['max_pending_tasks'],
+            maxbytes=self.arguments['max_pending_bytes'],
+            maxsize_per_type=self.arguments['max_pending_tasks_per_type'],
+            maxbytes_per_type=self.arguments['max_pending_bytes_per_type'],
+            item_size=lambda task: len(task.payload),
+        )
 
         # tasks assigned to workers, assigned task ID -> task (future, ...)
         self.running_tasks = {}
 
+        # heartbeat deadlines of running tasks, keyed by assigned task ID
+        self.heartbeat_timeouts = lease_timeouts.LeaseTimeouts(
+            self.requeue_timed_out_tasks,
+        )
+
+        # IDs of running tasks removed because their producers cancelled,
+        # kept for one heartbeat timeout to tell their workers to abort
+        self.cancelled_tasks = lease_timeouts.LeaseTimeouts(
+            lambda task_ids: None,
+        )
+
+        # content-addressed sub-documents of payloads, SHA-256 hex digest -> JSON bytes
+        self.blobs = {}
+
+        # tasks without result, task key -> task shared by duplicate submissions
+        self.in_flight_tasks = {}
+
+        # results of finished tasks, task key -> JSON bytes
+        self.result_cache = result_cache.ResultCache(
+            self.arguments['result_cache_size'],
+            self.arguments['result_cache_bytes'],
+        )
+
+        # asynchronously submitted tasks without result, handle -> task
+        self.submitted_tasks = {}
+
+        # results of submitted tasks until their TTL expires, handle -> JSON bytes
+        self.submitted_results = {}
+        # errors of failed submitted tasks until their TTL expires, handle -> JSON bytes
+        self.submitted_errors = {}
+        self.submitted_result_timeouts = lease_timeouts.LeaseTimeouts(
+            self.drop_expired_submitted_results,
+        )
+
+        # tasks which failed max_attempts times, task ID of last attempt -> task
+        self.dead_letter_tasks = {}
+
+        # workers identified by their workerId, not journaled
+        self.workers = worker_registry.WorkerRegistry(
+            self.arguments['worker_expiry'],
+        )
+
+        # write-ahead log of state changes, None if journaling is disabled
+        self.journal: typing.Optional[journal.Journal] = None
+
+        # work stealing from peer routers, None if no peers are given
+        self.federation: typing.Optional[federation.Federation] = None
+        if len(self.arguments['peer']) > 0:
+            self.federation = federation.Federation(self)
+
+        # speculative execution of stragglers, None if disabled
+        self.speculation: typing.Optional[speculation.Speculation] = None
+        if self.arguments['speculation_budget'] > 0:
+            self.speculation = speculation.Speculation(self)
+
+        # counters and histograms per task type
+        self.metrics = metrics.Metrics()
+
+    async def run_background_tasks(self):
+        '''Runs the sweepers of heartbeat and result timeouts and the journal
+        writer.'''
+
+        background_tasks = [
+            self.heartbeat_timeouts.run(),
+            self.cancelled_tasks.run(),
+            self.submitted_result_timeouts.run(),
+            self.workers.run(),
+        ]
+        if self.journal is not None:
+            background_tasks.append(self.journal.run(self.snapshot_records))
+        if self.federation is not None:
+            background_tasks.append(self.federation.run())
+        if self.speculation is not None:
+            background_tasks.append(self.speculation.run())
+        await asyncio.gather(*background_tasks)
+
+    def journal_append(self, record: dict, raw_values: typing.Dict[str, bytes] = {}):
+        if self.journal is not None:
+            self.journal.append(journal.encode_record(record, raw_values))
+
+    async def journal_commit(self):
+        '''Waits until all state changes are durable.'''
+
+        if self.journal is not None:
+            await self.journal.commit()
+
+    async def restore_from_journal(self, path: pathlib.Path):
+        '''Restores the state from snapshot and journal at the given path and
+        starts journaling.'''
+
+        state_journal = journal.Journal(
+            path,
+            self.arguments['journal_compaction_interval'],
+        )
+        for record in state_journal.read():
+            self.replay_record(record)
+            # done callbacks of result futures run before the next record
+            await asyncio.sleep(0)
+        state_journal.write_snapshot(self.snapshot_records())
+        self.journal = state_journal
+
+    def replay_record(self, record: dict):
+        operation = record['op']
+        if operation == 'blob':
+            self.blobs[record['hash']] = record['blob'].encode()
+            return
+        if operation == 'handleResult':
+            self.store_submitted_result_value(
+                record['handle'],
+                self.encode_json_value(record['result']),
+            )
+            return
+        if operation == 'handleError':
+            self.store_submitted_error(
+                record['handle'],
+                self.encode_json_value(record['error']),
+            )
+            return
+        if operation == 'deadLetter':
+            task = Task(
+                type=record['taskType'],
+                result_future=asyncio.Future(),
+                payload=self.encode_json_value(record['payload']),
+                key=tuple(record['key']),
+            )
+            task.task_id = record['taskId']
+            task.errors = [
+                self.encode_json_value(error)
+                for error in record['errors']
+            ]
+            task.result_future.cancel()
+            self.dead_letter_tasks[task.task_id] = task
+            return
+        if operation == 'dropDeadLetter':
+            self.drop_dead_letter_task(record['taskId'])
+            return
+        if operation == 'cancelHandle':
+            self.cancel_submitted_task(record['handle'])
+            return
+        if operation == 'dropResult':
+            self.drop_submitted_result(record['handle'])
+            return
+
+        key = tuple(record['key'])
+        if operation == 'task':
+            self.create_task(
+                record['taskType'],
+                self.encode_json_value(record['payload']),
+                key,
+                record['priority'],
+                record['estimatedCost'],
+                record.get('requirements'),
+                record.get('affinityKey'),
+                record.get('producerId'),
+                None if record.get('origin') is None else tuple(record['origin']),
+            )
+            return
+        if operation == 'cache':
+            self.result_cache[key] = self.encode_json_value(record['result'])
+            return
+
+        try:
+            task: Task = self.in_flight_tasks[key]
+        except KeyError:
+            if operation == 'handle' and key in self.result_cache.results:
+                # task finished after the handle was created
+                self.store_submitted_result_value(
+                    record['handle'],
+                    self.result_cache[key],
+                )
+            return
+        if operation == 'handle':
+            task.subscriber_count += 1
+            self.add_submitted_task(record['handle'], task)
+        elif operation == 'assign':
+            try:
+                self.pending_tasks.remove(task.type, task)
+            except ValueError:
+                pass
+            self.assign_task(
+                task, record['taskId'], lease_duration=record.get('leaseDuration'))
+        elif operation == 'requeue':
+            if self.running_tasks.get(task.task_id) is task:
+                self.requeue_running_task(task.task_id)
+        elif operation == 'attempt':
+            task.errors.append(self.encode_json_value(record['error']))
+        elif operation == 'error':
+            if self.running_tasks.get(task.task_id) is task:
+                self.fail_running_task(
+                    task.task_id,
+                    self.encode_json_value(record['error']),
+                )
+        elif operation == 'complete':
+            self.complete_running_task(
+                task.task_id,
+                self.encode_json_value(record['result']),
+            )
+        elif operation == 'remove':
+            del self.in_flight_tasks[key]
+            self.remove_task(task)
+
+    def snapshot_records(self) -> typing.Iterator[bytes]:
+        '''Yields journal records restoring the current state.'''
+
+        for blob_hash, blob in self.blobs.items():
+            yield journal.encode_record(self.blob_record(blob_hash, blob))
+        for key, result in self.result_cache.results.items():
+            yield journal.encode_record(
+                {'op': 'cache', 'key': key},
+                {'result': result},
+            )
+
+        # pending tasks in queue order, then tasks handed off or running
+        tasks = dict.fromkeys(
+            task
+            for _, task in self.pending_tasks.items()
+            if task.speculated_task is None
+        )
+        tasks.update(dict.fromkeys(self.in_flight_tasks.values()))
+        for task in tasks:
+            # done callbacks of finished tasks may not have run yet
+            if task.result_future.done():
+                if self.has_result(task.result_future):
+                    yield journal.encode_record(
+                        {'op': 'cache', 'key': task.key},
+                        {'result': task.result_future.result()},
+                    )
+                continue
+            yield self.task_record(task)
+            # failed attempts count towards max_attempts after restoring
+            for error in task.errors:
+                yield journal.encode_record(
+                    {'op': 'attempt', 'key': task.key},
+                    {'error': error},
+                )
+            if self.running_tasks.get(task.task_id) is task:
+                yield journal.encode_record(
+                    {'op': 'assign', 'key': task.key, 'taskId': task.task_id, 'leaseDuration': task.lease_duration},
+                )
+
+        for handle, task in self.submitted_tasks.items():
+            if not task.result_future.done():
+                yield journal.encode_record(
+                    {'op': 'handle', 'handle': handle, 'key': task.key},
+                )
+            elif self.has_result(task.result_future):
+                yield journal.encode_record(
+                    {'op': 'handleResult', 'handle': handle},
+                    {'result': task.result_future.result()},
+                )
+            elif not task.result_future.cancelled():
+                yield journal.encode_record(
+                    {'op': 'handleError', 'handle': handle},
+                    {'error': task.result_future.exception().body},
+                )
+        for handle, result in self.submitted_results.items():
+            yield journal.encode_record(
+                {'op': 'handleResult', 'handle': handle},
+                {'result': result},
+            )
+        for handle, error in self.submitted_errors.items():
+            yield journal.encode_record(
+                {'op': 'handleError', 'handle': handle},
+                {'error': error},
+            )
+
+        for task in self.dead_letter_tasks.values():
+            yield journal.encode_record(
+                {
+                    'op': 'deadLetter',
+                    'key': task.key,
+                    'taskType': task.type,
+                    'taskId': task.task_id,
+                },
+                {
+                    'payload': task.payload,
+                    'errors': b'[' + b','.join(task.errors) + b']',
+                },
+            )
+
+    def blob_record(self, blob_hash: str, blob: bytes) -> dict:
+        # blobs are stored as string to keep them byte-identical to their hash
+        return {'op': 'blob', 'hash': blob_hash, 'blob': blob.decode()}
+
+    def task_record(self, task: Task) -> bytes:
+        return journal.encode_record(
+            {
+                'op': 'task',
+                'key': task.key,
+                'taskType': task.type,
+                'priority': task.priority,
+                'estimatedCost': task.estimated_cost,
+                'requirements': task.requirements,
+                'affinityKey': task.affinity_key,
+                'producerId': task.producer_id,
+                'origin': task.origin,
+            },
+            {'payload': task.payload},
+        )
+
     def add_routes(self, app: aiohttp.web.Application):
         app.add_routes([
             aiohttp.web.post(
                 '/task/run',
                 self.handle_task_run,
             ),
+            aiohttp.web.post(
+                '/task/run_batch',
+                self.handle_task_run_batch,
+            ),
+            aiohttp.web.post(
+                '/task/submit',
+                self.handle_task_submit,
+            ),
+            aiohttp.web.post(
+                '/task/cancel',
+                self.handle_task_cancel,
+            ),
+            aiohttp.web.post(
+                '/result/wait',
+                self.handle_result_wait,
+            ),
             aiohttp.web.get(
                 '/task/get',
                 self.handle_task_get,
             ),
+            aiohttp.web.post(
+                '/task/release',
+                self.handle_task_release,
+            ),
             aiohttp.web.post(
                 '/task/heartbeat',
                 self.handle_task_heartbeat,
@@ -44,11 +510,131 @@ class Api:
                 '/result/set',
                 self.handle_result_set,
             ),
+            aiohttp.web.post(
+                '/result/set_batch',
+                self.handle_result_set_batch,
+            ),
+            aiohttp.web.post(
+                '/result/set_and_get',
+                self.handle_result_set_and_task_get,
+            ),
+            aiohttp.web.post(
+                '/result/error',
+                self.handle_result_error,
+            ),
+            aiohttp.web.get(
+                '/dead_letter/list',
+                self.handle_dead_letter_list,
+            ),
+            aiohttp.web.post(
+                '/dead_letter/drop',
+                self.handle_dead_letter_drop,
+            ),
+            aiohttp.web.post(
+                '/blob/set',
+                self.handle_blob_set,
+            ),
+            aiohttp.web.get(
+                '/blob/get',
+                self.handle_blob_get,
+            ),
+            aiohttp.web.get(
+                '/worker/websocket',
+                self.handle_worker_websocket,
+            ),
+            aiohttp.web.post(
+                '/worker/register',
+                self.handle_worker_register,
+            ),
+            aiohttp.web.get(
+                '/workers',
+                self.handle_workers,
+            ),
+            aiohttp.web.get(
+                '/peer/status',
+                self.handle_peer_status,
+            ),
+            aiohttp.web.get(
+                '/peer/steal',
+                self.handle_peer_steal,
+            ),
+            aiohttp.web.get(
+                '/metrics',
+                self.handle_metrics,
+            ),
         ])
 
+    def new_id(self) -> str:
+        '''Random ID of a task lease or submitted task.'''
+
+        return str(uuid.uuid4())
+
     def json_formatter(self, data):
         return json.dumps(data, sort_keys=True, indent=4)
 
+    def encode_json_value(self, data) -> bytes:
+        '''Encodes a decoded JSON value compactly for splicing it into
+        responses.'''
+
+        return json.dumps(data, separators=(',', ':')).encode()
+
+    async def read_json_value(self, request: aiohttp.web.Request) -> bytes:
+        '''Reads an undecoded JSON value (payload or result) from the request
+        body. Payloads and results are passed through the router as opaque
+        bytes, they are only validated once here since they are spliced into
+        the responses of workers and producers.'''
+
+        body = await request.read()
+        if len(body.strip()) == 0:
+            raise aiohttp.web.HTTPBadRequest(reason='Missing body')
+        try:
+            json.loads(body)
+        except ValueError:
+            raise aiohttp.web.HTTPBadRequest(reason='Malformed JSON body')
+        return body
+
+    async def read_json_values(self, request: aiohttp.web.Request) -> typing.Dict[str, bytes]:
+        '''Reads a JSON object of undecoded JSON values (e.g. task ID ->
+        result) from the request body. The values are passed through like
+        the ones read by read_json_value.'''
+
+        body = await request.read()
+        try:
+            return split_json_object(body.decode())
+        except ValueError:
+            raise aiohttp.web.HTTPBadRequest(reason='Results are not an object')
+
+    async def read_json(self, request: aiohttp.web.Request):
+        '''Reads and decodes a JSON request body (e.g. a list of task IDs).'''
+
+        try:
+            return json.loads(await request.read())
+        except ValueError:
+            raise aiohttp.web.HTTPBadRequest(reason='Malformed JSON body')
+
+    def has_result(self, result_future: asyncio.Future) -> bool:
+        '''Whether a result future is resolved with a result (neither
+        cancelled nor failed).'''
+
+        return (
+            result_future.done()
+            and not result_future.cancelled()
+            and result_future.exception() is None
+        )
+
+    def task_response_body(self, task: Task) -> bytes:
+        return b''.join((
+            b'{"taskType":',
+            self.encode_json_value(task.type),
+            b',"taskId":',
+            self.encode_json_value(task.task_id),
+            b',"leaseDuration":',
+            self.encode_json_value(task.lease_duration),
+            b',"payload":',
+            task.payload,
+            b'}',
+        ))
+
     async def handle_task_run(self, request: aiohttp.web.Request):
         '''Task Producer -> Router'''
 
@@ -57,45 +643,725 @@ class Api:
             task_type = request.query['taskType']
         except KeyError:
             raise aiohttp.web.HTTPBadRequest(reason='Missing taskType')
+        priority, estimated_costs = self.parse_scheduling_parameters(request)
+        requirements = self.parse_requirements(request)
+        affinity_keys = self.parse_affinity_keys(request)
+        task = self.subscribe_task(
+            task_type,
+            await self.read_json_value(request),
+            request.headers.get('Idempotency-Key'),
+            priority,
+            estimated_costs[0],
+            requirements[0],
+            affinity_keys[0],
+            request.query.get('producerId'),
+        )
+
+        try:
+            # wait for result and return it
+            return aiohttp.web.Response(
+                body=await asyncio.shield(task.result_future),
+                content_type='application/json',
+            )
+        except TaskFailedError as error:
+            return aiohttp.web.Response(
+                status=422,
+                reason='Task failed',
+                body=error.body,
+                content_type='application/json',
+            )
+        except asyncio.CancelledError:
+            self.unsubscribe_task(task)
+
+    async def handle_task_run_batch(self, request: aiohttp.web.Request):
+        '''Task Producer -> Router'''
+
+        # create tasks from request
+        try:
+            task_type = request.query['taskType']
+        except KeyError:
+            raise aiohttp.web.HTTPBadRequest(reason='Missing taskType')
+        # payloads are passed through like the one of /task/run
+        try:
+            payloads = split_json_array((await request.read()).decode())
+        except ValueError:
+            raise aiohttp.web.HTTPBadRequest(reason='Payloads are not a list')
+        priority, estimated_costs = self.parse_scheduling_parameters(
+            request, len(payloads))
+        requirements = self.parse_requirements(request, len(payloads))
+        affinity_keys = self.parse_affinity_keys(request, len(payloads))
+        tasks = []
+        try:
+            for payload, estimated_cost, task_requirements, affinity_key in zip(payloads, estimated_costs, requirements, affinity_keys):
+                tasks.append(self.subscribe_task(
+                    task_type,
+                    payload,
+                    priority=priority,
+                    estimated_cost=estimated_cost,
+                    requirements=task_requirements,
+                    affinity_key=affinity_key,
+                    producer_id=request.query.get('producerId'),
+                ))
+        except aiohttp.web.HTTPException:
+            # batches are admitted completely or not at all
+            for task in tasks:
+                self.unsubscribe_task(task)
+            raise
+
+        # result future -> indices of tasks in request (duplicates share futures)
+        pending_futures = {}
+        for index, task in enumerate(tasks):
+            pending_futures.setdefault(task.result_future, []).append(index)
+        try:
+            # stream results as newline delimited JSON in completion order
+            response = aiohttp.web.StreamResponse(
+                headers={'Content-Type': 'application/x-ndjson'},
+            )
+            await response.prepare(request)
+            while len(pending_futures) > 0:
+                done_futures, _ = await asyncio.wait(
+                    pending_futures.keys(),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for done_future in done_futures:
+                    indices = pending_futures.pop(done_future)
+                    if done_future.exception() is None:
+                        field, value = b'result', done_future.result()
+                    else:
+                        field, value = b'error', done_future.exception().body
+                    # newlines in JSON can only be whitespace between tokens
+                    value = value.replace(b'\n', b' ').replace(b'\r', b' ')
+                    await response.write(b''.join(
+                        b'{"index":%d,"%s":%s}\n' % (index, field, value)
+                        for index in indices
+                    ))
+            await response.write_eof()
+            return response
+        except asyncio.CancelledError:
+            for indices in list(pending_futures.values()):
+                for index in indices:
+                    self.unsubscribe_task(tasks[index])
+
+    async def handle_task_submit(self, request: aiohttp.web.Request):
+        '''Task Producer -> Router'''
+
+        # create task from request
+        try:
+            task_type = request.query['taskType']
+        except KeyError:
+            raise aiohttp.web.HTTPBadRequest(reason='Missing taskType')
+        priority, estimated_costs = self.parse_scheduling_parameters(request)
+        requirements = self.parse_requirements(request)
+        affinity_keys = self.parse_affinity_keys(request)
+        task = self.subscribe_task(
+            task_type,
+            await self.read_json_value(request),
+            request.headers.get('Idempotency-Key'),
+            priority,
+            estimated_costs[0],
+            requirements[0],
+            affinity_keys[0],
+            request.query.get('producerId'),
+        )
+
+        # the handle identifies the task until its result is collected
+        handle = self.new_id()
+        self.add_submitted_task(handle, task)
+        self.journal_append({'op': 'handle', 'handle': handle, 'key': task.key})
+        await self.journal_commit()
+
+        return aiohttp.web.json_response(
+            {
+                'handle': handle,
+            },
+            dumps=self.json_formatter,
+        )
+
+    def add_submitted_task(self, handle: str, task: Task):
+        self.submitted_tasks[handle] = task
+        task.result_future.add_done_callback(
+            functools.partial(self.store_submitted_result, handle),
+        )
+
+    def store_submitted_result(self, handle: str, result_future: asyncio.Future):
+        try:
+            del self.submitted_tasks[handle]
+        except KeyError:
+            return
+        if result_future.cancelled():
+            return
+        if result_future.exception() is not None:
+            self.store_submitted_error(handle, result_future.exception().body)
+            return
+        self.store_submitted_result_value(handle, result_future.result())
+
+    def store_submitted_result_value(self, handle: str, result: bytes):
+        self.submitted_results[handle] = result
+        self.submitted_result_timeouts.add(
+            handle,
+            self.arguments['result_ttl'],
+        )
+
+    def store_submitted_error(self, handle: str, error: bytes):
+        self.submitted_errors[handle] = error
+        self.submitted_result_timeouts.add(
+            handle,
+            self.arguments['result_ttl'],
+        )
+
+    def drop_submitted_result(self, handle: str):
+        if self.submitted_results.pop(handle, None) is None and self.submitted_errors.pop(handle, None) is None:
+            return
+        self.submitted_result_timeouts.remove(handle)
+        self.journal_append({'op': 'dropResult', 'handle': handle})
+
+    def cancel_submitted_task(self, handle: str):
+        try:
+            task: Task = self.submitted_tasks.pop(handle)
+        except KeyError:
+            # task already finished or unknown
+            self.drop_submitted_result(handle)
+            return
+        self.journal_append({'op': 'cancelHandle', 'handle': handle})
+        self.unsubscribe_task(task)
+
+    def drop_expired_submitted_results(self, handles: typing.List[str]):
+        for handle in handles:
+            self.submitted_results.pop(handle, None)
+            self.submitted_errors.pop(handle, None)
+
+    async def read_handles(self, request: aiohttp.web.Request) -> typing.List[str]:
+        handles = await self.read_json(request)
+        if not isinstance(handles, list) or not all(isinstance(handle, str) for handle in handles):
+            raise aiohttp.web.HTTPBadRequest(reason='Handles are not a list')
+        return handles
+
+    async def handle_task_cancel(self, request: aiohttp.web.Request):
+        '''Task Producer -> Router'''
+
+        for handle in await self.read_handles(request):
+            self.cancel_submitted_task(handle)
+        await self.journal_commit()
+
+        raise aiohttp.web.HTTPOk()
+
+    async def handle_result_wait(self, request: aiohttp.web.Request):
+        '''Task Producer -> Router'''
+
+        timeout = self.parse_prefer_wait(request)
+        body = await self.read_json(request)
+        try:
+            handles = body['handles']
+            collected_handles = body.get('collected', [])
+        except (TypeError, KeyError):
+            raise aiohttp.web.HTTPBadRequest(reason='Missing handles')
+        if not all(
+            isinstance(value, list) and all(isinstance(handle, str) for handle in value)
+            for value in (handles, collected_handles)
+        ):
+            raise aiohttp.web.HTTPBadRequest(reason='Handles are not a list')
+
+        # results acknowledged by the producer are not kept any longer
+        for handle in collected_handles:
+            self.drop_submitted_result(handle)
+
+        # wait until at least one of the results is available
+        pending_futures = [
+            self.submitted_tasks[handle].result_future
+            for handle in handles
+            if handle in self.submitted_tasks
+        ]
+        if 0 < len(pending_futures) == len(handles):
+            await asyncio.wait(
+                pending_futures,
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+        # collect available results and errors of failed tasks, both stay
+        # available until their TTL expires
+        results = []
+        errors = []
+        unknown_handles = []
+        for handle in handles:
+            if handle in self.submitted_results:
+                results.append((handle, self.submitted_results[handle]))
+            elif handle in self.submitted_errors:
+                errors.append((handle, self.submitted_errors[handle]))
+            elif handle not in self.submitted_tasks:
+                unknown_handles.append(handle)
+        if len(results) == 0 and len(errors) == 0 and len(unknown_handles) == 0:
+            raise aiohttp.web.HTTPNoContent(
+                reason='Prefer timeout before result availability')
+
+        # results are spliced into the response
+        return aiohttp.web.Response(
+            body=b''.join((
+                b'{"results":{',
+                b','.join(
+                    self.encode_json_value(handle) + b':' + result
+                    for handle, result in results
+                ),
+                b'},"errors":{',
+                b','.join(
+                    self.encode_json_value(handle) + b':' + error
+                    for handle, error in errors
+                ),
+                b'},"unknownHandles":',
+                self.encode_json_value(unknown_handles),
+                b'}',
+            )),
+            content_type='application/json',
+        )
+
+    def parse_scheduling_parameters(self, request: aiohttp.web.Request, count: int = 1) -> typing.Tuple[float, typing.List[typing.Optional[float]]]:
+        '''Extracts the priority and the estimated costs of count tasks from a
+        request of a task producer. Either one estimatedCost for all tasks or
+        one per task may be given.'''
+
+        try:
+            priority = float(request.query.get('priority', 0))
+            if not math.isfinite(priority):
+                raise ValueError
+        except ValueError:
+            raise aiohttp.web.HTTPBadRequest(reason='Malformed priority')
+        try:
+            estimated_costs = [
+                float(estimated_cost)
+                for estimated_cost in request.query.getall('estimatedCost', [])
+            ]
+            if not all(math.isfinite(estimated_cost) for estimated_cost in estimated_costs):
+                raise ValueError
+        except ValueError:
+            raise aiohttp.web.HTTPBadRequest(reason='Malformed estimatedCost')
+        if len(estimated_costs) == 0:
+            estimated_costs = [None] * count
+        elif len(estimated_costs) == 1:
+            estimated_costs = estimated_costs * count
+        elif len(estimated_costs) != count:
+            raise aiohttp.web.HTTPBadRequest(
+                reason='Amount of estimatedCost does not match amount of tasks')
+        return priority, estimated_costs
+
+    def parse_requirements(self, request: aiohttp.web.Request, count: int = 1) -> typing.List[typing.Optional[dict]]:
+        '''Extracts the requirements of count tasks from a request of a task
+        producer. Requirements are given as JSON {"resources": {name: minimum
+        amount}, "labels": [...]} or null, either one for all tasks or one per
+        task may be given.'''
+
+        try:
+            requirements = [
+                self.normalize_requirements(json.loads(task_requirements))
+                for task_requirements in request.query.getall('requirements', [])
+            ]
+        except (ValueError, TypeError, AttributeError):
+            raise aiohttp.web.HTTPBadRequest(reason='Malformed requirements')
+        if len(requirements) == 0:
+            return [None] * count
+        if len(requirements) == 1:
+            return requirements * count
+        if len(requirements) != count:
+            raise aiohttp.web.HTTPBadRequest(
+                reason='Amount of requirements does not match amount of tasks')
+        return requirements
+
+    def normalize_requirements(self, requirements) -> typing.Optional[dict]:
+        '''Validates requirements, missing fields are filled in. Returns None
+        for null or empty requirements.'''
+
+        if requirements is None:
+            return None
+        resources = requirements.get('resources', {})
+        labels = requirements.get('labels', [])
+        if not (
+            set(requirements.keys()) <= {'resources', 'labels'}
+            and isinstance(resources, dict)
+            and all(isinstance(amount, (int, float)) and math.isfinite(amount) for amount in resources.values())
+            and isinstance(labels, list)
+            and all(isinstance(label, str) for label in labels)
+        ):
+            raise TypeError
+        if len(resources) == 0 and len(labels) == 0:
+            return None
+        return {'resources': resources, 'labels': labels}
+
+    def parse_affinity_keys(self, request: aiohttp.web.Request, count: int = 1) -> typing.List[typing.Optional[str]]:
+        '''Extracts the affinity keys of count tasks from a request of a task
+        producer. Either one affinityKey for all tasks or one per task may be
+        given, empty keys mean no affinity.'''
+
+        affinity_keys = [
+            affinity_key if len(affinity_key) > 0 else None
+            for affinity_key in request.query.getall('affinityKey', [])
+        ]
+        if len(affinity_keys) == 0:
+            return [None] * count
+        if len(affinity_keys) == 1:
+            return affinity_keys * count
+        if len(affinity_keys) != count:
+            raise aiohttp.web.HTTPBadRequest(
+                reason='Amount of affinityKey does not match amount of tasks')
+        return affinity_keys
+
+    def subscribe_task(self, task_type: str, payload: bytes, idempotency_key: typing.Optional[str] = None, priority: float = 0, estimated_cost: typing.Optional[float] = None, requirements: typing.Optional[dict] = None, affinity_key: typing.Optional[str] = None, producer_id: typing.Optional[str] = None) -> Task:
+        '''Returns the task evaluating the payload. Submissions with the same
+        idempotency key (or the same payload if no key is given) share one
+        task while it is in flight and are served from the result cache
+        afterwards.'''
+
+        if idempotency_key is None:
+            key = (task_type, 'sha256:' + hashlib.sha256(payload).hexdigest())
+        else:
+            key = (task_type, 'key:' + idempotency_key)
+
+        task_type_metrics = self.metrics[task_type]
+        try:
+            task: Task = self.in_flight_tasks[key]
+            task_type_metrics.coalesced_tasks += 1
+        except KeyError:
+            try:
+                result = self.result_cache[key]
+            except KeyError:
+                task = self.create_task(
+                    task_type, payload, key, priority, estimated_cost, requirements, affinity_key, producer_id, admit=True)
+            else:
+                task_type_metrics.cached_results += 1
+                task = Task(
+                    type=task_type,
+                    result_future=asyncio.Future(),
+                    payload=payload,
+                    key=key,
+                )
+                task.result_future.set_result(result)
+
+        # rejected submissions are counted by admit_task
+        task_type_metrics.submitted_tasks += 1
+        task.subscriber_count += 1
+        return task
+
+    def admit_task(self, task: Task):
+        '''Rejects a new task if the pending tasks would exceed their limits.
+        Retry-After estimates when the pending tasks drained far enough from
+        the recent completion rate.'''
+
+        for maxbytes in (self.arguments['max_pending_bytes'], self.arguments['max_pending_bytes_per_type']):
+            if 0 < maxbytes < len(task.payload):
+                self.metrics[task.type].rejected_tasks += 1
+                raise aiohttp.web.HTTPRequestEntityTooLarge(
+                    maxbytes,
+                    len(task.payload),
+                    reason='Payload exceeds pending bytes limit',
+                )
+
+        type_overflow, overflow = self.pending_tasks.overflow(task.type, task)
+        if type_overflow == 0 and overflow == 0:
+            return
+        task_type_metrics = self.metrics[task.type]
+        task_type_metrics.rejected_tasks += 1
+        retry_after = max(
+            self.drain_time(type_overflow, task_type_metrics.service_rate),
+            self.drain_time(overflow, self.metrics.service_rate),
+        )
+        raise aiohttp.web.HTTPServiceUnavailable(
+            reason='Too many pending tasks',
+            headers={'Retry-After': str(retry_after)},
+        )
+
+    def drain_time(self, count: int, service_rate: metrics.ServiceRate) -> int:
+        '''Estimates the seconds until count tasks completed.'''
+
+        if count == 0:
+            return 0
+        maximum_retry_after = self.arguments['maximum_retry_after']
+        rate = service_rate.rate()
+        if rate == 0:
+            return maximum_retry_after
+        return min(max(math.ceil(count / rate), 1), maximum_retry_after)
+
+    def producer_weight(self, producer_id: typing.Optional[str]) -> float:
+        '''Share of the workers a producer gets relative to other producers
+        with pending tasks of the same task type.'''
+
+        return self.arguments['producer_weight'].get(producer_id, 1)
+
+    def create_task(self, task_type: str, payload: bytes, key: typing.Tuple[str, str], priority: float, estimated_cost: typing.Optional[float], requirements: typing.Optional[dict] = None, affinity_key: typing.Optional[str] = None, producer_id: typing.Optional[str] = None, origin: typing.Optional[typing.Tuple[str, str]] = None, admit: bool = False) -> Task:
+        '''Creates an in-flight task and puts it in the pending task queue.
+        With admit the task is rejected if the pending tasks would exceed
+        their limits (see admit_task).'''
+
         task = Task(
             type=task_type,
             result_future=asyncio.Future(),
-            payload=await request.json(),
+            payload=payload,
+            key=key,
+            priority=priority,
+            estimated_cost=estimated_cost,
+            requirements=requirements,
+            affinity_key=affinity_key,
+            producer_id=producer_id,
+            origin=origin,
         )
+        if admit:
+            self.admit_task(task)
+        self.in_flight_tasks[key] = task
+        task.result_future.add_done_callback(
+            functools.partial(self.finish_in_flight_task, task),
+        )
+        if origin is not None and self.federation is not None:
+            task.result_future.add_done_callback(
+                functools.partial(self.federation.return_result, task),
+            )
+        self.push_pending_task(task)
+        if self.journal is not None:
+            self.journal.append(self.task_record(task))
+        return task
+
+    def finish_in_flight_task(self, task: Task, result_future: asyncio.Future):
+        if self.in_flight_tasks.get(task.key) is task:
+            del self.in_flight_tasks[task.key]
+        # failures are not cached, a later submission tries again, results of
+        # stolen tasks are returned to their origin only
+        if self.has_result(result_future) and task.origin is None:
+            self.result_cache[task.key] = result_future.result()
 
+    def unsubscribe_task(self, task: Task):
+        '''Removes a task once no producer waits for its result any longer.'''
+
+        task.subscriber_count -= 1
+        if task.subscriber_count > 0 or task.result_future.done():
+            return
+        # later duplicates must not attach to the removed task
+        if self.in_flight_tasks.get(task.key) is task:
+            del self.in_flight_tasks[task.key]
+            self.journal_append({'op': 'remove', 'key': task.key})
+        self.metrics[task.type].removed_tasks += 1
+        self.remove_task(task)
+
+    def remove_task(self, task: Task):
+        '''Removes a task whose producer request got cancelled from the
+        pending or running tasks.'''
+
+        task.result_future.cancel()
         try:
-            # put task in pending task queue
-            self.pending_tasks.push(task.type, task)
+            self.pending_tasks.remove(task.type, task)
+            return
+        except ValueError:
+            pass
+        # both attempts of a task executed speculatively are aborted
+        for attempt in (task, task.speculative_copy):
+            if attempt is not None and self.running_tasks.get(attempt.task_id) is attempt:
+                self.abort_running_task(attempt)
 
-            # wait for result and return it
-            return aiohttp.web.json_response(
-                await task.result_future,
-                dumps=self.json_formatter,
+    def pop_running_task(self, task_id: str) -> Task:
+        '''Removes a running task and stops its heartbeat timeout. Raises
+        KeyError if no task with the given ID is running.'''
+
+        task: Task = self.running_tasks.pop(task_id)
+        self.heartbeat_timeouts.remove(task_id)
+        if self.speculation is not None:
+            self.speculation.account(task, time.monotonic() - task.assigned_time)
+        return task
+
+    def abort_running_task(self, task: Task):
+        '''Removes a running task, its worker is told to abort it by the
+        heartbeat response.'''
+
+        self.pop_running_task(task.task_id)
+        # the worker heartbeats within its lease duration
+        self.cancelled_tasks.add(task.task_id, task.lease_duration)
+
+    def running_twin(self, task: Task) -> typing.Optional[Task]:
+        '''The other attempt of a task executed speculatively if it is still
+        running.'''
+
+        twin = task.speculative_copy if task.speculated_task is None else task.speculated_task
+        if twin is not None and self.running_tasks.get(twin.task_id) is twin:
+            return twin
+        return None
+
+    def speculate_task(self, task: Task) -> bool:
+        '''Hands a copy of a straggling running task to an idle worker.
+        Returns False if no idle worker accepts it.'''
+
+        copy = Task(
+            type=task.type,
+            result_future=task.result_future,
+            payload=task.payload,
+            key=task.key,
+            priority=task.priority,
+            estimated_cost=task.estimated_cost,
+            requirements=task.requirements,
+            affinity_key=task.affinity_key,
+            producer_id=task.producer_id,
+        )
+        copy.speculated_task = task
+        copy.created_time = task.created_time
+        if not self.pending_tasks.offer(task.type, copy):
+            return False
+        task.speculative_copy = copy
+        self.metrics[task.type].speculative_tasks += 1
+        return True
+
+    def requeue_timed_out_tasks(self, task_ids: typing.List[str]):
+        for task_id in task_ids:
+            self.metrics[self.running_tasks[task_id].type].expired_heartbeats += 1
+            # a task crashing its worker is only noticed by its heartbeat
+            self.fail_running_task(
+                task_id,
+                b'{"message":"Heartbeat timeout"}',
             )
-        except asyncio.CancelledError:
-            try:
-                self.pending_tasks.remove(task.type, task)
-            except ValueError:
-                try:
-                    running_task: Task = self.running_tasks[task.task_id]
-                except KeyError:
-                    return
-                del self.running_tasks[task.task_id]
-                running_task['heartbeat_task'].cancel()
-                try:
-                    await running_task['heartbeat_task']
-                except asyncio.CancelledError:
-                    pass
 
-    async def heartbeat_timeout_trigger(self, task: Task):
-        await asyncio.sleep(self.arguments['heartbeat_timeout'])
-        del self.running_tasks[task.task_id]
+    def requeue_running_task(self, task_id: str):
+        '''Requeues a running task without counting a failed attempt.'''
+
+        task = self.pop_running_task(task_id)
+        # the other attempt of a task executed speculatively carries on
+        if self.running_twin(task) is not None:
+            return
+        if task.speculated_task is not None:
+            task = task.speculated_task
+        self.journal_append({'op': 'requeue', 'key': task.key})
+        self.requeue_task(task)
+
+    def requeue_task(self, task: Task):
+        task.queued_time = time.monotonic()
+        # requeued tasks may straggle again
+        task.speculative_copy = None
+        self.push_pending_task(task)
+
+    def push_pending_task(self, task: Task):
+        '''Queues a task or hands it off to a waiting worker. Tasks waiting
+        for a warm worker are offered to all waiting workers once their
+        affinity delay passed.'''
+
         self.pending_tasks.push(task.type, task)
+        if task.affinity_key is not None and task in self.pending_tasks.queues.get(task.type, ()):
+            asyncio.get_running_loop().call_later(
+                self.arguments['affinity_delay'],
+                self.pending_tasks.hand_off_queued,
+                task.type,
+                task,
+            )
+
+    def worker_accepts_task(self, worker: typing.Optional[worker_registry.Worker], task: Task) -> bool:
+        '''Whether a worker (None for anonymous workers) may run a task.
+        Anonymous workers only get tasks without requirements. Tasks with an
+        affinity key wait for a worker having the key warm (delay
+        scheduling), other workers only get them after the affinity delay or
+        if no worker has the key warm. Speculative copies go to other workers
+        than the straggling task.'''
+
+        if task.speculated_task is not None and worker is not None and task.speculated_task.worker_id == worker.worker_id:
+            return False
+        if task.requirements is not None and (worker is None or not worker.satisfies(task.requirements)):
+            return False
+        if task.affinity_key is None or (worker is not None and task.affinity_key in worker.warm_keys):
+            return True
+        return self.affinity_delay_passed(task)
+
+    def affinity_delay_passed(self, task: Task) -> bool:
+        '''Whether a task with an affinity key stopped waiting for a worker
+        having the key warm.'''
+
+        return (
+            time.monotonic() - task.queued_time >= self.arguments['affinity_delay']
+            or not self.workers.is_warm_anywhere(task.affinity_key)
+        )
+
+    def peer_accepts_task(self, task: Task) -> bool:
+        '''Whether a peer router may steal a task. Tasks stolen from another
+        router and speculative copies are not passed on, tasks with an
+        affinity key wait for local workers having the key warm first.'''
+
+        return task.origin is None and task.speculated_task is None and (
+            task.affinity_key is None or self.affinity_delay_passed(task)
+        )
+
+    def fail_running_task(self, task_id: str, error: bytes) -> bool:
+        '''Records a failed attempt of a running task. The task is requeued
+        until it failed max_attempts times, then it is moved to the dead
+        letter tasks and its producers get the errors of all attempts.
+        Returns False if no task with the given ID is running.'''
+
+        try:
+            task = self.pop_running_task(task_id)
+        except KeyError:
+            return False
+        task_type_metrics = self.metrics[task.type]
+        task_type_metrics.failed_attempts += 1
+        worker = self.workers.get(task.worker_id)
+        if worker is not None:
+            worker.failed_tasks += 1
+
+        # the other attempt of a task executed speculatively carries on,
+        # failed copies count as failed attempts of the task otherwise
+        if self.running_twin(task) is not None:
+            return True
+        if task.speculated_task is not None:
+            task = task.speculated_task
+        self.journal_append(
+            {'op': 'error', 'key': task.key},
+            {'error': error},
+        )
+        task.errors.append(error)
+
+        # the origin router retries stolen tasks
+        if task.origin is not None:
+            task.result_future.set_exception(TaskFailedError(error))
+            return True
+
+        if len(task.errors) < self.arguments['max_attempts']:
+            self.requeue_task(task)
+            return True
+
+        task_type_metrics.dead_lettered_tasks += 1
+        self.dead_letter_tasks[task_id] = task
+        task.result_future.set_exception(TaskFailedError(b''.join((
+            b'{"message":"Task failed","attempts":',
+            self.encode_json_value(len(task.errors)),
+            b',"errors":[',
+            b','.join(task.errors),
+            b']}',
+        ))))
+        return True
+
+    def drop_dead_letter_task(self, task_id: str) -> bool:
+        if self.dead_letter_tasks.pop(task_id, None) is None:
+            return False
+        self.journal_append({'op': 'dropDeadLetter', 'taskId': task_id})
+        return True
+
+    async def pop_pending_tasks(self, task_types: typing.List[str], count: int, worker_id: typing.Optional[str] = None) -> typing.List[Task]:
+        '''Waits for pending tasks the worker accepts (see
+        worker_accepts_task).'''
+
+        worker = self.workers.get(worker_id)
+        while True:
+            # skip tasks whose producer request got cancelled while the task
+            # was being handed off to this worker
+            tasks = [
+                task
+                for task in await self.pending_tasks.pop_many(
+                    task_types,
+                    count,
+                    functools.partial(self.worker_accepts_task, worker),
+                )
+                if not task.result_future.done()
+            ]
+            if len(tasks) > 0:
+                return tasks
 
     async def handle_task_get(self, request: aiohttp.web.Request):
         '''Worker -> Router'''
 
-        # RFC 7240
+        timeout, count, task_types = self.parse_lease_request(request)
+        lease_duration = self.parse_lease_duration(request)
+        self.see_worker(request)
+        return await self.lease_tasks(request, timeout, count, task_types, lease_duration)
+
+    def parse_prefer_wait(self, request: aiohttp.web.Request) -> int:
+        '''Extracts the long-polling timeout in seconds (RFC 7240).'''
+
         try:
             prefer_match = re.fullmatch(
                 r'wait=(\d+)', request.headers['Prefer'])
@@ -104,68 +1370,462 @@ class Api:
                     reason='Malformed Prefer header')
         except KeyError:
             raise aiohttp.web.HTTPBadRequest(reason='Missing Prefer header')
-        timeout = int(prefer_match.group(1))
+        return int(prefer_match.group(1))
+
+    def parse_lease_request(self, request: aiohttp.web.Request) -> typing.Tuple[int, int, typing.List[str]]:
+        '''Extracts long-polling timeout, maximum amount of tasks and task
+        types from a request of a worker for tasks.'''
+
+        timeout = self.parse_prefer_wait(request)
+        count, task_types = self.parse_worker_subscription(request)
+        return timeout, count, task_types
+
+    def parse_worker_subscription(self, request: aiohttp.web.Request) -> typing.Tuple[int, typing.List[str]]:
+        '''Extracts maximum amount of tasks and task types from a request of
+        a worker.'''
+
+        # maximum amount of tasks leased at once, if given the response is a list of tasks
+        try:
+            count = int(request.query.get('count', 1))
+        except ValueError:
+            raise aiohttp.web.HTTPBadRequest(reason='Malformed count')
+        if count < 1:
+            raise aiohttp.web.HTTPBadRequest(reason='Malformed count')
 
-        # retrieve task of given types
         try:
             task_types = request.query.getall('taskType')
         except KeyError:
             raise aiohttp.web.HTTPBadRequest(reason='Missing taskType')
+
+        return count, task_types
+
+    def parse_lease_duration(self, request: aiohttp.web.Request) -> float:
+        '''Extracts the lease duration in seconds requested by a worker,
+        bounded by min_lease_duration and max_lease_duration. Workers not
+        requesting one get heartbeat_timeout.'''
+
+        if 'leaseDuration' not in request.query:
+            return self.arguments['heartbeat_timeout']
         try:
-            task: Task = await asyncio.wait_for(self.pending_tasks.pop(task_types), timeout)
+            lease_duration = float(request.query['leaseDuration'])
+            if not math.isfinite(lease_duration):
+                raise ValueError
+        except ValueError:
+            raise aiohttp.web.HTTPBadRequest(reason='Malformed leaseDuration')
+        return min(
+            max(lease_duration, self.arguments['min_lease_duration']),
+            self.arguments['max_lease_duration'],
+        )
+
+    async def lease_tasks(self, request: aiohttp.web.Request, timeout: int, count: int, task_types: typing.List[str], lease_duration: float) -> aiohttp.web.Response:
+        '''Long-polls for tasks of the given types and assigns them to the
+        requesting worker.'''
+
+        # retrieve tasks of given types
+        try:
+            tasks = await asyncio.wait_for(self.pop_pending_tasks(task_types, count, request.query.get('workerId')), timeout)
         except asyncio.TimeoutError:
             raise aiohttp.web.HTTPNoContent(
                 reason='Prefer timeout before task availability')
 
-        # move task into running_tasks and start heartbeat timeout
-        task.task_id = str(uuid.uuid4())
-        self.running_tasks[task.task_id] = {
-            'task': task,
-            'heartbeat_task': asyncio.create_task(
-                self.heartbeat_timeout_trigger(
-                    task,
-                ),
-            ),
-        }
+        # move tasks into running_tasks and start heartbeat timeouts
+        for task in tasks:
+            self.assign_task(task, self.new_id(), request.query.get('workerId'), lease_duration)
+        try:
+            await self.journal_commit()
+        except asyncio.CancelledError:
+            # the worker disconnected while the assignment got journaled, the
+            # tasks never reach it
+            for task in tasks:
+                if self.running_tasks.get(task.task_id) is task:
+                    self.requeue_running_task(task.task_id)
+            raise
+
+        # return tasks to worker, payloads are spliced into the response
+        if 'count' in request.query:
+            body = b'[' + b','.join(
+                self.task_response_body(task)
+                for task in tasks
+            ) + b']'
+        else:
+            body = self.task_response_body(tasks[0])
+        return aiohttp.web.Response(
+            body=body,
+            content_type='application/json',
+        )
+
+    def assign_task(self, task: Task, task_id: str, worker_id: typing.Optional[str] = None, lease_duration: typing.Optional[float] = None):
+        '''Moves a task into running_tasks, starts its heartbeat timeout
+        (after lease_duration seconds, heartbeat_timeout if not given) and
+        journals the assignment (except of speculative copies).'''
+
+        task.task_id = task_id
+        task.worker_id = worker_id
+        task.lease_duration = self.arguments['heartbeat_timeout'] if lease_duration is None else lease_duration
+        worker = self.workers.get(worker_id)
+        if worker is not None and task.affinity_key is not None:
+            # the worker loads the data of the task
+            self.workers.warm_up(worker, task.affinity_key)
+        task.assigned_time = time.monotonic()
+        task_type_metrics = self.metrics[task.type]
+        task_type_metrics.assigned_tasks += 1
+        task_type_metrics.queued_seconds.observe(
+            task.assigned_time - task.queued_time)
+        self.running_tasks[task.task_id] = task
+        self.heartbeat_timeouts.add(task.task_id, task.lease_duration)
+        if task.speculated_task is None:
+            self.journal_append(
+                {'op': 'assign', 'key': task.key, 'taskId': task.task_id, 'leaseDuration': task.lease_duration})
+
+    async def handle_worker_websocket(self, request: aiohttp.web.Request):
+        '''Worker <-> Router
+
+        Persistent connection of a worker subscribed to the given task types.
+        The router sends {"tasks": [...]} messages while less than count tasks
+        are leased by the worker and answers heartbeats with
+        {"cancelledTaskIds": [...]} if tasks got cancelled by their producers.
+        The worker sends {"type": "heartbeat", "taskIds": [...]} and {"type": "results", "results": {task ID:
+        result}} and {"type": "errors", "errors": {task ID: error}} messages.
+        Tasks of a disconnected worker are requeued immediately.'''
+
+        count, task_types = self.parse_worker_subscription(request)
+        lease_duration = self.parse_lease_duration(request)
+        worker_id = request.query.get('workerId')
+
+        websocket = aiohttp.web.WebSocketResponse(
+            # detect half-open connections well before the heartbeat timeout
+            heartbeat=self.arguments['heartbeat_timeout'] / 2,
+        )
+        await websocket.prepare(request)
+
+        # IDs of the tasks leased over this connection
+        leased_task_ids = set()
+        free_capacity_event = asyncio.Event()
+        free_capacity_event.set()
+
+        async def send_tasks():
+            while True:
+                await free_capacity_event.wait()
+                if len(leased_task_ids) >= count:
+                    free_capacity_event.clear()
+                    continue
+                tasks = await self.pop_pending_tasks(
+                    task_types,
+                    count - len(leased_task_ids),
+                    worker_id,
+                )
+                for task in tasks:
+                    self.assign_task(task, self.new_id(), worker_id, lease_duration)
+                    leased_task_ids.add(task.task_id)
+                await self.journal_commit()
+                await websocket.send_bytes(
+                    b'{"tasks":[' + b','.join(
+                        self.task_response_body(task)
+                        for task in tasks
+                    ) + b']}',
+                )
+
+        # connected workers are kept in the registry while idle
+        worker = self.see_worker(request)
+        if worker is not None:
+            worker.connections += 1
+
+        send_tasks_task = asyncio.create_task(send_tasks())
+        try:
+            async for message in websocket:
+                if message.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                    continue
+                self.see_worker(request)
+                try:
+                    data = json.loads(message.data)
+                    message_type = data['type']
+                    if message_type == 'heartbeat' and not isinstance(data['taskIds'], list):
+                        raise TypeError
+                    if message_type in ('results', 'errors') and not isinstance(data[message_type], dict):
+                        raise TypeError
+                except (ValueError, TypeError, KeyError):
+                    await websocket.close(message=b'Malformed message')
+                    break
+                if message_type == 'heartbeat':
+                    cancelled_task_ids = []
+                    for task_id in data['taskIds']:
+                        if task_id in leased_task_ids:
+                            task = self.running_tasks.get(task_id)
+                            if task is not None:
+                                self.heartbeat_timeouts.renew(task_id, task.lease_duration)
+                            elif task_id in self.cancelled_tasks:
+                                cancelled_task_ids.append(task_id)
+                    if len(cancelled_task_ids) > 0:
+                        await websocket.send_json({
+                            'cancelledTaskIds': cancelled_task_ids,
+                        })
+                    # tasks requeued after missed heartbeats or cancelled free their capacity
+                    lost_task_ids = [
+                        task_id
+                        for task_id in leased_task_ids
+                        if task_id not in self.running_tasks
+                    ]
+                    if len(lost_task_ids) > 0:
+                        leased_task_ids.difference_update(lost_task_ids)
+                        free_capacity_event.set()
+                elif message_type == 'results':
+                    # results of tasks which are not running anymore are dropped
+                    for task_id, result in data['results'].items():
+                        if task_id in leased_task_ids:
+                            leased_task_ids.remove(task_id)
+                            self.complete_running_task(
+                                task_id,
+                                self.encode_json_value(result),
+                            )
+                    free_capacity_event.set()
+                    await self.journal_commit()
+                elif message_type == 'errors':
+                    for task_id, error in data['errors'].items():
+                        if task_id in leased_task_ids:
+                            leased_task_ids.remove(task_id)
+                            self.fail_running_task(
+                                task_id,
+                                self.encode_json_value(error),
+                            )
+                    free_capacity_event.set()
+                    await self.journal_commit()
+        finally:
+            send_tasks_task.cancel()
+            try:
+                await send_tasks_task
+            except (asyncio.CancelledError, ConnectionError):
+                pass
+            if worker is not None:
+                worker.connections -= 1
+                self.see_worker(request)
+
+            # requeue tasks of the disconnected worker
+            for task_id in leased_task_ids:
+                if task_id in self.running_tasks:
+                    self.metrics[self.running_tasks[task_id].type].disconnected_tasks += 1
+                    self.requeue_running_task(task_id)
+
+        return websocket
+
+    def see_worker(self, request: aiohttp.web.Request) -> typing.Optional[worker_registry.Worker]:
+        '''Updates the last seen time of the worker identified by the
+        workerId of a request, requests without workerId are anonymous.'''
+
+        worker_id = request.query.get('workerId')
+        if worker_id is None:
+            return None
+        return self.workers.see(worker_id)
+
+    async def handle_worker_register(self, request: aiohttp.web.Request):
+        '''Worker -> Router
+
+        Registers a worker with {"workerId": ..., "hostname": ...,
+        "taskTypes": [...], "concurrency": ..., "resources": {name: amount},
+        "labels": [...], "warmKeys": [...]}, all fields are optional.
+        Resources and labels are matched against the requirements of tasks,
+        warm keys against their affinity keys. The worker passes the returned workerId in
+        its following requests.'''
+
+        registration = await self.read_json(request)
+        try:
+            worker_id = registration.get('workerId', str(uuid.uuid4()))
+            hostname = registration.get('hostname')
+            task_types = registration.get('taskTypes', [])
+            concurrency = registration.get('concurrency')
+            resources = registration.get('resources', {})
+            labels = registration.get('labels', [])
+            warm_keys = registration.get('warmKeys', [])
+            if not (
+                isinstance(worker_id, str)
+                and (hostname is None or isinstance(hostname, str))
+                and isinstance(task_types, list)
+                and all(isinstance(task_type, str) for task_type in task_types)
+                and (concurrency is None or (isinstance(concurrency, int) and not isinstance(concurrency, bool) and concurrency >= 1))
+                and isinstance(resources, dict)
+                and all(
+                    isinstance(amount, (int, float)) and not isinstance(amount, bool) and math.isfinite(amount)
+                    for amount in resources.values()
+                )
+                and isinstance(labels, list)
+                and all(isinstance(label, str) for label in labels)
+                and isinstance(warm_keys, list)
+                and all(isinstance(key, str) for key in warm_keys)
+            ):
+                raise TypeError
+        except (AttributeError, TypeError):
+            raise aiohttp.web.HTTPBadRequest(
+                reason='Malformed worker registration')
+
+        worker = self.workers.see(worker_id)
+        worker.hostname = hostname
+        worker.task_types = task_types
+        worker.concurrency = concurrency
+        worker.resources = resources
+        worker.labels = labels
+        self.workers.set_warm_keys(worker, warm_keys)
+        worker.registered_time = worker.last_seen_time
 
-        # return task to worker
         return aiohttp.web.json_response(
             {
-                'taskType': task.type,
-                'taskId': task.task_id,
-                'payload': task.payload,
+                'workerId': worker_id,
             },
             dumps=self.json_formatter,
         )
 
+    async def handle_workers(self, request: aiohttp.web.Request):
+        '''Operator -> Router'''
+
+        now = time.monotonic()
+        leases = {}
+        for task in self.running_tasks.values():
+            if task.worker_id is not None:
+                leases.setdefault(task.worker_id, []).append({
+                    'taskType': task.type,
+                    'taskId': task.task_id,
+                    'runningSeconds': now - task.assigned_time,
+                })
+
+        return aiohttp.web.json_response(
+            [
+                {
+                    'workerId': worker.worker_id,
+                    'hostname': worker.hostname,
+                    'taskTypes': worker.task_types,
+                    'concurrency': worker.concurrency,
+                    'resources': worker.resources,
+                    'labels': worker.labels,
+                    'warmKeys': list(worker.warm_keys),
+                    'registeredTime': worker.registered_time,
+                    'lastSeenTime': worker.last_seen_time,
+                    'connected': worker.connections > 0,
+                    'leases': leases.get(worker.worker_id, []),
+                    'completedTasks': worker.completed_tasks,
+                    'failedTasks': worker.failed_tasks,
+                    'meanTaskSeconds': worker.mean_task_seconds(),
+                }
+                for worker in self.workers.values()
+            ],
+            dumps=self.json_formatter,
+        )
+
     async def handle_task_heartbeat(self, request: aiohttp.web.Request):
-        '''Worker -> Router'''
+        '''Worker -> Router
 
-        # extract task id
+        Renews the leases of running tasks, by their lease duration or by a
+        newly requested leaseDuration. The response tells the seconds until
+        the earliest renewed lease expires as nextDeadline (null if no lease
+        was renewed).'''
+
+        # extract task ids, all tasks of a lease may be given at once
         try:
-            task_id = request.query['taskId']
+            task_ids = request.query.getall('taskId')
         except KeyError:
             raise aiohttp.web.HTTPBadRequest(reason='Missing taskId')
+        lease_duration = None
+        if 'leaseDuration' in request.query:
+            lease_duration = self.parse_lease_duration(request)
+        self.see_worker(request)
+
+        # restart heartbeat timeouts of running tasks, workers abort
+        # cancelled tasks
+        all_tasks_found = True
+        cancelled_task_ids = []
+        next_deadline = None
+        for task_id in task_ids:
+            task = self.running_tasks.get(task_id)
+            if task is not None:
+                if lease_duration is not None:
+                    task.lease_duration = lease_duration
+                self.heartbeat_timeouts.renew(task_id, task.lease_duration)
+                if next_deadline is None or task.lease_duration < next_deadline:
+                    next_deadline = task.lease_duration
+            elif task_id in self.cancelled_tasks:
+                cancelled_task_ids.append(task_id)
+            else:
+                all_tasks_found = False
+
+        body = self.encode_json_value({
+            'cancelledTaskIds': cancelled_task_ids,
+            'nextDeadline': next_deadline,
+        })
+        if not all_tasks_found:
+            raise aiohttp.web.HTTPNotFound(
+                reason='Task with taskId not found',
+                body=body,
+                content_type='application/json',
+            )
+        return aiohttp.web.Response(
+            body=body,
+            content_type='application/json',
+        )
+
+    async def handle_task_release(self, request: aiohttp.web.Request):
+        '''Worker -> Router
+
+        Gives leased tasks back without counting a failed attempt (e.g. when
+        the worker shuts down), they are requeued at once.'''
+
+        task_ids = await self.read_json(request)
+        if not isinstance(task_ids, list) or not all(isinstance(task_id, str) for task_id in task_ids):
+            raise aiohttp.web.HTTPBadRequest(reason='Task IDs are not a list')
+        self.see_worker(request)
+
+        all_tasks_found = True
+        for task_id in task_ids:
+            if task_id in self.running_tasks:
+                self.requeue_running_task(task_id)
+            else:
+                all_tasks_found = False
+        await self.journal_commit()
+
+        if not all_tasks_found:
+            raise aiohttp.web.HTTPNotFound(reason='Task with taskId not found')
+        raise aiohttp.web.HTTPOk()
+
+    def complete_running_task(self, task_id: str, result: bytes) -> bool:
+        '''Sets the result of a running task and removes it from the running
+        tasks. Returns False if no task with the given ID is running.'''
 
-        # get running task
+        # remove task from running, stop heartbeat timeout
         try:
-            running_task: Task = self.running_tasks[task_id]
+            running_task = self.pop_running_task(task_id)
         except KeyError:
-            raise aiohttp.web.HTTPNotFound(reason='Task with taskId not found')
+            return False
 
-        # cancel and restart heartbeat timeout
-        running_task['heartbeat_task'].cancel()
+        # set result future of task
         try:
-            await running_task['heartbeat_task']
-        except asyncio.CancelledError:
+            running_task.result_future.set_result(result)
+        except asyncio.InvalidStateError:
             pass
-        running_task['heartbeat_task'] = asyncio.create_task(
-            self.heartbeat_timeout_trigger(
-                running_task['task'],
-            ),
-        )
+        else:
+            self.journal_append(
+                {'op': 'complete', 'key': running_task.key},
+                {'result': result},
+            )
+            completed_time = time.monotonic()
+            task_type_metrics = self.metrics[running_task.type]
+            task_type_metrics.completed_tasks += 1
+            task_type_metrics.service_rate.record()
+            self.metrics.service_rate.record()
+            task_type_metrics.running_seconds.observe(
+                completed_time - running_task.assigned_time)
+            task_type_metrics.total_seconds.observe(
+                completed_time - running_task.created_time)
+            if self.speculation is not None:
+                self.speculation.observe(
+                    running_task.type, completed_time - running_task.assigned_time)
+            # the first result of a task executed speculatively wins
+            twin = self.running_twin(running_task)
+            if twin is not None:
+                self.abort_running_task(twin)
+            if running_task.speculated_task is not None:
+                task_type_metrics.speculative_wins += 1
+            worker = self.workers.get(running_task.worker_id)
+            if worker is not None:
+                worker.completed_tasks += 1
+                worker.running_seconds += completed_time - running_task.assigned_time
 
-        raise aiohttp.web.HTTPOk()
+        return True
 
     async def handle_result_set(self, request: aiohttp.web.Request):
         '''Worker -> Router'''
@@ -175,32 +1835,287 @@ class Api:
             task_id = request.query['taskId']
         except KeyError:
             raise aiohttp.web.HTTPBadRequest(reason='Missing taskId')
+        self.see_worker(request)
+
+        # check running task before reading the result
+        if task_id not in self.running_tasks:
+            raise aiohttp.web.HTTPNotFound(reason='Task with taskId not found')
+
+        # task may be deleted because of a cancellation in the producer request task while waiting for this request's JSON body (context switch)
+        if not self.complete_running_task(task_id, await self.read_json_value(request)):
+            raise aiohttp.web.HTTPNotFound(reason='Task with taskId not found')
+        await self.journal_commit()
+
+        raise aiohttp.web.HTTPOk()
+
+    async def handle_result_set_batch(self, request: aiohttp.web.Request):
+        '''Worker -> Router'''
+
+        # results are given as object of task ID -> result
+        results = await self.read_json_values(request)
+        self.see_worker(request)
+
+        all_tasks_found = True
+        for task_id, result in results.items():
+            if not self.complete_running_task(task_id, result):
+                all_tasks_found = False
+        await self.journal_commit()
 
-        # get running task
+        if not all_tasks_found:
+            raise aiohttp.web.HTTPNotFound(reason='Task with taskId not found')
+        raise aiohttp.web.HTTPOk()
+
+    async def handle_result_set_and_task_get(self, request: aiohttp.web.Request):
+        '''Worker -> Router'''
+
+        timeout, count, task_types = self.parse_lease_request(request)
+        lease_duration = self.parse_lease_duration(request)
+
+        # results are given as object of task ID -> result
+        results = await self.read_json_values(request)
+        self.see_worker(request)
+
+        # results of tasks which are not running anymore are dropped, the
+        # worker is interested in its next tasks anyway
+        for task_id, result in results.items():
+            self.complete_running_task(task_id, result)
+
+        return await self.lease_tasks(request, timeout, count, task_types, lease_duration)
+
+    async def handle_result_error(self, request: aiohttp.web.Request):
+        '''Worker -> Router'''
+
+        # extract task id
         try:
-            running_task: Task = self.running_tasks[task_id]
+            task_id = request.query['taskId']
         except KeyError:
+            raise aiohttp.web.HTTPBadRequest(reason='Missing taskId')
+        self.see_worker(request)
+
+        # check running task before reading the error
+        if task_id not in self.running_tasks:
             raise aiohttp.web.HTTPNotFound(reason='Task with taskId not found')
 
-        # set result future of task
+        # the failed task is requeued at once instead of after the heartbeat timeout
+        if not self.fail_running_task(task_id, await self.read_json_value(request)):
+            raise aiohttp.web.HTTPNotFound(reason='Task with taskId not found')
+        await self.journal_commit()
+
+        raise aiohttp.web.HTTPOk()
+
+    async def handle_dead_letter_list(self, request: aiohttp.web.Request):
+        '''Operator -> Router'''
+
+        # payloads and errors are spliced into the response
+        return aiohttp.web.Response(
+            body=b'[' + b','.join(
+                b''.join((
+                    b'{"taskType":',
+                    self.encode_json_value(task.type),
+                    b',"taskId":',
+                    self.encode_json_value(task.task_id),
+                    b',"payload":',
+                    task.payload,
+                    b',"errors":[',
+                    b','.join(task.errors),
+                    b']}',
+                ))
+                for task in self.dead_letter_tasks.values()
+            ) + b']',
+            content_type='application/json',
+        )
+
+    async def handle_dead_letter_drop(self, request: aiohttp.web.Request):
+        '''Operator -> Router'''
+
+        task_ids = await self.read_json(request)
+        if not isinstance(task_ids, list) or not all(isinstance(task_id, str) for task_id in task_ids):
+            raise aiohttp.web.HTTPBadRequest(reason='Task IDs are not a list')
+
+        all_tasks_found = True
+        for task_id in task_ids:
+            if not self.drop_dead_letter_task(task_id):
+                all_tasks_found = False
+        await self.journal_commit()
+
+        if not all_tasks_found:
+            raise aiohttp.web.HTTPNotFound(reason='Task with taskId not found')
+        raise aiohttp.web.HTTPOk()
+
+    async def handle_blob_set(self, request: aiohttp.web.Request):
+        '''Task Producer -> Router'''
+
+        # extract hash
         try:
-            running_task['task'].result_future.set_result(await request.json())
-        except asyncio.InvalidStateError:
-            pass
+            blob_hash = request.query['hash']
+        except KeyError:
+            raise aiohttp.web.HTTPBadRequest(reason='Missing hash')
 
-        # re-get running task, because it may be deleted because of a cancellation in the producer request task (context switch)
+        # blobs are immutable, re-registering is a no-op
+        if blob_hash not in self.blobs:
+            blob = await self.read_json_value(request)
+            if hashlib.sha256(blob).hexdigest() != blob_hash:
+                raise aiohttp.web.HTTPBadRequest(
+                    reason='Hash does not match blob')
+            self.blobs[blob_hash] = blob
+            self.journal_append(self.blob_record(blob_hash, blob))
+            await self.journal_commit()
+
+        raise aiohttp.web.HTTPOk()
+
+    async def handle_blob_get(self, request: aiohttp.web.Request):
+        '''Worker -> Router'''
+
+        # extract hash
         try:
-            running_task: Task = self.running_tasks[task_id]
+            blob_hash = request.query['hash']
         except KeyError:
-            # while waiting for this request's JSON body, task got deleted
-            raise aiohttp.web.HTTPNotFound(reason='Task with taskId not found')
+            raise aiohttp.web.HTTPBadRequest(reason='Missing hash')
 
-        # remove task from running, stop heartbeat timeout
-        del self.running_tasks[task_id]
-        running_task['heartbeat_task'].cancel()
         try:
-            await running_task['heartbeat_task']
-        except asyncio.CancelledError:
-            pass
+            blob = self.blobs[blob_hash]
+        except KeyError:
+            raise aiohttp.web.HTTPNotFound(reason='Blob with hash not found')
 
-        raise aiohttp.web.HTTPOk()
+        return aiohttp.web.Response(
+            body=blob,
+            content_type='application/json',
+        )
+
+    async def handle_peer_status(self, request: aiohttp.web.Request):
+        '''Router -> Router
+
+        Amount of pending tasks per task type which peer routers may
+        steal.'''
+
+        pending_tasks = {}
+        for task_type, task in self.pending_tasks.items():
+            if task.origin is None:
+                pending_tasks[task_type] = pending_tasks.get(task_type, 0) + 1
+
+        return aiohttp.web.json_response(
+            {
+                'pendingTasks': pending_tasks,
+            },
+            dumps=self.json_formatter,
+        )
+
+    async def handle_peer_steal(self, request: aiohttp.web.Request):
+        '''Router -> Router
+
+        Leases pending tasks to a peer router which runs them on its own
+        workers, like /task/get with count. The peer passes its workerId,
+        heartbeats the tasks and returns their results. The response contains
+        the scheduling parameters of the tasks in addition.'''
+
+        timeout, count, task_types = self.parse_lease_request(request)
+        self.see_worker(request)
+        try:
+            tasks = await asyncio.wait_for(
+                self.pending_tasks.pop_many(
+                    task_types,
+                    count,
+                    self.peer_accepts_task,
+                ),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            raise aiohttp.web.HTTPNoContent(
+                reason='Prefer timeout before task availability')
+
+        # skip tasks whose producer request got cancelled while the task was
+        # being handed off
+        tasks = [
+            task
+            for task in tasks
+            if not task.result_future.done()
+        ]
+        for task in tasks:
+            self.assign_task(task, self.new_id(), request.query.get('workerId'))
+        await self.journal_commit()
+
+        # payloads are spliced into the response
+        return aiohttp.web.Response(
+            body=b'[' + b','.join(
+                b''.join((
+                    b'{"taskType":',
+                    self.encode_json_value(task.type),
+                    b',"taskId":',
+                    self.encode_json_value(task.task_id),
+                    b',"priority":',
+                    self.encode_json_value(task.priority),
+                    b',"estimatedCost":',
+                    self.encode_json_value(task.estimated_cost),
+                    b',"requirements":',
+                    self.encode_json_value(task.requirements),
+                    b',"affinityKey":',
+                    self.encode_json_value(task.affinity_key),
+                    b',"producerId":',
+                    self.encode_json_value(task.producer_id),
+                    b',"payload":',
+                    task.payload,
+                    b'}',
+                ))
+                for task in tasks
+            ) + b']',
+            content_type='application/json',
+        )
+
+    async def handle_metrics(self, request: aiohttp.web.Request):
+        '''Monitoring -> Router'''
+
+        running_tasks = {}
+        for task in self.running_tasks.values():
+            running_tasks[task.type] = running_tasks.get(task.type, 0) + 1
+
+        return aiohttp.web.Response(
+            text=self.metrics.render({
+                'pending_tasks': (
+                    'Tasks waiting for a worker',
+                    {
+                        task_type: len(queue)
+                        for task_type, queue in self.pending_tasks.queues.items()
+                    },
+                ),
+                'pending_bytes': (
+                    'Size of the payloads of tasks waiting for a worker',
+                    {
+                        task_type: self.pending_tasks.sizes_in_bytes.get(task_type, 0)
+                        for task_type in self.pending_tasks.queues
+                    },
+                ),
+                'running_tasks': (
+                    'Tasks assigned to workers',
+                    running_tasks,
+                ),
+                'waiting_lease_requests': (
+                    'Long-polling worker requests waiting for tasks',
+                    {
+                        task_type: len(waiters)
+                        for task_type, waiters in self.pending_tasks.waiters.items()
+                    },
+                ),
+                'submitted_results': (
+                    'Results of submitted tasks kept for collection',
+                    {None: len(self.submitted_results)},
+                ),
+                'result_cache_entries': (
+                    'Results in the result cache',
+                    {None: len(self.result_cache)},
+                ),
+                'blobs': (
+                    'Registered blobs',
+                    {None: len(self.blobs)},
+                ),
+                'dead_letter_tasks': (
+                    'Tasks which failed too often, kept for inspection',
+                    {None: len(self.dead_letter_tasks)},
+                ),
+                'workers': (
+                    'Workers seen within the worker expiry',
+                    {None: len(self.workers)},
+                ),
+            }),
+            content_type='text/plain',
+            charset='utf-8',
+        )
@@ -1,12 +1,57 @@
 import aiohttp
 import asyncio
 import datetime
+import functools
+import hashlib
+import json
 import pathlib
 import socket
 import typing
 import urllib
 
 
+def append_to_server_url(server_url: str, object_type: str, operation: str):
+    parsed_server_url = urllib.parse.urlparse(server_url)
+    return urllib.parse.urlunparse((
+        parsed_server_url.scheme,
+        parsed_server_url.netloc,
+        str(pathlib.PurePosixPath(parsed_server_url.path) /
+            object_type / operation),
+        '',
+        '',
+        '',
+    ))
+
+
+class TaskFailedError(Exception):
+    '''Raised if the router gave up on a task after too many failed attempts,
+    error contains the errors reported for all attempts.'''
+
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+
+def parse_retry_after(response: aiohttp.ClientResponse) -> typing.Optional[float]:
+    '''Returns the seconds to wait before retrying a request rejected by an
+    overloaded router, None if the response is no such rejection.'''
+
+    if response.status != 503:
+        return None
+    try:
+        return max(float(response.headers['Retry-After']), 0)
+    except (KeyError, ValueError):
+        return None
+
+
+def raise_for_rejection(response: aiohttp.ClientResponse):
+    '''Raises ClientResponseError if the router rejected the request itself
+    (e.g. a too large payload), retrying it would be rejected again.'''
+
+    if 400 <= response.status < 500 and response.status not in (408, 429):
+        response.raise_for_status()
+
+
 class KeepAliveTCPConnector(aiohttp.TCPConnector):
 
     async def _create_connection(self, req: aiohttp.ClientRequest, traces: typing.List['Trace'], timeout: aiohttp.ClientTimeout):
@@ -50,21 +95,43 @@ class KeepAliveTCPConnector(aiohttp.TCPConnector):
 
 class ApiClient:
 
-    def __init__(self, server_url: str, connect_timeout: int, initial_retry_timeout: int, maximum_retry_timeout: int):
-        parsed_server_url = urllib.parse.urlparse(server_url)
-        self.endpoint = urllib.parse.urlunparse((
-            parsed_server_url.scheme,
-            parsed_server_url.netloc,
-            str(pathlib.PurePosixPath(parsed_server_url.path) /
-                'task' / 'run'),
-            '',
-            '',
-            '',
-        ))
+    def __init__(self, server_url: str, connect_timeout: int, initial_retry_timeout: int, maximum_retry_timeout: int, maximum_concurrent_polls: int = 4, poll_timeout: int = 60, producer_id: typing.Optional[str] = None):
+        self.submit_endpoint = append_to_server_url(
+            server_url, 'task', 'submit')
+        self.cancel_endpoint = append_to_server_url(
+            server_url, 'task', 'cancel')
+        self.wait_endpoint = append_to_server_url(server_url, 'result', 'wait')
+        self.batch_endpoint = append_to_server_url(
+            server_url, 'task', 'run_batch')
+        self.blob_endpoint = append_to_server_url(server_url, 'blob', 'set')
+
+        # registered blobs, SHA-256 hex digest -> JSON bytes
+        self.blobs = {}
+        # hashes of blobs known to the router
+        self.uploaded_blob_hashes = set()
 
         self.connect_timeout = connect_timeout
         self.initial_retry_timeout = initial_retry_timeout
         self.maximum_retry_timeout = maximum_retry_timeout
+        self.maximum_concurrent_polls = maximum_concurrent_polls
+        self.poll_timeout = poll_timeout
+        # identifies the producer towards the router which shares the workers
+        # fairly between producers, None submits anonymously
+        self.producer_id = producer_id
+
+        # outstanding submitted tasks, handle -> future of (found, result)
+        self.result_futures = {}
+        # handles covered by one of the running polls
+        self.polled_handles = set()
+        # handles of received results, acknowledged with the next poll
+        self.collected_handles = []
+        self.poll_tasks = set()
+        # restarted to cover new handles once the maximum amount of polls runs
+        self.newest_poll_task = None
+        self.poll_retry_count = 0
+        # cancel requests of abandoned tasks
+        self.background_tasks = set()
+        self.closing = False
 
         self.session = aiohttp.ClientSession(
             connector=KeepAliveTCPConnector(
@@ -84,29 +151,292 @@ class ApiClient:
         return self
 
     async def __aexit__(self, *args, **kwargs):
+        self.closing = True
+        for poll_task in self.poll_tasks:
+            poll_task.cancel()
+        await asyncio.gather(
+            *self.poll_tasks,
+            *self.background_tasks,
+            return_exceptions=True,
+        )
         await self.session.__aexit__(*args, **kwargs)
 
-    async def run(self, type: str, payload):
+    def blob(self, data) -> dict:
+        '''Registers a large sub-document of payloads (e.g. a configuration)
+        and returns a reference to it which can be embedded into payloads
+        instead. The router stores each blob once and workers fetch and cache
+        it by its hash.'''
+
+        blob = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+        blob_hash = hashlib.sha256(blob).hexdigest()
+        self.blobs[blob_hash] = blob
+        return {'$blob': blob_hash}
+
+    async def upload_blobs(self):
+        for blob_hash, blob in self.blobs.items():
+            if blob_hash in self.uploaded_blob_hashes:
+                continue
+            async with self.session.post(self.blob_endpoint, params={'hash': blob_hash}, data=blob) as response:
+                raise_for_rejection(response)
+                assert response.status == 200
+            self.uploaded_blob_hashes.add(blob_hash)
+
+    async def run(self, type: str, payload, priority: float = 0, estimated_cost: typing.Optional[float] = None, requirements: typing.Optional[dict] = None, affinity_key: typing.Optional[str] = None):
+        '''Submits the payload and waits for its result. Results of all
+        outstanding tasks are collected by a few shared long-polling requests,
+        connection failures therefore never abort a running evaluation.
+        Priority and estimated cost are used by the scheduling policy of the
+        router, only workers satisfying the requirements ({"resources": {name:
+        minimum amount}, "labels": [...]}) get the task. Workers which ran
+        tasks with the same affinity key before are preferred. Raises
+        TaskFailedError if the evaluation failed repeatedly and
+        aiohttp.ClientResponseError if the router rejected the submission.'''
+
+        while True:
+            handle = await self.submit(type, payload, priority, estimated_cost, requirements, affinity_key)
+            result_future = asyncio.get_running_loop().create_future()
+            self.result_futures[handle] = result_future
+            self.schedule_polls()
+            try:
+                found, result = await result_future
+            except asyncio.CancelledError:
+                self.result_futures.pop(handle, None)
+                cancel_task = asyncio.create_task(self.cancel(handle))
+                self.background_tasks.add(cancel_task)
+                cancel_task.add_done_callback(self.background_tasks.discard)
+                raise
+            if found:
+                return result
+            # router restarted or result expired
+            print('Router lost submitted task, submitting again...')
+
+    async def cancel(self, handle: str):
+        try:
+            async with self.session.post(self.cancel_endpoint, json=[handle]) as response:
+                pass
+        except aiohttp.ClientConnectionError:
+            # task will be dropped by the router after its result expired
+            pass
+
+    def schedule_polls(self):
+        '''Starts polls for handles not covered by a running poll. Once the
+        maximum amount of concurrent polls runs, the newest poll is restarted
+        to cover the new handles as well, they would wait for the poll
+        timeout otherwise if all polls wait for long-running tasks. Results
+        are kept by the router until they are acknowledged, restarted polls
+        therefore never lose results.'''
+
+        while not self.closing:
+            handles = [
+                handle
+                for handle in self.result_futures
+                if handle not in self.polled_handles
+            ]
+            if len(handles) == 0:
+                return
+            if len(self.poll_tasks) >= self.maximum_concurrent_polls:
+                # polls are scheduled again once the cancelled poll is done
+                self.newest_poll_task.cancel()
+                return
+            self.polled_handles.update(handles)
+            poll_task = asyncio.create_task(self.poll(handles))
+            # polls may be cancelled before they started
+            poll_task.add_done_callback(
+                functools.partial(self.poll_done, handles))
+            self.poll_tasks.add(poll_task)
+            self.newest_poll_task = poll_task
+
+    def poll_done(self, handles: typing.List[str], poll_task: asyncio.Task):
+        self.polled_handles.difference_update(handles)
+        self.poll_tasks.discard(poll_task)
+        self.schedule_polls()
+
+    async def poll(self, handles: typing.List[str]):
+        collected_handles = self.collected_handles
+        self.collected_handles = []
+        try:
+            try:
+                async with self.session.post(self.wait_endpoint, headers={'Prefer': f'wait={self.poll_timeout}'}, json={'handles': handles, 'collected': collected_handles}) as response:
+                    assert response.status in (200, 204)
+                    collected_handles = []
+                    if response.status == 204:
+                        return
+                    results = await response.json()
+                self.poll_retry_count = 0
+                for handle, result in results['results'].items():
+                    self.collected_handles.append(handle)
+                    self.set_result(handle, (True, result))
+                for handle, error in results['errors'].items():
+                    self.collected_handles.append(handle)
+                    self.set_error(handle, TaskFailedError(error))
+                if len(results['unknownHandles']) > 0:
+                    # router restarted and lost its blobs, they are uploaded
+                    # again before the tasks are submitted again
+                    self.uploaded_blob_hashes.clear()
+                for handle in results['unknownHandles']:
+                    self.set_result(handle, (False, None))
+            except AssertionError:
+                print(
+                    f'Got {response.status} while waiting for results, retrying...')
+                raise
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError):
+                print('Failed to connect while waiting for results, retrying...')
+                raise
+        except (AssertionError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError):
+            # router may have restarted and lost its blobs
+            self.uploaded_blob_hashes.clear()
+            # exponential back-off
+            await asyncio.sleep(
+                min(
+                    self.maximum_retry_timeout,
+                    self.initial_retry_timeout * 2**self.poll_retry_count,
+                ),
+            )
+            self.poll_retry_count += 1
+        finally:
+            # unacknowledged results are acknowledged with the next poll
+            self.collected_handles.extend(collected_handles)
+
+    def set_result(self, handle: str, result: typing.Tuple[bool, typing.Any]):
+        result_future = self.result_futures.pop(handle, None)
+        if result_future is not None and not result_future.done():
+            result_future.set_result(result)
+
+    def set_error(self, handle: str, error: TaskFailedError):
+        result_future = self.result_futures.pop(handle, None)
+        if result_future is not None and not result_future.done():
+            result_future.set_exception(error)
+
+    def scheduling_params(self, type: str, priority: float, estimated_costs: typing.List[typing.Optional[float]], requirements: typing.List[typing.Optional[dict]], affinity_keys: typing.List[typing.Optional[str]]) -> typing.List[typing.Tuple[str, str]]:
+        params = [('taskType', type), ('priority', str(priority))]
+        if all(estimated_cost is not None for estimated_cost in estimated_costs):
+            params.extend(
+                ('estimatedCost', str(estimated_cost))
+                for estimated_cost in estimated_costs
+            )
+        if any(task_requirements is not None for task_requirements in requirements):
+            params.extend(
+                ('requirements', json.dumps(task_requirements))
+                for task_requirements in requirements
+            )
+        if any(affinity_key is not None for affinity_key in affinity_keys):
+            params.extend(
+                ('affinityKey', '' if affinity_key is None else affinity_key)
+                for affinity_key in affinity_keys
+            )
+        if self.producer_id is not None:
+            params.append(('producerId', self.producer_id))
+        return params
+
+    async def submit(self, type: str, payload, priority: float = 0, estimated_cost: typing.Optional[float] = None, requirements: typing.Optional[dict] = None, affinity_key: typing.Optional[str] = None) -> str:
         retry_count = 0
         retry_first_timestamp = None
 
         while True:
             try:
                 try:
-                    async with self.session.post(self.endpoint, params={'taskType': type}, json=payload) as response:
-                        assert response.status == 200
-                        return await response.json()
+                    await self.upload_blobs()
+                    async with self.session.post(self.submit_endpoint, params=self.scheduling_params(type, priority, [estimated_cost], [requirements], [affinity_key]), json=payload) as response:
+                        retry_after = parse_retry_after(response)
+                        if retry_after is None:
+                            raise_for_rejection(response)
+                            assert response.status == 200
+                            return (await response.json())['handle']
+                    # router asked to come back when its queue drained
+                    print(
+                        f'Router has too many pending tasks, retrying after {retry_after} seconds...')
+                    await asyncio.sleep(retry_after)
+                    continue
                 except AssertionError:
                     retry_output = '' if retry_count == 0 else f' (retried {retry_count} times since {datetime.datetime.now() - retry_first_timestamp})'
                     print(
-                        f'Got {response.status} while running task, retrying...{retry_output}')
+                        f'Got {response.status} while submitting task, retrying...{retry_output}')
                     raise
                 except aiohttp.ClientConnectionError:
                     retry_output = '' if retry_count == 0 else f' (retried {retry_count} times since {datetime.datetime.now() - retry_first_timestamp})'
                     print(
-                        f'Failed to connect while running task, retrying...{retry_output}')
+                        f'Failed to connect while submitting task, retrying...{retry_output}')
                     raise
             except (AssertionError, aiohttp.ClientConnectionError):
+                # router may have restarted and lost its blobs
+                self.uploaded_blob_hashes.clear()
+                # store timestamp
+                if retry_first_timestamp is None:
+                    retry_first_timestamp = datetime.datetime.now()
+                # exponential back-off
+                await asyncio.sleep(
+                    min(
+                        self.maximum_retry_timeout,
+                        self.initial_retry_timeout * 2**retry_count,
+                    ),
+                )
+                retry_count += 1
+
+    async def run_many(self, type: str, payloads: typing.List[typing.Any], priority: float = 0, estimated_costs: typing.Optional[typing.List[typing.Optional[float]]] = None, requirements: typing.Optional[typing.List[typing.Optional[dict]]] = None, affinity_keys: typing.Optional[typing.List[typing.Optional[str]]] = None):
+        '''Runs all payloads in one batch request and yields (index, result)
+        tuples in completion order. After failures only the payloads without
+        result are submitted again. The estimated costs are only sent if
+        known for all payloads. The result of a task whose evaluation failed
+        repeatedly is a TaskFailedError. Raises aiohttp.ClientResponseError if
+        the router rejected the batch.'''
+
+        if estimated_costs is None:
+            estimated_costs = [None] * len(payloads)
+        if requirements is None:
+            requirements = [None] * len(payloads)
+        if affinity_keys is None:
+            affinity_keys = [None] * len(payloads)
+
+        # indices of payloads without result (dict used as ordered set)
+        remaining_indices = dict.fromkeys(range(len(payloads)))
+        retry_count = 0
+        retry_first_timestamp = None
+
+        while len(remaining_indices) > 0:
+            submitted_indices = list(remaining_indices)
+            try:
+                try:
+                    await self.upload_blobs()
+                    async with self.session.post(self.batch_endpoint, params=self.scheduling_params(type, priority, [estimated_costs[index] for index in submitted_indices], [requirements[index] for index in submitted_indices], [affinity_keys[index] for index in submitted_indices]), json=[payloads[index] for index in submitted_indices]) as response:
+                        retry_after = parse_retry_after(response)
+                        if retry_after is not None:
+                            # router asked to come back when its queue drained
+                            response.release()
+                            print(
+                                f'Router has too many pending tasks, retrying after {retry_after} seconds...')
+                            await asyncio.sleep(retry_after)
+                            continue
+                        raise_for_rejection(response)
+                        assert response.status == 200
+                        buffer = b''
+                        async for chunk in response.content.iter_any():
+                            *lines, buffer = (buffer + chunk).split(b'\n')
+                            for line in lines:
+                                result = json.loads(line)
+                                index = submitted_indices[result['index']]
+                                del remaining_indices[index]
+                                retry_count = 0
+                                retry_first_timestamp = None
+                                if 'error' in result:
+                                    yield index, TaskFailedError(result['error'])
+                                else:
+                                    yield index, result['result']
+                        if len(remaining_indices) > 0:
+                            raise aiohttp.ClientPayloadError(
+                                'Response ended before all results were received')
+                except AssertionError:
+                    retry_output = '' if retry_count == 0 else f' (retried {retry_count} times since {datetime.datetime.now() - retry_first_timestamp})'
+                    print(
+                        f'Got {response.status} while running tasks, retrying...{retry_output}')
+                    raise
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError):
+                    retry_output = '' if retry_count == 0 else f' (retried {retry_count} times since {datetime.datetime.now() - retry_first_timestamp})'
+                    print(
+                        f'Failed to connect while running tasks, retrying...{retry_output}')
+                    raise
+            except (AssertionError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError):
+                # router may have restarted and lost its blobs
+                self.uploaded_blob_hashes.clear()
                 # store timestamp
                 if retry_first_timestamp is None:
                     retry_first_timestamp = datetime.datetime.now()
@@ -0,0 +1,204 @@
+import aiohttp
+import asyncio
+import socket
+import typing
+
+# task IDs per heartbeat request, they are passed in the URL
+heartbeat_batch_size = 100
+
+
+class Federation:
+    '''Work stealing from peer routers (e.g. of another site behind NAT).
+
+    The router exchanges the amount of pending tasks with its peers
+    periodically. While local workers wait for tasks of a type with an empty
+    queue, the router steals pending tasks of the type from the peer with the
+    most of them. Towards its peers the router acts as a worker: stolen tasks
+    are heartbeated until their result is returned to the peer (their
+    origin), failed attempts are reported to the origin which retries
+    them.'''
+
+    def __init__(self, api):
+        self.api = api
+        self.arguments = api.arguments
+        self.peers: typing.List[str] = [
+            peer.rstrip('/')
+            for peer in self.arguments['peer']
+        ]
+        # workerId of the router towards its peers
+        self.router_id = f'router@{socket.gethostname()}:{self.arguments["port"]}'
+        # peer URL -> task type -> amount of pending tasks which may be stolen
+        self.peer_pending_tasks: typing.Dict[str, typing.Dict[str, int]] = {
+            peer: {}
+            for peer in self.peers
+        }
+        # set once the amounts of pending tasks got updated
+        self.peer_status_event = asyncio.Event()
+        # requests returning results, referenced until they are done
+        self.result_requests = set()
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+
+    async def run(self):
+        '''Exchanges status, steals and heartbeats tasks until cancelled.'''
+
+        try:
+            await asyncio.gather(
+                self.exchange_status(),
+                self.steal_tasks(),
+                self.send_heartbeats(),
+            )
+        finally:
+            await self.session.close()
+
+    async def exchange_status(self):
+        while True:
+            await asyncio.gather(*(
+                self.update_status(peer)
+                for peer in self.peers
+            ))
+            self.peer_status_event.set()
+            await asyncio.sleep(self.arguments['peer_status_interval'])
+
+    async def update_status(self, peer: str):
+        try:
+            async with self.session.get(f'{peer}/peer/status') as response:
+                response.raise_for_status()
+                self.peer_pending_tasks[peer] = (await response.json())['pendingTasks']
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError):
+            # unreachable peers are not stolen from
+            self.peer_pending_tasks[peer] = {}
+
+    async def steal_tasks(self):
+        '''Steals tasks for idle lease requests, biased towards the most
+        backlogged peer.'''
+
+        pending_tasks = self.api.pending_tasks
+        while True:
+            self.peer_status_event.clear()
+            stolen_tasks = 0
+            for task_type, waiters in list(pending_tasks.waiters.items()):
+                if len(pending_tasks.queues.get(task_type, ())) > 0:
+                    continue
+                peer = max(
+                    self.peers,
+                    key=lambda peer: self.peer_pending_tasks[peer].get(task_type, 0),
+                )
+                backlog = self.peer_pending_tasks[peer].get(task_type, 0)
+                if backlog == 0:
+                    continue
+                count = await self.steal(peer, task_type, min(len(waiters), backlog))
+                # stealing less than announced means the peer ran out
+                self.peer_pending_tasks[peer][task_type] = backlog - count if count > 0 else 0
+                stolen_tasks += count
+            if stolen_tasks == 0:
+                await self.peer_status_event.wait()
+
+    async def steal(self, peer: str, task_type: str, count: int) -> int:
+        '''Steals up to count pending tasks of a type from a peer and queues
+        them, returns the amount of stolen tasks.'''
+
+        try:
+            async with self.session.get(
+                f'{peer}/peer/steal',
+                headers={'Prefer': 'wait=1'},
+                params={
+                    'taskType': task_type,
+                    'count': count,
+                    'workerId': self.router_id,
+                },
+            ) as response:
+                if response.status != 200:
+                    return 0
+                tasks = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return 0
+
+        for task in tasks:
+            self.api.create_task(
+                task['taskType'],
+                self.api.encode_json_value(task['payload']),
+                # stolen tasks are never coalesced with local ones
+                (task['taskType'], f'peer:{peer}:{task["taskId"]}'),
+                task['priority'],
+                task['estimatedCost'],
+                task['requirements'],
+                task['affinityKey'],
+                task['producerId'],
+                (peer, task['taskId']),
+            ).subscriber_count += 1
+        await self.api.journal_commit()
+        return len(tasks)
+
+    def stolen_tasks(self) -> typing.Dict[str, list]:
+        '''Stolen tasks without result by their origin peer.'''
+
+        tasks = {}
+        for task in self.api.in_flight_tasks.values():
+            if task.origin is not None and not task.result_future.done():
+                tasks.setdefault(task.origin[0], []).append(task)
+        return tasks
+
+    async def send_heartbeats(self):
+        '''Heartbeats stolen tasks at their origin, tasks cancelled or lost
+        there are removed.'''
+
+        while True:
+            await asyncio.sleep(self.arguments['peer_heartbeat_interval'])
+            for peer, tasks in self.stolen_tasks().items():
+                for index in range(0, len(tasks), heartbeat_batch_size):
+                    await self.heartbeat(peer, tasks[index:index + heartbeat_batch_size])
+
+    async def heartbeat(self, peer: str, tasks: list):
+        try:
+            async with self.session.post(
+                f'{peer}/task/heartbeat',
+                params=[('workerId', self.router_id)] + [
+                    ('taskId', task.origin[1])
+                    for task in tasks
+                ],
+            ) as response:
+                status = response.status
+                cancelled_task_ids = (await response.json())['cancelledTaskIds'] if status in (200, 404) else []
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError):
+            # the origin times the tasks out if it stays unreachable
+            return
+
+        if status == 404 and len(tasks) > 1:
+            # find the tasks the origin does not know anymore
+            for task in tasks:
+                await self.heartbeat(peer, [task])
+            return
+        for task in tasks:
+            if task.origin[1] in cancelled_task_ids or status == 404:
+                self.api.unsubscribe_task(task)
+
+    def return_result(self, task, result_future: asyncio.Future):
+        '''Done callback of stolen tasks, returns their result or error to
+        their origin.'''
+
+        if result_future.cancelled():
+            return
+        if result_future.exception() is None:
+            path, body = '/result/set', result_future.result()
+        else:
+            path, body = '/result/error', result_future.exception().body
+        request = asyncio.ensure_future(self.post_result(task.origin, path, body))
+        self.result_requests.add(request)
+        request.add_done_callback(self.result_requests.discard)
+
+    async def post_result(self, origin: typing.Tuple[str, str], path: str, body: bytes):
+        peer, task_id = origin
+        for attempt in range(3):
+            try:
+                async with self.session.post(
+                    f'{peer}{path}',
+                    params={'taskId': task_id, 'workerId': self.router_id},
+                    data=body,
+                    headers={'Content-Type': 'application/json'},
+                ):
+                    # 404 if the origin requeued or removed the task meanwhile
+                    return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await asyncio.sleep(2 ** attempt)
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import pathlib
+import typing
+
+
+def encode_record(record: dict, raw_values: typing.Dict[str, bytes] = {}) -> bytes:
+    '''Encodes a journal record as one line of JSON. Raw values (payloads and
+    results) are spliced into the line without decoding them.'''
+
+    line = json.dumps(record, separators=(',', ':')).encode()
+    if len(raw_values) > 0:
+        line = line[:-1] + b''.join(
+            b',%s:%s' % (
+                json.dumps(name).encode(),
+                # newlines in JSON can only be whitespace between tokens
+                value.replace(b'\n', b' ').replace(b'\r', b' '),
+            )
+            for name, value in raw_values.items()
+        ) + b'}'
+    return line + b'\n'
+
+
+class Journal:
+    '''Append-only write-ahead log of state changes with snapshot compaction.
+
+    Records appended while a write is in progress are written and synced
+    together with the next write (group commit). Once the journal contains
+    more than compaction_interval records, the current state is written to a
+    snapshot file and the journal starts over. Snapshot and journal carry a
+    generation number, a journal of an older generation than the snapshot is
+    already contained in the snapshot.'''
+
+    def __init__(self, path: pathlib.Path, compaction_interval: int):
+        self.path = path
+        self.snapshot_path = path.with_name(path.name + '.snapshot')
+        self.compaction_interval = compaction_interval
+        self.generation = 0
+        # records in the journal file since the last snapshot
+        self.record_count = 0
+        # encoded records not yet written
+        self.pending_records = []
+        # resolved once the pending records are written and synced
+        self.commit_future: typing.Optional[asyncio.Future] = None
+        # resolved once the records currently being written are synced
+        self.writing_future: typing.Optional[asyncio.Future] = None
+        self.pending_records_event = asyncio.Event()
+
+    def read(self) -> typing.Iterator[dict]:
+        '''Yields the records of the snapshot and the journal in order.'''
+
+        snapshot_generation = 0
+        if self.snapshot_path.exists():
+            with self.snapshot_path.open('rb') as snapshot_file:
+                header = json.loads(snapshot_file.readline())
+                snapshot_generation = header['generation']
+                for line in snapshot_file:
+                    yield json.loads(line)
+        self.generation = snapshot_generation
+
+        if not self.path.exists():
+            return
+        with self.path.open('rb') as journal_file:
+            try:
+                header = json.loads(journal_file.readline())
+            except ValueError:
+                return
+            if header['generation'] != snapshot_generation:
+                return
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # last record may be incomplete after a crash
+                    return
+                yield record
+
+    def append(self, record: bytes):
+        '''Appends an encoded record, it is written with the next commit.'''
+
+        self.pending_records.append(record)
+        if self.commit_future is None:
+            self.commit_future = asyncio.get_running_loop().create_future()
+        self.pending_records_event.set()
+
+    async def commit(self):
+        '''Waits until all appended records are written and synced.'''
+
+        commit_future = self.commit_future or self.writing_future
+        if commit_future is not None:
+            await asyncio.shield(commit_future)
+
+    def write_file(self, path: pathlib.Path, lines: typing.Iterable[bytes]):
+        '''Atomically replaces the file at path with the given lines.'''
+
+        temporary_path = path.with_name(path.name + '.tmp')
+        with temporary_path.open('wb') as file:
+            file.writelines(lines)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    def write_snapshot(self, records: typing.Iterable[bytes]):
+        '''Replaces snapshot and journal by a snapshot of the given records.'''
+
+        self.generation += 1
+        header = encode_record({'generation': self.generation})
+        self.write_file(self.snapshot_path, [header, *records])
+        self.write_file(self.path, [header])
+        self.record_count = 0
+
+    def write_records(self, records: typing.List[bytes]):
+        with self.path.open('ab') as journal_file:
+            journal_file.writelines(records)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.record_count += len(records)
+
+    async def run(self, snapshot_records: typing.Callable[[], typing.Iterable[bytes]]):
+        '''Writer committing appended records in groups. snapshot_records
+        returns the records describing the current state.'''
+
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.pending_records_event.wait()
+            self.pending_records_event.clear()
+            records, commit_future = self.pending_records, self.commit_future
+            self.pending_records = []
+            self.commit_future = None
+            self.writing_future = commit_future
+
+            try:
+                if self.record_count + len(records) > self.compaction_interval:
+                    # the snapshot already contains the effect of the records
+                    await loop.run_in_executor(
+                        None,
+                        self.write_snapshot,
+                        list(snapshot_records()),
+                    )
+                else:
+                    await loop.run_in_executor(
+                        None,
+                        self.write_records,
+                        records,
+                    )
+            except asyncio.CancelledError:
+                commit_future.cancel()
+                raise
+            except Exception as error:
+                commit_future.set_exception(error)
+                raise
+            finally:
+                self.writing_future = None
+            commit_future.set_result(None)
@@ -0,0 +1,103 @@
+import asyncio
+import heapq
+import typing
+
+
+class LeaseTimeouts:
+    '''Deadlines of leases with a single background sweeper.
+
+    Deadlines are kept in a dict and a heap of (deadline, key) entries.
+    Renewing a lease only updates the deadline in the dict, outdated heap
+    entries are rescheduled or dropped lazily by the sweeper. All leases
+    expired at the same time are reported with one callback call.'''
+
+    def __init__(self, expired_callback: typing.Callable[[typing.List[typing.Hashable]], None]):
+        self.expired_callback = expired_callback
+        # key -> deadline (in event loop time)
+        self.deadlines = {}
+        # (deadline, key) entries, may contain outdated entries
+        self.heap = []
+        # set if the sweeper needs to wake up earlier than planned
+        self.wakeup_event = asyncio.Event()
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self.deadlines
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def _schedule(self, key: typing.Hashable, deadline: float):
+        if len(self.heap) == 0 or deadline < self.heap[0][0]:
+            self.wakeup_event.set()
+        heapq.heappush(self.heap, (deadline, key))
+
+        # compact if outdated entries dominate the heap
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [
+                (deadline, key)
+                for key, deadline in self.deadlines.items()
+            ]
+            heapq.heapify(self.heap)
+
+    def add(self, key: typing.Hashable, timeout: float):
+        '''Start a lease which expires after timeout seconds.'''
+
+        deadline = asyncio.get_running_loop().time() + timeout
+        self.deadlines[key] = deadline
+        self._schedule(key, deadline)
+
+    def renew(self, key: typing.Hashable, timeout: float) -> bool:
+        '''Move the deadline of a lease to timeout seconds from now. Returns
+        False if there is no lease with the given key.'''
+
+        try:
+            previous_deadline = self.deadlines[key]
+        except KeyError:
+            return False
+        deadline = asyncio.get_running_loop().time() + timeout
+        self.deadlines[key] = deadline
+        # later deadlines are picked up lazily by the sweeper
+        if deadline < previous_deadline:
+            self._schedule(key, deadline)
+        return True
+
+    def remove(self, key: typing.Hashable):
+        '''Stop a lease without expiring it.'''
+
+        self.deadlines.pop(key, None)
+
+    async def run(self):
+        '''Sweeper expiring leases whose deadline passed.'''
+
+        loop = asyncio.get_running_loop()
+        while True:
+            self.wakeup_event.clear()
+
+            now = loop.time()
+            expired_keys = []
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                deadline, key = heapq.heappop(self.heap)
+                try:
+                    current_deadline = self.deadlines[key]
+                except KeyError:
+                    # lease got removed
+                    continue
+                if current_deadline > now:
+                    # lease got renewed
+                    heapq.heappush(self.heap, (current_deadline, key))
+                    continue
+                del self.deadlines[key]
+                expired_keys.append(key)
+            if len(expired_keys) > 0:
+                self.expired_callback(expired_keys)
+
+            if len(self.heap) > 0:
+                try:
+                    await asyncio.wait_for(
+                        self.wakeup_event.wait(),
+                        self.heap[0][0] - loop.time(),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self.wakeup_event.wait()
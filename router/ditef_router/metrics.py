@@ -0,0 +1,165 @@
+import bisect
+import collections
+import time
+import typing
+
+# upper bounds in seconds, tasks take from milliseconds up to hours
+duration_buckets = (
+    0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800,
+    3600, 7200, 14400, 28800, 86400,
+)
+
+
+class Histogram:
+    '''Histogram with fixed buckets, only cumulated when rendered.'''
+
+    def __init__(self, buckets: typing.Sequence[float] = duration_buckets):
+        self.buckets = buckets
+        # observations per bucket, the last bucket is +Inf
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ServiceRate:
+    '''Rate of recent events per second, counted in a sliding window.'''
+
+    def __init__(self, window: float = 60):
+        self.window = window
+        # monotonic timestamps of the events within the window
+        self.timestamps = collections.deque()
+
+    def _expire(self, now: float):
+        while len(self.timestamps) > 0 and self.timestamps[0] <= now - self.window:
+            self.timestamps.popleft()
+
+    def record(self):
+        now = time.monotonic()
+        self.timestamps.append(now)
+        self._expire(now)
+
+    def rate(self) -> float:
+        self._expire(time.monotonic())
+        return len(self.timestamps) / self.window
+
+
+class TaskTypeMetrics:
+    '''Counters and histograms of the lifecycle of tasks of one task type.'''
+
+    counter_help = {
+        'submitted_tasks': 'Submissions by task producers',
+        'coalesced_tasks': 'Submissions attached to an in-flight task with the same key',
+        'cached_results': 'Submissions served from the result cache',
+        'assigned_tasks': 'Assignments of tasks to workers',
+        'completed_tasks': 'Tasks completed by workers',
+        'expired_heartbeats': 'Running tasks requeued because of a missed heartbeat',
+        'disconnected_tasks': 'Running tasks requeued because the WebSocket of their worker disconnected',
+        'removed_tasks': 'Tasks removed because no producer waits for them anymore',
+        'failed_attempts': 'Failed attempts reported by workers or detected by missed heartbeats',
+        'dead_lettered_tasks': 'Tasks moved to the dead letter tasks after too many failed attempts',
+        'rejected_tasks': 'Submissions rejected because the pending task limits were reached',
+        'speculative_tasks': 'Speculative copies of straggling tasks handed to idle workers',
+        'speculative_wins': 'Tasks whose speculative copy completed first',
+    }
+    histogram_help = {
+        'queued_seconds': 'Time from queueing to assignment of tasks',
+        'running_seconds': 'Time from assignment to completion of tasks',
+        'total_seconds': 'Time from submission to completion of tasks',
+    }
+
+    def __init__(self):
+        self.submitted_tasks = 0
+        self.coalesced_tasks = 0
+        self.cached_results = 0
+        self.assigned_tasks = 0
+        self.completed_tasks = 0
+        self.expired_heartbeats = 0
+        self.disconnected_tasks = 0
+        self.removed_tasks = 0
+        self.failed_attempts = 0
+        self.dead_lettered_tasks = 0
+        self.rejected_tasks = 0
+        self.speculative_tasks = 0
+        self.speculative_wins = 0
+        self.queued_seconds = Histogram()
+        self.running_seconds = Histogram()
+        self.total_seconds = Histogram()
+        # recent completions, used to estimate when rejected tasks fit
+        self.service_rate = ServiceRate()
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    '''Metrics of all task types in the Prometheus text exposition format.
+    Counters and histograms are updated incrementally, gauges are passed in
+    when rendering.'''
+
+    def __init__(self, prefix: str = 'ditef_router'):
+        self.prefix = prefix
+        # task type -> TaskTypeMetrics
+        self.task_types = {}
+        # recent completions of all task types
+        self.service_rate = ServiceRate()
+
+    def __getitem__(self, task_type: str) -> TaskTypeMetrics:
+        try:
+            return self.task_types[task_type]
+        except KeyError:
+            self.task_types[task_type] = TaskTypeMetrics()
+            return self.task_types[task_type]
+
+    def render(self, gauges: typing.Dict[str, typing.Tuple[str, typing.Dict[str, float]]]) -> str:
+        '''Renders all metrics, gauges are given as name -> (help, task type
+        -> value), the task type None renders a gauge without label.'''
+
+        lines = []
+
+        def add_metric(name: str, type: str, help: str, samples: typing.Iterable[typing.Tuple[str, str, float]]):
+            lines.append(f'# HELP {self.prefix}_{name} {help}')
+            lines.append(f'# TYPE {self.prefix}_{name} {type}')
+            for suffix, labels, value in samples:
+                if labels:
+                    labels = f'{{{labels}}}'
+                lines.append(f'{self.prefix}_{name}{suffix}{labels} {value}')
+
+        def task_type_label(task_type: typing.Optional[str]) -> str:
+            if task_type is None:
+                return ''
+            return f'task_type="{escape_label_value(task_type)}"'
+
+        for name, (help, values) in gauges.items():
+            add_metric(name, 'gauge', help, (
+                ('', task_type_label(task_type), value)
+                for task_type, value in values.items()
+            ))
+
+        for name, help in TaskTypeMetrics.counter_help.items():
+            add_metric(f'{name}_total', 'counter', help, (
+                ('', task_type_label(task_type), getattr(task_type_metrics, name))
+                for task_type, task_type_metrics in self.task_types.items()
+            ))
+
+        for name, help in TaskTypeMetrics.histogram_help.items():
+            samples = []
+            for task_type, task_type_metrics in self.task_types.items():
+                histogram: Histogram = getattr(task_type_metrics, name)
+                label = task_type_label(task_type)
+                cumulative_count = 0
+                for bucket, bucket_count in zip([*histogram.buckets, '+Inf'], histogram.bucket_counts):
+                    cumulative_count += bucket_count
+                    samples.append(
+                        ('_bucket', f'{label},le="{bucket}"', cumulative_count))
+                samples.append(('_sum', label, histogram.sum))
+                samples.append(('_count', label, histogram.count))
+            add_metric(name, 'histogram', help, samples)
+
+        return '\n'.join(lines) + '\n'
+
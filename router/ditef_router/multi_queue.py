@@ -1,48 +1,586 @@
 import asyncio
+import collections
+import heapq
+import itertools
+import math
 import random
 import typing
 
 
+class FifoQueue:
+    '''First in, first out (FIFO) queue backed by a deque. Removed items are
+    only marked as removed and skipped when they reach the front, which makes
+    removal of arbitrary items O(1).'''
+
+    def __init__(self):
+        # entries are one-element lists, removed entries become empty lists
+        self.entries = collections.deque()
+        # item -> entry in self.entries
+        self.entry_finder = {}
+
+    def __len__(self) -> int:
+        return len(self.entry_finder)
+
+    def __contains__(self, item) -> bool:
+        return item in self.entry_finder
+
+    def __iter__(self):
+        '''Iterates over the items in queue order.'''
+
+        for entry in self.entries:
+            if entry:
+                yield entry[0]
+
+    def front_rank(self) -> float:
+        '''All items have the same rank, queues of different types are chosen
+        uniformly.'''
+
+        return 0
+
+    def find(self, accepts: typing.Callable[[typing.Any], bool]) -> typing.Tuple[float, typing.Any]:
+        '''Returns rank and item of the first accepted item in queue order.
+        Raises IndexError if no item is accepted.'''
+
+        for item in self:
+            if accepts(item):
+                return 0, item
+        raise IndexError('No item accepted')
+
+    def push(self, item):
+        '''Append an item to the back of the queue.'''
+
+        entry = [item]
+        self.entry_finder[item] = entry
+        self.entries.append(entry)
+
+    def push_front(self, item):
+        '''Put an item back to the front of the queue.'''
+
+        entry = [item]
+        self.entry_finder[item] = entry
+        self.entries.appendleft(entry)
+
+    def pop(self):
+        '''Remove and return the item at the front of the queue. Raises
+        IndexError if the queue is empty.'''
+
+        while True:
+            entry = self.entries.popleft()
+            if entry:
+                item = entry[0]
+                del self.entry_finder[item]
+                return item
+
+    def take(self, item):
+        '''Remove an item returned by find() to hand it out.'''
+
+        self.remove(item)
+
+    def remove(self, item):
+        '''Remove the given item from the queue. Raises ValueError if the item
+        is not contained.'''
+
+        try:
+            entry = self.entry_finder.pop(item)
+        except KeyError:
+            raise ValueError('Item not in queue')
+        entry.clear()
+
+        # compact if the removed entries dominate the deque
+        if len(self.entries) > 2 * len(self.entry_finder) + 64:
+            self.entries = collections.deque(
+                entry for entry in self.entries if entry
+            )
+
+
+class PriorityQueue:
+    '''Queue returning the item with the lowest rank first and items of equal
+    rank in first in, first out (FIFO) order. Backed by a heap, removed items
+    are only marked as removed like in FifoQueue.'''
+
+    def __init__(self, rank: typing.Callable[[typing.Any], float]):
+        self.rank = rank
+        # entries are [rank, sequence number, item] lists, removed entries
+        # become [rank, sequence number]
+        self.entries = []
+        # item -> entry in self.entries
+        self.entry_finder = {}
+        self.back_sequence_numbers = itertools.count()
+        self.front_sequence_numbers = itertools.count(-1, -1)
+
+    def __len__(self) -> int:
+        return len(self.entry_finder)
+
+    def __contains__(self, item) -> bool:
+        return item in self.entry_finder
+
+    def _push_with_sequence_number(self, item, sequence_number: int):
+        entry = [self.rank(item), sequence_number, item]
+        self.entry_finder[item] = entry
+        heapq.heappush(self.entries, entry)
+
+    def _drop_removed_entries(self):
+        while self.entries and len(self.entries[0]) < 3:
+            heapq.heappop(self.entries)
+
+    def _entries_in_order(self):
+        '''Iterates over the entries in queue order without popping them,
+        walks the heap with a second heap of the frontier of visited
+        entries.'''
+
+        # (entry, index in self.entries), entries are never equal
+        frontier = [(self.entries[0], 0)] if self.entries else []
+        while frontier:
+            entry, index = heapq.heappop(frontier)
+            for child_index in (2 * index + 1, 2 * index + 2):
+                if child_index < len(self.entries):
+                    heapq.heappush(
+                        frontier, (self.entries[child_index], child_index))
+            if len(entry) == 3:
+                yield entry
+
+    def __iter__(self):
+        '''Iterates over the items in queue order.'''
+
+        for entry in self._entries_in_order():
+            yield entry[2]
+
+    def front_rank(self) -> float:
+        '''Rank of the item which would be returned by pop().'''
+
+        self._drop_removed_entries()
+        return self.entries[0][0]
+
+    def find(self, accepts: typing.Callable[[typing.Any], bool]) -> typing.Tuple[float, typing.Any]:
+        '''Returns rank and item of the first accepted item in queue order.
+        Raises IndexError if no item is accepted.'''
+
+        for rank, _, item in self._entries_in_order():
+            if accepts(item):
+                return rank, item
+        raise IndexError('No item accepted')
+
+    def push(self, item):
+        '''Insert an item behind all items of lower or equal rank.'''
+
+        self._push_with_sequence_number(item, next(self.back_sequence_numbers))
+
+    def push_front(self, item):
+        '''Put an item back in front of all items of equal rank.'''
+
+        self._push_with_sequence_number(
+            item, next(self.front_sequence_numbers))
+
+    def pop(self):
+        '''Remove and return the item with the lowest rank. Raises IndexError
+        if the queue is empty.'''
+
+        self._drop_removed_entries()
+        _, _, item = heapq.heappop(self.entries)
+        del self.entry_finder[item]
+        return item
+
+    def take(self, item):
+        '''Remove an item returned by find() to hand it out.'''
+
+        self.remove(item)
+
+    def remove(self, item):
+        '''Remove the given item from the queue. Raises ValueError if the item
+        is not contained.'''
+
+        try:
+            entry = self.entry_finder.pop(item)
+        except KeyError:
+            raise ValueError('Item not in queue')
+        entry.pop()
+
+        # compact if the removed entries dominate the heap
+        if len(self.entries) > 2 * len(self.entry_finder) + 64:
+            self.entries = [entry for entry in self.entries if len(entry) == 3]
+            heapq.heapify(self.entries)
+
+
+class FairQueue:
+    '''Queue shared fairly between flows (e.g. task producers) by deficit
+    round robin. Each flow has its own queue created by queue_factory which
+    orders the items of the flow. The flows take turns in round robin order,
+    a flow gets weight items handed out per turn (weights below 1 take
+    several rounds for one item). Removed items which were not handed out do
+    not count.'''
+
+    def __init__(self, flow: typing.Callable[[typing.Any], typing.Hashable], weight: typing.Callable[[typing.Hashable], float], queue_factory: typing.Callable[[], typing.Any] = FifoQueue):
+        self.flow = flow
+        self.weight = weight
+        self.queue_factory = queue_factory
+        # flows with queued items in round robin order -> queue of the flow,
+        # the first flow has the turn
+        self.flows = collections.OrderedDict()
+        # flow -> items the flow may still hand out in its turn
+        self.deficits = {}
+        # whether the first flow started its turn (got its weight added to
+        # its deficit)
+        self.turn_started = False
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __contains__(self, item) -> bool:
+        queue = self.flows.get(self.flow(item))
+        return queue is not None and item in queue
+
+    def _start_turn(self):
+        '''Passes the turn on until the first flow may hand out an item.'''
+
+        while True:
+            flow = next(iter(self.flows))
+            if not self.turn_started:
+                self.turn_started = True
+                self.deficits[flow] += self.weight(flow)
+            if self.deficits[flow] >= 1:
+                return
+            self.flows.move_to_end(flow)
+            self.turn_started = False
+
+    def _queues_in_order(self):
+        if len(self.flows) > 0:
+            self._start_turn()
+        return self.flows.values()
+
+    def __iter__(self):
+        '''Iterates over the items in queue order, flow after flow.'''
+
+        for queue in list(self._queues_in_order()):
+            yield from queue
+
+    def front_rank(self) -> float:
+        '''Rank of the item which would be returned by pop() within its
+        flow.'''
+
+        return next(iter(self._queues_in_order())).front_rank()
+
+    def find(self, accepts: typing.Callable[[typing.Any], bool]) -> typing.Tuple[float, typing.Any]:
+        '''Returns rank and item of the first accepted item of the flow
+        having the turn, if it has none of the following flows. Raises
+        IndexError if no item is accepted.'''
+
+        for queue in self._queues_in_order():
+            try:
+                return queue.find(accepts)
+            except IndexError:
+                pass
+        raise IndexError('No item accepted')
+
+    def _remove_from_flow(self, flow: typing.Hashable, item):
+        try:
+            queue = self.flows[flow]
+        except KeyError:
+            raise ValueError('Item not in queue')
+        queue.remove(item)
+        self.length -= 1
+        # flows start over once they ran out of items
+        if len(queue) == 0:
+            if flow == next(iter(self.flows)):
+                self.turn_started = False
+            del self.flows[flow]
+            del self.deficits[flow]
+
+    def _get_queue_of_flow(self, flow: typing.Hashable):
+        try:
+            return self.flows[flow]
+        except KeyError:
+            self.deficits[flow] = 0
+            self.flows[flow] = self.queue_factory()
+            return self.flows[flow]
+
+    def push(self, item):
+        '''Insert an item into the queue of its flow, new flows get their
+        turn after all other flows.'''
+
+        self._get_queue_of_flow(self.flow(item)).push(item)
+        self.length += 1
+
+    def push_front(self, item):
+        '''Put an item back to the front of the queue of its flow, new flows
+        get the next turn.'''
+
+        flow = self.flow(item)
+        if flow not in self.flows:
+            self._get_queue_of_flow(flow)
+            self.flows.move_to_end(flow, last=False)
+            self.turn_started = False
+        self.flows[flow].push_front(item)
+        self.length += 1
+
+    def pop(self):
+        '''Remove and return the front item of the flow having the turn.
+        Raises IndexError if the queue is empty.'''
+
+        if self.length == 0:
+            raise IndexError('Queue is empty')
+        _, item = self.find(lambda item: True)
+        self.take(item)
+        return item
+
+    def take(self, item):
+        '''Remove an item returned by find() to hand it out, it counts
+        against the turn of its flow.'''
+
+        flow = self.flow(item)
+        self._remove_from_flow(flow, item)
+        if flow in self.deficits:
+            self.deficits[flow] -= 1
+
+    def remove(self, item):
+        '''Remove the given item from the queue. Raises ValueError if the item
+        is not contained.'''
+
+        self._remove_from_flow(self.flow(item), item)
+
+
 class MultiQueue:
-    '''Multiple first in, first out (FIFO) queues with types.'''
+    '''Multiple queues with types, first in, first out (FIFO) queues unless
+    another queue_factory (e.g. creating PriorityQueue) is given.
+
+    Pending pop() calls are registered as waiters for each of their types. A
+    push() hands the item directly to the longest waiting waiter of its type
+    (waking up exactly one pop() call) and only queues it if nobody waits.
+    pop() calls may only accept some items (e.g. matching the resources of a
+    worker), other items are skipped and left to other pop() calls.
+
+    The amount of queued items and their size (given by item_size) can be
+    limited in total and per type, 0 means unlimited. Limits are not enforced
+    by push(), callers check overflow() before admitting new items.'''
 
-    def __init__(self, maxsize=0):
+    def __init__(self, queue_factory: typing.Callable[[], typing.Any] = FifoQueue, maxsize: int = 0, maxbytes: int = 0, maxsize_per_type: int = 0, maxbytes_per_type: int = 0, item_size: typing.Callable[[typing.Any], int] = lambda item: 0):
+        self.queue_factory = queue_factory
         self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.maxsize_per_type = maxsize_per_type
+        self.maxbytes_per_type = maxbytes_per_type
+        self.item_size = item_size
+        # type -> queue created by queue_factory
         self.queues = {}
-        self.put_event = asyncio.Event()
+        # type -> OrderedDict of waiter futures in order of arrival -> accepts
+        # predicate of the waiting pop() call (None accepts all items)
+        self.waiters = {}
+        # type -> size of queued items
+        self.sizes_in_bytes = {}
+        self.size_in_bytes = 0
 
-    def _get_queue_of_type(self, type: typing.Hashable) -> list:
+    def _get_queue_of_type(self, type: typing.Hashable):
         try:
             return self.queues[type]
         except KeyError:
-            self.queues[type] = []
+            self.queues[type] = self.queue_factory()
             return self.queues[type]
 
+    def _add_size(self, type: typing.Hashable, item, sign: int):
+        size = sign * self.item_size(item)
+        self.sizes_in_bytes[type] = self.sizes_in_bytes.get(type, 0) + size
+        self.size_in_bytes += size
+
+    def overflow(self, type: typing.Hashable, item) -> typing.Tuple[int, int]:
+        '''Returns the amount of items of the given type and of items of all
+        types which have to be popped before the item can be queued without
+        exceeding the limits, (0, 0) if it can be queued right away. Items
+        handed off to waiting pop() calls accepting them are never queued.'''
+
+        if self._accepting_waiter(type, item) is not None:
+            return 0, 0
+        size = self.item_size(item)
+        return (
+            self._overflow(
+                len(self.queues.get(type, ())),
+                self.sizes_in_bytes.get(type, 0),
+                size,
+                self.maxsize_per_type,
+                self.maxbytes_per_type,
+            ),
+            self._overflow(
+                sum(len(queue) for queue in self.queues.values()),
+                self.size_in_bytes,
+                size,
+                self.maxsize,
+                self.maxbytes,
+            ),
+        )
+
+    def _overflow(self, length: int, size_in_bytes: int, size: int, maxsize: int, maxbytes: int) -> int:
+        overflow = 0
+        if maxsize > 0:
+            overflow = max(overflow, length + 1 - maxsize)
+        if maxbytes > 0 and size_in_bytes + size > maxbytes:
+            # assuming items of average size are popped
+            average_size = size_in_bytes / length if length > 0 else size
+            overflow = max(overflow, math.ceil(
+                (size_in_bytes + size - maxbytes) / max(average_size, 1)))
+        return overflow
+
+    def _accepting_waiter(self, type: typing.Hashable, item) -> typing.Optional[asyncio.Future]:
+        '''Returns the longest waiting waiter of the given type which accepts
+        the item, None if there is no such waiter.'''
+
+        waiters = self.waiters.get(type)
+        if not waiters:
+            return None
+        # waiters of cancelled pop() calls are removed lazily
+        done_waiters = []
+        accepting_waiter = None
+        for waiter, accepts in waiters.items():
+            if waiter.done():
+                done_waiters.append(waiter)
+            elif accepts is None or accepts(item):
+                accepting_waiter = waiter
+                break
+        for waiter in done_waiters:
+            del waiters[waiter]
+        return accepting_waiter
+
+    def _hand_off(self, type: typing.Hashable, item) -> bool:
+        '''Pass the item to the longest waiting pop() call of the given type
+        which accepts it. Returns False if there is no such waiter.'''
+
+        waiter = self._accepting_waiter(type, item)
+        if waiter is None:
+            return False
+        del self.waiters[type][waiter]
+        waiter.set_result((type, item))
+        return True
+
+    def hand_off_queued(self, type: typing.Hashable, item) -> bool:
+        '''Pass a queued item to a waiting pop() call which accepts it by now
+        (e.g. if accepts depends on the time the item waited). Returns False
+        if the item is not queued or no waiter accepts it.'''
+
+        queue = self.queues.get(type)
+        if queue is None or item not in queue:
+            return False
+        if self._accepting_waiter(type, item) is None:
+            return False
+        queue.take(item)
+        self._add_size(type, item, -1)
+        return self._hand_off(type, item)
+
+    def offer(self, type: typing.Hashable, item) -> bool:
+        '''Hand an item off to a pop() call waiting for the given type which
+        accepts it, the item is never queued. Returns False if there is no
+        such waiter.'''
+
+        return self._hand_off(type, item)
+
     def push(self, type: typing.Hashable, item):
-        '''Put an item into the queue of the given type. If the queue is full,
-        wait until a free slot is available before adding the item.'''
+        '''Put an item into the queue of the given type or hand it off to
+        exactly one pop() call waiting for this type.'''
 
-        self._get_queue_of_type(type).append(item)
+        if not self._hand_off(type, item):
+            self._get_queue_of_type(type).push(item)
+            self._add_size(type, item, 1)
 
-        # trigger put event to wake up pending get() calls
-        self.put_event.set()
-        self.put_event.clear()
+    def _pop_nowait(self, types: typing.List[typing.Hashable], accepts: typing.Optional[typing.Callable[[typing.Any], bool]] = None):
+        '''Remove and return an accepted item from a queue of one of the given
+        types, the first accepted item of each queue is chosen uniformly
+        between the queues with the lowest rank of that item. Raises
+        IndexError if no queue of the given types contains an accepted
+        item.'''
 
-    async def pop(self, types: typing.Iterable[typing.Hashable]):
+        if accepts is None:
+            # the first item of each queue is accepted
+            candidates = [
+                (type, self.queues[type].front_rank(), None)
+                for type in types
+                if len(self.queues.get(type, ())) > 0
+            ]
+        else:
+            candidates = []
+            for type in types:
+                if len(self.queues.get(type, ())) > 0:
+                    try:
+                        rank, item = self.queues[type].find(accepts)
+                    except IndexError:
+                        continue
+                    candidates.append((type, rank, item))
+        if len(candidates) == 0:
+            raise IndexError('All queues are empty')
+        lowest_rank = min(rank for _, rank, _ in candidates)
+        type, _, item = random.choice([
+            candidate
+            for candidate in candidates
+            if candidate[1] == lowest_rank
+        ])
+        if accepts is None:
+            item = self.queues[type].pop()
+        else:
+            self.queues[type].take(item)
+        self._add_size(type, item, -1)
+        return item
+
+    async def pop(self, types: typing.Iterable[typing.Hashable], accepts: typing.Optional[typing.Callable[[typing.Any], bool]] = None):
         '''Remove and return an item from a queue of one of the given types.
-        If all queues of the given types are empty, wait until an item is
-        available.'''
+        If accepts is given, only items for which it returns True are
+        returned. If no queue of the given types contains an accepted item,
+        wait until one is available.'''
 
-        types_copy = list(types)
-        while True:
-            random.shuffle(types_copy)
-            for type in types_copy:
-                queue = self._get_queue_of_type(type)
-                if len(queue) > 0:
-                    return queue.pop(0)
-            await self.put_event.wait()
+        types = list(types)
+
+        try:
+            return self._pop_nowait(types, accepts)
+        except IndexError:
+            pass
+
+        # register as waiter for all given types
+        waiter = asyncio.get_running_loop().create_future()
+        for type in types:
+            self.waiters.setdefault(
+                type,
+                collections.OrderedDict(),
+            )[waiter] = accepts
+        try:
+            type, item = await waiter
+            return item
+        except asyncio.CancelledError:
+            # an item may have been handed off right before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                type, item = waiter.result()
+                if not self._hand_off(type, item):
+                    self._get_queue_of_type(type).push_front(item)
+                    self._add_size(type, item, 1)
+            raise
+        finally:
+            for type in types:
+                try:
+                    waiters = self.waiters[type]
+                except KeyError:
+                    continue
+                waiters.pop(waiter, None)
+                if len(waiters) == 0:
+                    del self.waiters[type]
+
+    async def pop_many(self, types: typing.Iterable[typing.Hashable], count: int, accepts: typing.Optional[typing.Callable[[typing.Any], bool]] = None) -> list:
+        '''Remove and return up to count accepted items from queues of the
+        given types. If no queue of the given types contains an accepted
+        item, wait until at least one is available.'''
+
+        types = list(types)
+        items = [await self.pop(types, accepts)]
+        try:
+            while len(items) < count:
+                items.append(self._pop_nowait(types, accepts))
+        except IndexError:
+            pass
+        return items
+
+    def items(self):
+        '''Iterates over (type, item) tuples of all queued items, items of
+        each type in queue order.'''
+
+        for type, queue in self.queues.items():
+            for item in queue:
+                yield type, item
 
     def remove(self, type: typing.Hashable, item):
         '''Removes the given item from a queue of the given type.'''
 
         self._get_queue_of_type(type).remove(item)
+        self._add_size(type, item, -1)
@@ -0,0 +1,35 @@
+import collections
+import typing
+
+
+class ResultCache:
+    '''Least recently used (LRU) cache of results. The least recently used
+    results are evicted as soon as more than maxsize results or more than
+    maxbytes bytes of results are cached. A limit of 0 disables caching.'''
+
+    def __init__(self, maxsize: int, maxbytes: int):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        # key -> JSON bytes in order of use
+        self.results = collections.OrderedDict()
+        self.size_in_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def __getitem__(self, key: typing.Hashable) -> bytes:
+        result = self.results[key]
+        self.results.move_to_end(key)
+        return result
+
+    def __setitem__(self, key: typing.Hashable, result: bytes):
+        previous_result = self.results.pop(key, None)
+        if previous_result is not None:
+            self.size_in_bytes -= len(previous_result)
+        self.results[key] = result
+        self.size_in_bytes += len(result)
+
+        # evict least recently used results
+        while len(self.results) > 0 and (len(self.results) > self.maxsize or self.size_in_bytes > self.maxbytes):
+            _, evicted_result = self.results.popitem(last=False)
+            self.size_in_bytes -= len(evicted_result)
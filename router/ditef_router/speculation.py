@@ -0,0 +1,102 @@
+import asyncio
+import collections
+import time
+import typing
+
+# completed tasks per task type the runtime distribution is estimated from
+runtime_window = 200
+# below this amount of completed tasks stragglers are not told apart
+minimum_samples = 20
+# interval in seconds in which running tasks are checked for stragglers
+check_interval = 1.0
+
+
+class Speculation:
+    '''Speculative execution of straggling tasks (e.g. on a throttled
+    worker).
+
+    The runtimes of recently completed tasks are kept per task type. A running
+    task is a straggler once it ran speculation_factor times longer than the
+    95th percentile of its task type. A copy of a straggler is handed to an
+    idle worker waiting for its task type. Both attempts share the result,
+    the first result wins and the worker of the other attempt is told to
+    abort it by the heartbeat response. Copies are never journaled.
+
+    The time spent on copies is limited to speculation_budget percent of the
+    time spent on all other attempts.'''
+
+    def __init__(self, api):
+        self.api = api
+        self.arguments = api.arguments
+        # task type -> runtimes in seconds of recently completed tasks
+        self.runtimes: typing.Dict[str, collections.deque] = {}
+        # running time of finished attempts, copies and other attempts
+        self.speculative_seconds = 0.0
+        self.regular_seconds = 0.0
+
+    def observe(self, task_type: str, seconds: float):
+        '''Records the runtime of a completed task.'''
+
+        try:
+            runtimes = self.runtimes[task_type]
+        except KeyError:
+            runtimes = self.runtimes[task_type] = collections.deque(
+                maxlen=runtime_window)
+        runtimes.append(seconds)
+
+    def account(self, task, seconds: float):
+        '''Records the running time of a finished attempt.'''
+
+        if task.speculated_task is None:
+            self.regular_seconds += seconds
+        else:
+            self.speculative_seconds += seconds
+
+    def quantile(self, task_type: str, q: float) -> typing.Optional[float]:
+        '''Nearest-rank quantile of the recent runtimes of a task type, None
+        if too few tasks completed.'''
+
+        runtimes = self.runtimes.get(task_type, ())
+        if len(runtimes) < minimum_samples:
+            return None
+        return sorted(runtimes)[min(int(q * len(runtimes)), len(runtimes) - 1)]
+
+    async def run(self):
+        '''Checks the running tasks for stragglers until cancelled.'''
+
+        while True:
+            await asyncio.sleep(check_interval)
+            self.speculate()
+
+    def speculate(self):
+        '''Launches copies of stragglers while idle workers wait and the
+        budget allows.'''
+
+        now = time.monotonic()
+        running_tasks = list(self.api.running_tasks.values())
+        speculative_seconds = self.speculative_seconds
+        regular_seconds = self.regular_seconds
+        for task in running_tasks:
+            if task.speculated_task is None:
+                regular_seconds += now - task.assigned_time
+            else:
+                speculative_seconds += now - task.assigned_time
+        budget = self.arguments['speculation_budget'] / 100
+
+        # thresholds per task type, None if the task type has too few samples
+        thresholds = {}
+        for task in running_tasks:
+            # tasks are copied at most once
+            if task.speculated_task is not None or task.speculative_copy is not None:
+                continue
+            if task.type not in thresholds:
+                percentile = self.quantile(task.type, 0.95)
+                thresholds[task.type] = None if percentile is None else percentile * self.arguments['speculation_factor']
+            threshold = thresholds[task.type]
+            if threshold is None or now - task.assigned_time < threshold:
+                continue
+            if speculative_seconds >= budget * regular_seconds:
+                return
+            if self.api.speculate_task(task):
+                # reserve the typical runtime of the copy
+                speculative_seconds += self.quantile(task.type, 0.5)
@@ -0,0 +1,134 @@
+import collections
+import time
+import typing
+from . import lease_timeouts
+
+# affinity keys remembered per worker, the least recently used are forgotten
+maximum_warm_keys = 16
+
+
+class Worker:
+    '''Worker known to the router. Details are given on registration, workers
+    seen without registration (e.g. after a restart of the router) are only
+    known by their ID.'''
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self.hostname: typing.Optional[str] = None
+        self.task_types: typing.List[str] = []
+        # maximum amount of tasks run at once
+        self.concurrency: typing.Optional[int] = None
+        # resource hints, resource name -> amount (e.g. cpus, memory in bytes)
+        self.resources: typing.Dict[str, float] = {}
+        # arbitrary capabilities (e.g. gpu)
+        self.labels: typing.List[str] = []
+        # affinity keys of data the worker has cached (OrderedDict used as
+        # ordered set, least recently used first)
+        self.warm_keys = collections.OrderedDict()
+        # wall clock timestamps
+        self.registered_time = time.time()
+        self.last_seen_time = self.registered_time
+        # open WebSocket connections of the worker
+        self.connections = 0
+        self.completed_tasks = 0
+        # reported errors and missed heartbeats
+        self.failed_tasks = 0
+        # sum of the running times of completed tasks
+        self.running_seconds = 0.0
+
+    def satisfies(self, requirements: dict) -> bool:
+        '''Whether the worker has at least the required amount of each
+        resource and all required labels. Resources which are not given by
+        the worker are not available.'''
+
+        return (
+            all(
+                self.resources.get(name, 0) >= amount
+                for name, amount in requirements['resources'].items()
+            )
+            and all(
+                label in self.labels
+                for label in requirements['labels']
+            )
+        )
+
+    def mean_task_seconds(self) -> typing.Optional[float]:
+        if self.completed_tasks == 0:
+            return None
+        return self.running_seconds / self.completed_tasks
+
+
+class WorkerRegistry:
+    '''Workers by ID. Workers which were not seen for expiry seconds and are
+    not connected are forgotten.'''
+
+    def __init__(self, expiry: float):
+        self.expiry = expiry
+        # worker ID -> worker
+        self.workers: typing.Dict[str, Worker] = {}
+        # affinity key -> amount of workers having it warm
+        self.warm_key_counts: typing.Dict[str, int] = {}
+        self.timeouts = lease_timeouts.LeaseTimeouts(self.expire_workers)
+
+    def __len__(self) -> int:
+        return len(self.workers)
+
+    def get(self, worker_id: typing.Optional[str]) -> typing.Optional[Worker]:
+        return self.workers.get(worker_id)
+
+    def values(self) -> typing.Iterable[Worker]:
+        return self.workers.values()
+
+    def see(self, worker_id: str) -> Worker:
+        '''Updates the last seen time of a worker, unknown workers are
+        added.'''
+
+        try:
+            worker = self.workers[worker_id]
+        except KeyError:
+            worker = self.workers[worker_id] = Worker(worker_id)
+        worker.last_seen_time = time.time()
+        if not self.timeouts.renew(worker_id, self.expiry):
+            self.timeouts.add(worker_id, self.expiry)
+        return worker
+
+    def warm_up(self, worker: Worker, key: str):
+        '''Marks an affinity key as warm on a worker.'''
+
+        if key in worker.warm_keys:
+            worker.warm_keys.move_to_end(key)
+            return
+        worker.warm_keys[key] = None
+        self.warm_key_counts[key] = self.warm_key_counts.get(key, 0) + 1
+        while len(worker.warm_keys) > maximum_warm_keys:
+            self._cool_down(worker.warm_keys.popitem(last=False)[0])
+
+    def set_warm_keys(self, worker: Worker, keys: typing.List[str]):
+        '''Replaces the warm affinity keys of a worker.'''
+
+        for key in worker.warm_keys:
+            self._cool_down(key)
+        worker.warm_keys.clear()
+        for key in keys:
+            self.warm_up(worker, key)
+
+    def _cool_down(self, key: str):
+        self.warm_key_counts[key] -= 1
+        if self.warm_key_counts[key] == 0:
+            del self.warm_key_counts[key]
+
+    def is_warm_anywhere(self, key: str) -> bool:
+        return key in self.warm_key_counts
+
+    def expire_workers(self, worker_ids: typing.List[str]):
+        for worker_id in worker_ids:
+            # idle connected workers do not send anything but are still there
+            if self.workers[worker_id].connections > 0:
+                self.timeouts.add(worker_id, self.expiry)
+            else:
+                self.set_warm_keys(self.workers.pop(worker_id), [])
+
+    async def run(self):
+        '''Sweeper forgetting expired workers.'''
+
+        await self.timeouts.run()
@@ -1,5 +1,5 @@
 import asyncio
-from . import successful_task, heartbeating, prefer_header, task_type, task_results, task_producer, multiple_workers, multiple_tasks, multiple_workers_multiple_tasks, many_tasks_many_workers, task_producer_cancellation
+from . import successful_task, heartbeating, prefer_header, task_type, task_results, task_producer, multiple_workers, multiple_tasks, multiple_workers_multiple_tasks, many_tasks_many_workers, task_producer_cancellation, task_run_batch, task_lease, blob, result_set_and_get, task_submit, task_deduplication, scheduling_policy, journal, metrics, worker_websocket, task_failure, admission_control, worker_registry, resource_matching, affinity, federation, fair_queuing, speculation
 
 
 def main():
@@ -16,6 +16,8 @@ def main():
     asyncio.run(heartbeating.test_missing_task_id_in_heartbeat())
     print('heartbeating.test_non_existing_task_id_in_heartbeat...')
     asyncio.run(heartbeating.test_non_existing_task_id_in_heartbeat())
+    print('heartbeating.test_negotiated_lease_duration...')
+    asyncio.run(heartbeating.test_negotiated_lease_duration())
 
     print('prefer_header.test_missing_prefer_header...')
     asyncio.run(prefer_header.test_missing_prefer_header())
@@ -36,6 +38,8 @@ def main():
 
     print('task_producer.test_missing_task_type_from_producer...')
     asyncio.run(task_producer.test_missing_task_type_from_producer())
+    print('task_producer.test_malformed_payload_from_producer...')
+    asyncio.run(task_producer.test_malformed_payload_from_producer())
 
     print('multiple_workers.test_multiple_workers_one_task...')
     asyncio.run(multiple_workers.test_multiple_workers_one_task())
@@ -73,3 +77,107 @@ def main():
     asyncio.run(task_producer_cancellation.test_cancellation_before_assignment())
     print('task_producer_cancellation.test_cancellation_after_assignment...')
     asyncio.run(task_producer_cancellation.test_cancellation_after_assignment())
+    print('task_producer_cancellation.test_cancellation_reported_by_heartbeat...')
+    asyncio.run(task_producer_cancellation.test_cancellation_reported_by_heartbeat())
+
+    print('task_run_batch.test_batch_results_in_completion_order...')
+    asyncio.run(task_run_batch.test_batch_results_in_completion_order())
+    print('task_run_batch.test_missing_task_type_in_batch...')
+    asyncio.run(task_run_batch.test_missing_task_type_in_batch())
+    print('task_run_batch.test_api_client_run_many...')
+    asyncio.run(task_run_batch.test_api_client_run_many())
+
+    print('task_lease.test_lease_multiple_tasks...')
+    asyncio.run(task_lease.test_lease_multiple_tasks())
+    print('task_lease.test_malformed_count...')
+    asyncio.run(task_lease.test_malformed_count())
+    print('task_lease.test_non_existing_task_id_in_result_batch...')
+    asyncio.run(task_lease.test_non_existing_task_id_in_result_batch())
+    print('task_lease.test_release_tasks...')
+    asyncio.run(task_lease.test_release_tasks())
+
+    print('blob.test_blob_set_and_get...')
+    asyncio.run(blob.test_blob_set_and_get())
+    print('blob.test_malformed_blob...')
+    asyncio.run(blob.test_malformed_blob())
+    print('blob.test_api_client_blobs_after_restart...')
+    asyncio.run(blob.test_api_client_blobs_after_restart())
+
+    print('result_set_and_get.test_result_set_and_task_get...')
+    asyncio.run(result_set_and_get.test_result_set_and_task_get())
+    print('result_set_and_get.test_malformed_result_set_and_task_get...')
+    asyncio.run(result_set_and_get.test_malformed_result_set_and_task_get())
+
+    print('task_submit.test_submit_and_wait...')
+    asyncio.run(task_submit.test_submit_and_wait())
+    print('task_submit.test_result_ttl...')
+    asyncio.run(task_submit.test_result_ttl())
+    print('task_submit.test_cancel_submitted_task...')
+    asyncio.run(task_submit.test_cancel_submitted_task())
+    print('task_submit.test_api_client_run_multiplexed...')
+    asyncio.run(task_submit.test_api_client_run_multiplexed())
+    print('task_submit.test_api_client_polls_new_handles...')
+    asyncio.run(task_submit.test_api_client_polls_new_handles())
+
+    print('task_deduplication.test_identical_payloads_share_task...')
+    asyncio.run(task_deduplication.test_identical_payloads_share_task())
+    print('task_deduplication.test_idempotency_key...')
+    asyncio.run(task_deduplication.test_idempotency_key())
+    print('task_deduplication.test_cancellation_of_shared_task...')
+    asyncio.run(task_deduplication.test_cancellation_of_shared_task())
+
+    print('scheduling_policy.test_scheduling_policies...')
+    asyncio.run(scheduling_policy.test_scheduling_policies())
+    print('scheduling_policy.test_malformed_scheduling_parameters...')
+    asyncio.run(scheduling_policy.test_malformed_scheduling_parameters())
+
+    print('journal.test_restore_after_crash...')
+    asyncio.run(journal.test_restore_after_crash())
+    print('journal.test_journal_compaction...')
+    asyncio.run(journal.test_journal_compaction())
+
+    print('metrics.test_task_lifecycle_metrics...')
+    asyncio.run(metrics.test_task_lifecycle_metrics())
+
+    print('worker_websocket.test_websocket_worker...')
+    asyncio.run(worker_websocket.test_websocket_worker())
+    print('worker_websocket.test_websocket_disconnect_requeues_tasks...')
+    asyncio.run(worker_websocket.test_websocket_disconnect_requeues_tasks())
+
+    print('task_failure.test_failed_task_is_requeued...')
+    asyncio.run(task_failure.test_failed_task_is_requeued())
+    print('task_failure.test_dead_letter_tasks...')
+    asyncio.run(task_failure.test_dead_letter_tasks())
+    print('task_failure.test_batch_errors...')
+    asyncio.run(task_failure.test_batch_errors())
+    print('task_failure.test_failed_attempts_survive_restart...')
+    asyncio.run(task_failure.test_failed_attempts_survive_restart())
+
+    print('admission_control.test_pending_task_limits...')
+    asyncio.run(admission_control.test_pending_task_limits())
+    print('admission_control.test_pending_bytes_limits...')
+    asyncio.run(admission_control.test_pending_bytes_limits())
+    print('admission_control.test_api_client_honours_retry_after...')
+    asyncio.run(admission_control.test_api_client_honours_retry_after())
+    print('admission_control.test_api_client_raises_on_rejection...')
+    asyncio.run(admission_control.test_api_client_raises_on_rejection())
+
+    print('worker_registry.test_worker_registry...')
+    asyncio.run(worker_registry.test_worker_registry())
+    print('worker_registry.test_worker_expiry...')
+    asyncio.run(worker_registry.test_worker_expiry())
+
+    print('resource_matching.test_tasks_match_worker_resources...')
+    asyncio.run(resource_matching.test_tasks_match_worker_resources())
+
+    print('affinity.test_delay_scheduling...')
+    asyncio.run(affinity.test_delay_scheduling())
+
+    print('federation.test_work_stealing...')
+    asyncio.run(federation.test_work_stealing())
+
+    print('fair_queuing.test_fair_queuing...')
+    asyncio.run(fair_queuing.test_fair_queuing())
+
+    print('speculation.test_speculative_execution...')
+    asyncio.run(speculation.test_speculative_execution())
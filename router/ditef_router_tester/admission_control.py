@@ -0,0 +1,182 @@
+import aiohttp
+import asyncio
+import ditef_router.api_client
+import subprocess
+import time
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_submit(client: aiohttp.ClientSession, task_type: str, task_payload, expected_status: int = 200) -> aiohttp.ClientResponse:
+    async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, json=task_payload) as response:
+        assert response.status == expected_status
+        return response
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str]):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_result_set(client: aiohttp.ClientSession, task_id: str, task_result):
+    async with client.post('http://localhost:8080/result/set', params={'taskId': task_id}, json=task_result) as response:
+        assert response.status == 200
+
+
+async def test_pending_task_limits():
+    process = subprocess.Popen(['task-router', '--max-pending-tasks=3', '--max-pending-tasks-per-type=2', '--maximum-retry-after=30'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            # limit per task type
+            await task_producer_submit(client, 'a', [1])
+            await task_producer_submit(client, 'a', [2])
+            response = await task_producer_submit(client, 'a', [3], 503)
+            # without completed tasks the service rate is unknown
+            assert response.headers['Retry-After'] == '30'
+            async with client.get('http://localhost:8080/metrics') as response:
+                metrics = (await response.text()).splitlines()
+            # rejected submissions are not counted as submitted
+            assert 'ditef_router_submitted_tasks_total{task_type="a"} 2' in metrics
+            assert 'ditef_router_rejected_tasks_total{task_type="a"} 1' in metrics
+            async with client.post('http://localhost:8080/task/run', params={'taskType': 'a'}, json=[3]) as response:
+                assert response.status == 503
+            async with client.post('http://localhost:8080/task/run_batch', params={'taskType': 'a'}, json=[[1], [3]]) as response:
+                assert response.status == 503
+
+            # duplicates of pending tasks do not need to be queued
+            await task_producer_submit(client, 'a', [1])
+
+            # global limit
+            await task_producer_submit(client, 'b', [1])
+            await task_producer_submit(client, 'c', [1], 503)
+
+            # the Retry-After follows the recent completion rate
+            for _ in range(2):
+                task = await worker_task_get(client, ['a'])
+                await worker_result_set(client, task['taskId'], 1)
+            await task_producer_submit(client, 'a', [3])
+            await task_producer_submit(client, 'a', [4])
+            response = await task_producer_submit(client, 'a', [5], 503)
+            # 2 completions per minute
+            assert response.headers['Retry-After'] == '30'
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_pending_bytes_limits():
+    process = subprocess.Popen(['task-router', '--max-pending-bytes-per-type=16'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            await task_producer_submit(client, 'a', 'x' * 10)
+            await task_producer_submit(client, 'a', 'y' * 10, 503)
+            await task_producer_submit(client, 'b', 'y' * 10)
+            await task_producer_submit(client, 'b', 'z' * 20, 413)
+
+            # tasks handed off to waiting workers are not queued
+            lease_task = asyncio.create_task(worker_task_get(client, ['c']))
+            await asyncio.sleep(0.5)
+            await task_producer_submit(client, 'c', 'x' * 10)
+            await task_producer_submit(client, 'c', 'y' * 10)
+            await task_producer_submit(client, 'c', 'z' * 10, 503)
+            assert (await lease_task)['payload'] == 'x' * 10
+
+            # tasks waiting workers do not accept are queued
+            lease_task = asyncio.create_task(worker_task_get(client, ['d']))
+            await asyncio.sleep(0.5)
+            for payload, expected_status in (('x' * 10, 200), ('y' * 10, 503)):
+                async with client.post('http://localhost:8080/task/submit', params={'taskType': 'd', 'requirements': '{"labels": ["gpu"]}'}, json=payload) as response:
+                    assert response.status == expected_status
+            await task_producer_submit(client, 'd', 'z' * 4)
+            assert (await lease_task)['payload'] == 'z' * 4
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_api_client_honours_retry_after():
+    process = subprocess.Popen(['task-router', '--max-pending-tasks=1', '--maximum-retry-after=1'])
+    try:
+        async with aiohttp.ClientSession() as client, ditef_router.api_client.ApiClient('http://localhost:8080/', 1, 60, 60) as api_client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            task_type = 'task-type-under-test'
+            start_time = time.monotonic()
+            task_producer_tasks = [
+                asyncio.create_task(api_client.run(task_type, [1, 2])),
+                asyncio.create_task(api_client.run(task_type, [3, 4])),
+            ]
+            batch_results = []
+
+            async def run_batch():
+                async for index, result in api_client.run_many(task_type, [[5, 6]]):
+                    batch_results.append(result)
+            task_producer_tasks.append(asyncio.create_task(run_batch()))
+
+            # rejected submissions are retried after Retry-After instead of the retry timeout
+            for _ in range(3):
+                task = await worker_task_get(client, [task_type])
+                await worker_result_set(client, task['taskId'], sum(task['payload']))
+            assert (await asyncio.gather(*task_producer_tasks))[:2] == [3, 7]
+            assert batch_results == [11]
+            assert time.monotonic() - start_time < 30
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_api_client_raises_on_rejection():
+    process = subprocess.Popen(['task-router', '--max-pending-bytes-per-type=16'])
+    try:
+        async with aiohttp.ClientSession() as client, ditef_router.api_client.ApiClient('http://localhost:8080/', 1, 60, 60) as api_client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            # rejected submissions fail instead of being retried
+            try:
+                await asyncio.wait_for(api_client.run('a', 'z' * 20), 10)
+                assert False
+            except aiohttp.ClientResponseError as error:
+                assert error.status == 413
+
+            async def run_batch():
+                async for index, result in api_client.run_many('a', ['z' * 20]):
+                    pass
+            try:
+                await asyncio.wait_for(run_batch(), 10)
+                assert False
+            except aiohttp.ClientResponseError as error:
+                assert error.status == 413
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
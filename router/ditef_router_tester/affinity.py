@@ -0,0 +1,86 @@
+import aiohttp
+import asyncio
+import subprocess
+import time
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_submit(client: aiohttp.ClientSession, task_type: str, task_payload, affinity_key: str):
+    async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type, 'affinityKey': affinity_key}, json=task_payload) as response:
+        assert response.status == 200
+
+
+async def worker_register(client: aiohttp.ClientSession, worker_id: str, warm_keys: typing.List[str]):
+    async with client.post('http://localhost:8080/worker/register', json={'workerId': worker_id, 'warmKeys': warm_keys}) as response:
+        assert response.status == 200
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str], worker_id: str, wait: int = 10):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': f'wait={wait}'}, params={'taskType': task_types, 'workerId': worker_id}) as response:
+        if response.status == 204:
+            return None
+        assert response.status == 200
+        return await response.json()
+
+
+async def test_delay_scheduling():
+    process = subprocess.Popen(['task-router', '--affinity-delay=2'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/worker/register', 'POST')
+
+            task_type = 'task-type-under-test'
+            await worker_register(client, 'warm-worker', ['dataset'])
+            await worker_register(client, 'cold-worker', [])
+
+            # warm workers get tasks right away
+            await task_producer_submit(client, task_type, 1, 'dataset')
+            assert (await worker_task_get(client, [task_type], 'warm-worker'))['payload'] == 1
+            warm_worker_task = asyncio.create_task(
+                worker_task_get(client, [task_type], 'warm-worker'))
+            await asyncio.sleep(0.5)
+            await task_producer_submit(client, task_type, 2, 'dataset')
+            assert (await warm_worker_task)['payload'] == 2
+
+            # other workers get them after the affinity delay
+            start_time = time.monotonic()
+            await task_producer_submit(client, task_type, 3, 'dataset')
+            assert await worker_task_get(client, [task_type], 'cold-worker', 1) is None
+            assert (await worker_task_get(client, [task_type], 'cold-worker'))['payload'] == 3
+            assert 1.5 < time.monotonic() - start_time < 3
+
+            # keys which are not warm anywhere do not delay tasks
+            start_time = time.monotonic()
+            await task_producer_submit(client, task_type, 4, 'other-dataset')
+            assert (await worker_task_get(client, [task_type], 'cold-worker'))['payload'] == 4
+            assert time.monotonic() - start_time < 1
+
+            # workers running a task have its key warm
+            async with client.get('http://localhost:8080/workers') as response:
+                workers = {
+                    worker['workerId']: worker
+                    for worker in await response.json()
+                }
+            assert workers['warm-worker']['warmKeys'] == ['dataset']
+            assert workers['cold-worker']['warmKeys'] == ['dataset', 'other-dataset']
+
+            async with client.post('http://localhost:8080/task/run_batch', params=[('taskType', task_type), ('affinityKey', 'a'), ('affinityKey', 'b')], json=[1, 2, 3]) as response:
+                assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -0,0 +1,390 @@
+import aiohttp
+import asyncio
+import click
+import contextlib
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+import typing
+import uuid
+
+
+def percentiles(samples: typing.List[float]) -> typing.Dict[str, typing.Optional[float]]:
+    '''Nearest-rank percentiles of the samples.'''
+
+    samples = sorted(samples)
+    return {
+        f'p{percentile}': samples[max(math.ceil(percentile / 100 * len(samples)) - 1, 0)] if len(samples) > 0 else None
+        for percentile in (50, 95, 99)
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as probe_socket:
+        probe_socket.bind(('localhost', 0))
+        return probe_socket.getsockname()[1]
+
+
+class Router:
+    '''Router subprocess on an ephemeral port. Its resource usage is collected
+    when it exits.'''
+
+    def __init__(self, arguments: typing.List[str]):
+        self.port = free_port()
+        self.url = f'http://localhost:{self.port}'
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                '-c',
+                'import ditef_router; ditef_router.main()',
+                '--host=localhost',
+                f'--port={self.port}',
+                *arguments,
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+
+    async def wait_until_ready(self, client: aiohttp.ClientSession):
+        while True:
+            assert self.process.poll() is None, 'Router exited during startup'
+            try:
+                async with client.get(f'{self.url}/metrics'):
+                    return
+            except aiohttp.ClientConnectorError:
+                pass
+            await asyncio.sleep(0.1)
+
+    def stop(self) -> dict:
+        '''Stops the router and returns its CPU time and peak memory.'''
+
+        # the ru_maxrss of a child starts at the RSS of its parent at fork time,
+        # the high water mark of the address space is reset by exec
+        with open(f'/proc/{self.process.pid}/status') as status_file:
+            max_rss_kilobytes = int(re.search(r'^VmHWM:\s+(\d+) kB$', status_file.read(), re.MULTILINE).group(1))
+        self.process.terminate()
+        _, _, resource_usage = os.wait4(self.process.pid, 0)
+        self.process.returncode = 0
+        return {
+            'cpuSeconds': resource_usage.ru_utime + resource_usage.ru_stime,
+            'maxRssBytes': max_rss_kilobytes * 1024,
+        }
+
+
+@contextlib.asynccontextmanager
+async def running_router(arguments: typing.List[str], report: dict):
+    '''Starts a router and a client session, the resource usage of the router
+    is added to the report.'''
+
+    router = Router(arguments)
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=None, limit_per_host=0)) as client:
+            await router.wait_until_ready(client)
+            yield router, client
+    finally:
+        report['router'] = router.stop()
+
+
+async def get_gauges(client: aiohttp.ClientSession, router: Router) -> typing.Dict[str, float]:
+    async with client.get(f'{router.url}/metrics') as response:
+        assert response.status == 200
+        samples = {}
+        for line in (await response.text()).splitlines():
+            if line.startswith('#'):
+                continue
+            name, value = re.fullmatch(r'(\S+) (\S+)', line).groups()
+            samples[name] = float(value)
+    return samples
+
+
+async def run_workers(client: aiohttp.ClientSession, router: Router, task_type: str, workers: int):
+    '''Workers answering each task with the length of its payload until
+    cancelled.'''
+
+    async def worker():
+        results = {}
+        while True:
+            async with client.post(f'{router.url}/result/set_and_get', headers={'Prefer': 'wait=1'}, params={'taskType': task_type, 'count': 1}, json=results) as response:
+                assert response.status in (200, 204)
+                tasks = await response.json() if response.status == 200 else []
+            results = {
+                task['taskId']: len(task['payload'][1])
+                for task in tasks
+            }
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+
+async def throughput_scenario(scenario: str, router_arguments: typing.List[str], producers: int, workers: int, tasks: int, payload_size: int, task_types: int = 1) -> dict:
+    '''Producers run tasks with payloads of the given size as fast as the
+    workers complete them. Producers and workers are spread evenly over the
+    given amount of task types.'''
+
+    report = {
+        'scenario': scenario,
+        'parameters': {
+            'producers': producers,
+            'workers': workers,
+            'tasks': tasks,
+            'payloadSize': payload_size,
+            'taskTypes': task_types,
+        },
+    }
+    async with running_router(router_arguments, report) as (router, client):
+        task_type_names = ['bench'] if task_types == 1 else [
+            f'bench-{index}'
+            for index in range(task_types)
+        ]
+        padding = 'x' * payload_size
+        latencies = []
+        remaining_tasks = tasks
+
+        async def producer(task_type: str):
+            nonlocal remaining_tasks
+            while remaining_tasks > 0:
+                remaining_tasks -= 1
+                # unique payloads, duplicates would be coalesced by the router
+                payload = [str(uuid.uuid4()), padding]
+                start_time = time.monotonic()
+                async with client.post(f'{router.url}/task/run', params={'taskType': task_type}, json=payload) as response:
+                    assert response.status == 200
+                    assert await response.json() == payload_size
+                latencies.append(time.monotonic() - start_time)
+
+        workers_task = asyncio.ensure_future(asyncio.gather(*(
+            run_workers(
+                client,
+                router,
+                task_type,
+                max(workers // len(task_type_names), 1),
+            )
+            for task_type in task_type_names
+        )))
+        start_time = time.monotonic()
+        await asyncio.gather(*(
+            producer(task_type_names[index % len(task_type_names)])
+            for index in range(producers)
+        ))
+        duration = time.monotonic() - start_time
+        workers_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await workers_task
+
+    report.update({
+        'durationSeconds': duration,
+        'tasksPerSecond': tasks / duration,
+        'latencySeconds': percentiles(latencies),
+    })
+    return report
+
+
+async def heartbeat_storm_scenario(router_arguments: typing.List[str], running_tasks: int, workers: int, duration: float) -> dict:
+    '''Workers lease running_tasks tasks and send one heartbeat request per
+    task as fast as possible.'''
+
+    report = {
+        'scenario': 'heartbeat_storm',
+        'parameters': {
+            'runningTasks': running_tasks,
+            'workers': workers,
+            'durationSeconds': duration,
+        },
+    }
+    async with running_router(['--heartbeat-timeout=3600', *router_arguments], report) as (router, client):
+        task_type = 'bench'
+
+        # producers wait for the results in batches
+        batch_size = 1000
+        producer_tasks = [
+            asyncio.create_task(client.post(
+                f'{router.url}/task/run_batch',
+                params={'taskType': task_type},
+                json=[
+                    [str(uuid.uuid4()), '']
+                    for _ in range(min(batch_size, running_tasks - offset))
+                ],
+            ))
+            for offset in range(0, running_tasks, batch_size)
+        ]
+
+        task_ids = []
+        while len(task_ids) < running_tasks:
+            async with client.get(f'{router.url}/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_type, 'count': batch_size}) as response:
+                assert response.status == 200
+                task_ids.extend(task['taskId'] for task in await response.json())
+
+        latencies = []
+        deadline = time.monotonic() + duration
+
+        async def worker(worker_task_ids: typing.List[str]):
+            while True:
+                for task_id in worker_task_ids:
+                    if time.monotonic() > deadline:
+                        return
+                    start_time = time.monotonic()
+                    async with client.post(f'{router.url}/task/heartbeat', params={'taskId': task_id}) as response:
+                        assert response.status == 200
+                    latencies.append(time.monotonic() - start_time)
+
+        start_time = time.monotonic()
+        await asyncio.gather(*(
+            worker(task_ids[index::workers])
+            for index in range(workers)
+        ))
+        storm_duration = time.monotonic() - start_time
+
+        for producer_task in producer_tasks:
+            producer_task.cancel()
+        await asyncio.gather(*producer_tasks, return_exceptions=True)
+
+    report.update({
+        'durationSeconds': storm_duration,
+        'heartbeatsPerSecond': len(latencies) / storm_duration,
+        'latencySeconds': percentiles(latencies),
+    })
+    return report
+
+
+async def cancellation_churn_scenario(router_arguments: typing.List[str], producers: int, workers: int, duration: float, cancellation_probability: float) -> dict:
+    '''Producers cancel a share of their requests after a random delay while
+    workers complete the others. The router must not keep cancelled tasks.'''
+
+    report = {
+        'scenario': 'cancellation_churn',
+        'parameters': {
+            'producers': producers,
+            'workers': workers,
+            'durationSeconds': duration,
+            'cancellationProbability': cancellation_probability,
+        },
+    }
+    async with running_router(router_arguments, report) as (router, client):
+        task_type = 'bench'
+        latencies = []
+        cancelled_tasks = 0
+        deadline = time.monotonic() + duration
+
+        async def run_task():
+            payload = [str(uuid.uuid4()), '']
+            start_time = time.monotonic()
+            async with client.post(f'{router.url}/task/run', params={'taskType': task_type}, json=payload) as response:
+                assert response.status == 200
+                await response.read()
+            latencies.append(time.monotonic() - start_time)
+
+        async def producer():
+            nonlocal cancelled_tasks
+            while time.monotonic() < deadline:
+                if random.random() < cancellation_probability:
+                    try:
+                        await asyncio.wait_for(run_task(), random.uniform(0, 0.01))
+                    except asyncio.TimeoutError:
+                        cancelled_tasks += 1
+                else:
+                    await run_task()
+
+        workers_task = asyncio.create_task(
+            run_workers(client, router, task_type, workers))
+        start_time = time.monotonic()
+        await asyncio.gather(*(producer() for _ in range(producers)))
+        churn_duration = time.monotonic() - start_time
+        workers_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await workers_task
+
+        # cancelled tasks must not be left behind
+        await asyncio.sleep(0.5)
+        gauges = await get_gauges(client, router)
+        label = f'{{task_type="{task_type}"}}'
+
+    report.update({
+        'durationSeconds': churn_duration,
+        'tasksPerSecond': len(latencies) / churn_duration,
+        'cancellationsPerSecond': cancelled_tasks / churn_duration,
+        'latencySeconds': percentiles(latencies),
+        'leftoverPendingTasks': gauges.get(f'ditef_router_pending_tasks{label}', 0.0),
+        'leftoverRunningTasks': gauges.get(f'ditef_router_running_tasks{label}', 0.0),
+    })
+    return report
+
+
+scenarios = ['throughput', 'payload_sizes', 'heartbeat_storm', 'cancellation_churn']
+
+
+async def run_scenarios(arguments: dict) -> typing.List[dict]:
+    router_arguments = list(arguments['router_argument'])
+    reports = []
+    for scenario in arguments['scenario'] or scenarios:
+        print(f'Running {scenario}...', file=sys.stderr)
+        if scenario == 'throughput':
+            reports.append(await throughput_scenario(
+                scenario,
+                router_arguments,
+                arguments['producers'],
+                arguments['workers'],
+                arguments['tasks'],
+                16,
+                arguments['task_types'],
+            ))
+        elif scenario == 'payload_sizes':
+            for payload_size in arguments['payload_size']:
+                reports.append(await throughput_scenario(
+                    scenario,
+                    # payloads are JSON strings with some overhead
+                    [f'--max-body-size={2 * payload_size + 1024}', *router_arguments],
+                    arguments['producers'],
+                    arguments['workers'],
+                    # transfer about the same amount of bytes per size
+                    max(min(arguments['tasks'], 256 * 1024 * 1024 // payload_size), 10),
+                    payload_size,
+                    arguments['task_types'],
+                ))
+        elif scenario == 'heartbeat_storm':
+            reports.append(await heartbeat_storm_scenario(
+                router_arguments,
+                arguments['running_tasks'],
+                arguments['workers'],
+                arguments['duration'],
+            ))
+        elif scenario == 'cancellation_churn':
+            reports.append(await cancellation_churn_scenario(
+                router_arguments,
+                arguments['producers'],
+                arguments['workers'],
+                arguments['duration'],
+                arguments['cancellation_probability'],
+            ))
+    return reports
+
+
+@click.command()
+@click.option('--scenario', type=click.Choice(scenarios), multiple=True, help='Scenario to run, may be given multiple times (default: all scenarios)')
+@click.option('--producers', default=100, help='Amount of concurrent task producers', show_default=True)
+@click.option('--workers', default=50, help='Amount of concurrent workers', show_default=True)
+@click.option('--tasks', default=10000, help='Amount of tasks run by the throughput scenarios', show_default=True)
+@click.option('--task-types', default=1, help='Amount of task types the producers and workers of the throughput scenarios are spread over', show_default=True)
+@click.option('--payload-size', type=int, multiple=True, default=[16, 1024, 64 * 1024, 1024 * 1024, 4 * 1024 * 1024], help='Payload size in bytes of the payload_sizes scenario, may be given multiple times', show_default=True)
+@click.option('--running-tasks', default=10000, help='Amount of running tasks in the heartbeat_storm scenario', show_default=True)
+@click.option('--duration', default=10.0, help='Duration in seconds of the heartbeat_storm and cancellation_churn scenarios', show_default=True)
+@click.option('--cancellation-probability', default=0.5, help='Probability that a producer cancels its task in the cancellation_churn scenario', show_default=True)
+@click.option('--router-argument', multiple=True, help='Additional argument passed to the router, may be given multiple times')
+@click.option('--output', type=click.File('w'), default='-', help='Path of the JSON report', show_default=True)
+def main(**arguments):
+    '''Benchmarks the throughput and latency of a router started on an
+    ephemeral port and reports the results as JSON.'''
+
+    reports = asyncio.run(run_scenarios(arguments))
+    json.dump(
+        {
+            'python': sys.version.split()[0],
+            'scenarios': reports,
+        },
+        arguments['output'],
+        indent=4,
+    )
+    arguments['output'].write('\n')
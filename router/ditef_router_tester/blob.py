@@ -0,0 +1,113 @@
+import aiohttp
+import asyncio
+import ditef_router.api_client
+import hashlib
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str]):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def test_blob_set_and_get():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/blob/set', 'POST')
+
+            blob = b'{"activation_functions":["relu","sigmoid"],"batch_size":32}'
+            blob_hash = hashlib.sha256(blob).hexdigest()
+
+            async with client.get('http://localhost:8080/blob/get', params={'hash': blob_hash}) as response:
+                assert response.status == 404
+
+            # registering twice is allowed
+            for _ in range(2):
+                async with client.post('http://localhost:8080/blob/set', params={'hash': blob_hash}, data=blob) as response:
+                    assert response.status == 200
+
+            async with client.get('http://localhost:8080/blob/get', params={'hash': blob_hash}) as response:
+                assert response.status == 200
+                assert await response.read() == blob
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_malformed_blob():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/blob/set', 'POST')
+
+            async with client.post('http://localhost:8080/blob/set', data=b'42') as response:
+                assert response.status == 400
+
+            async with client.post('http://localhost:8080/blob/set', params={'hash': 'wrong-hash'}, data=b'42') as response:
+                assert response.status == 400
+
+            async with client.get('http://localhost:8080/blob/get') as response:
+                assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_api_client_blobs_after_restart():
+    process = subprocess.Popen(['task-router'])
+    try:
+        # connections to the terminated router are not reused
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as client, ditef_router.api_client.ApiClient('http://localhost:8080/', 1, 1, 1) as api_client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/blob/set', 'POST')
+
+            task_type = 'task-type-under-test'
+            configuration = api_client.blob({'batch_size': 32})
+            task_producer_task = asyncio.create_task(
+                api_client.run(task_type, {'configuration': configuration}))
+            task = await worker_task_get(client, [task_type])
+            assert task['payload'] == {'configuration': configuration}
+
+            # the restarted router lost the task and its blob
+            process.terminate()
+            process.wait()
+            process = subprocess.Popen(['task-router'])
+            await wait_for_url(client, 'http://localhost:8080/blob/set', 'POST')
+
+            # the task is submitted again together with its blob
+            task = await worker_task_get(client, [task_type])
+            assert task['payload'] == {'configuration': configuration}
+            async with client.get('http://localhost:8080/blob/get', params={'hash': configuration['$blob']}) as response:
+                assert response.status == 200
+                assert await response.json() == {'batch_size': 32}
+            async with client.post('http://localhost:8080/result/set', params={'taskId': task['taskId']}, json=32) as response:
+                assert response.status == 200
+            assert await task_producer_task == 32
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -0,0 +1,69 @@
+import aiohttp
+import asyncio
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_submit(client: aiohttp.ClientSession, task_type: str, task_payload, producer_id: typing.Optional[str]):
+    params = {'taskType': task_type}
+    if producer_id is not None:
+        params['producerId'] = producer_id
+    async with client.post('http://localhost:8080/task/submit', params=params, json=task_payload) as response:
+        assert response.status == 200
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str]):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def test_fair_queuing():
+    process = subprocess.Popen(['task-router', '--producer-weight=quick=2'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            task_type = 'task-type-under-test'
+            for index in range(6):
+                await task_producer_submit(client, task_type, f'backlog-{index}', 'backlog')
+            for index in range(3):
+                await task_producer_submit(client, task_type, f'quick-{index}', 'quick')
+            for index in range(2):
+                await task_producer_submit(client, task_type, f'anonymous-{index}', None)
+
+            # producers take turns, quick gets two tasks per turn
+            payloads = [
+                (await worker_task_get(client, [task_type]))['payload']
+                for _ in range(11)
+            ]
+            assert payloads == [
+                'backlog-0',
+                'quick-0', 'quick-1',
+                'anonymous-0',
+                'backlog-1',
+                'quick-2',
+                'anonymous-1',
+                'backlog-2',
+                'backlog-3',
+                'backlog-4',
+                'backlog-5',
+            ]
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
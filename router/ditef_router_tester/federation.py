@@ -0,0 +1,89 @@
+import aiohttp
+import asyncio
+import subprocess
+import typing
+
+origin_url = 'http://localhost:8081'
+peer_url = 'http://localhost:8080'
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_submit(client: aiohttp.ClientSession, url: str, task_type: str, task_payload) -> str:
+    async with client.post(f'{url}/task/submit', params={'taskType': task_type}, json=task_payload) as response:
+        assert response.status == 200
+        return (await response.json())['handle']
+
+
+async def task_producer_wait(client: aiohttp.ClientSession, handle: str):
+    async with client.post(f'{origin_url}/result/wait', headers={'Prefer': 'wait=10'}, json={'handles': [handle]}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_task_get(client: aiohttp.ClientSession, url: str, task_types: typing.List[str]):
+    async with client.get(f'{url}/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types, 'workerId': 'worker-under-test'}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def test_work_stealing():
+    origin_process = subprocess.Popen(['task-router', '--port=8081'])
+    peer_process = subprocess.Popen(['task-router', f'--peer={origin_url}', '--peer-status-interval=0.5', '--peer-heartbeat-interval=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for servers to become ready
+            await wait_for_url(client, f'{origin_url}/peer/steal', 'GET')
+            await wait_for_url(client, f'{peer_url}/peer/steal', 'GET')
+
+            task_type = 'task-type-under-test'
+
+            # idle workers of the peer get tasks of the origin
+            handle = await task_producer_submit(client, origin_url, task_type, 1)
+            task = await worker_task_get(client, peer_url, [task_type])
+            assert task['payload'] == 1
+            async with client.get(f'{origin_url}/peer/status') as response:
+                assert await response.json() == {'pendingTasks': {}}
+
+            # stolen tasks are heartbeated at the origin
+            await asyncio.sleep(1.5)
+            async with client.get(f'{origin_url}/workers') as response:
+                worker_ids = [worker['workerId'] for worker in await response.json()]
+                assert len(worker_ids) == 1
+                assert worker_ids[0].startswith('router@')
+
+            # results are returned to the origin
+            async with client.post(f'{peer_url}/result/set', params={'taskId': task['taskId']}, json=10) as response:
+                assert response.status == 200
+            assert (await task_producer_wait(client, handle))['results'] == {handle: 10}
+
+            # failed attempts are retried by the origin
+            handle = await task_producer_submit(client, origin_url, task_type, 2)
+            task = await worker_task_get(client, peer_url, [task_type])
+            async with client.post(f'{peer_url}/result/error', params={'taskId': task['taskId']}, json={'message': 'failed'}) as response:
+                assert response.status == 200
+            task = await worker_task_get(client, peer_url, [task_type])
+            assert task['payload'] == 2
+            async with client.post(f'{peer_url}/result/set', params={'taskId': task['taskId']}, json=20) as response:
+                assert response.status == 200
+            assert (await task_producer_wait(client, handle))['results'] == {handle: 20}
+
+            # tasks of the peer are not stolen by the origin
+            await task_producer_submit(client, peer_url, task_type, 3)
+            assert (await worker_task_get(client, peer_url, [task_type]))['payload'] == 3
+    finally:
+        for process in (peer_process, origin_process):
+            try:
+                assert process.poll() is None  # process is still running
+                process.terminate()
+            finally:
+                process.wait()
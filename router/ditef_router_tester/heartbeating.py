@@ -240,3 +240,47 @@ async def test_non_existing_task_id_in_heartbeat():
             process.terminate()
         finally:
             process.wait()
+
+
+async def test_negotiated_lease_duration():
+    process = subprocess.Popen(['task-router', '--min-lease-duration=0.5', '--max-lease-duration=3'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            task_type = 'task-type-under-test'
+            async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, json=42) as response:
+                assert response.status == 200
+
+            # workers request lease durations within the bounds of the router
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_type, 'leaseDuration': 'soon'}) as response:
+                assert response.status == 400
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_type, 'leaseDuration': 1}) as response:
+                assert response.status == 200
+                task = await response.json()
+            assert task['leaseDuration'] == 1
+
+            # heartbeats tell the next deadline and may change the lease duration
+            async with client.post('http://localhost:8080/task/heartbeat', params={'taskId': task['taskId']}) as response:
+                assert response.status == 200
+                assert await response.json() == {'cancelledTaskIds': [], 'nextDeadline': 1}
+            async with client.post('http://localhost:8080/task/heartbeat', params={'taskId': task['taskId'], 'leaseDuration': 3600}) as response:
+                assert response.status == 200
+                assert await response.json() == {'cancelledTaskIds': [], 'nextDeadline': 3}
+            await asyncio.sleep(2)  # exceed the initial lease duration
+            async with client.post('http://localhost:8080/task/heartbeat', params={'taskId': task['taskId'], 'leaseDuration': 0.1}) as response:
+                assert response.status == 200
+                assert await response.json() == {'cancelledTaskIds': [], 'nextDeadline': 0.5}
+
+            # the task is requeued once its lease expired
+            await asyncio.sleep(1)
+            task2 = await worker_task_get(client, [task_type])
+            assert task2['taskId'] != task['taskId']
+            assert task2['leaseDuration'] == 60
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
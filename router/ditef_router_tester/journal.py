@@ -0,0 +1,142 @@
+import aiohttp
+import asyncio
+import pathlib
+import subprocess
+import tempfile
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_submit(client: aiohttp.ClientSession, task_type: str, task_payload) -> str:
+    async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, json=task_payload) as response:
+        assert response.status == 200
+        return (await response.json())['handle']
+
+
+async def task_producer_wait(client: aiohttp.ClientSession, handles: typing.List[str]):
+    async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': handles}) as response:
+        if response.status == 204:
+            return {'results': {}, 'errors': {}, 'unknownHandles': []}
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str]):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_result_set(client: aiohttp.ClientSession, task_id: str, task_result):
+    async with client.post('http://localhost:8080/result/set', params={'taskId': task_id}, json=task_result) as response:
+        assert response.status == 200
+
+
+async def run_with_restarts(arguments: typing.List[str], steps: typing.List[typing.Callable]):
+    '''Runs each step with a freshly started router, the router is killed
+    (without shutdown) between the steps. Results of a step are passed to the
+    next one.'''
+
+    state = None
+    for step in steps:
+        process = subprocess.Popen(['task-router', *arguments])
+        try:
+            async with aiohttp.ClientSession() as client:
+                # wait for server to become ready
+                await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+                state = await step(client, state)
+        finally:
+            try:
+                assert process.poll() is None  # process is still running
+                process.kill()
+            finally:
+                process.wait()
+
+
+async def test_restore_after_crash():
+    task_type = 'task-type-under-test'
+
+    async def submit(client: aiohttp.ClientSession, state):
+        handles = [
+            await task_producer_submit(client, task_type, [index, index])
+            for index in range(4)
+        ]
+        finished_task = await worker_task_get(client, [task_type])
+        await worker_result_set(client, finished_task['taskId'], sum(finished_task['payload']))
+        running_task = await worker_task_get(client, [task_type])
+        return handles, running_task
+
+    async def collect(client: aiohttp.ClientSession, state):
+        handles, running_task = state
+
+        # finished results survive
+        results = await task_producer_wait(client, handles)
+        assert results == {'results': {handles[0]: 0}, 'errors': {}, 'unknownHandles': []}
+
+        # running lease survives
+        async with client.post('http://localhost:8080/task/heartbeat', params={'taskId': running_task['taskId']}) as response:
+            assert response.status == 200
+        await worker_result_set(client, running_task['taskId'], sum(running_task['payload']))
+
+        # pending tasks come back in order
+        for index in range(2, 4):
+            task = await worker_task_get(client, [task_type])
+            assert task['payload'] == [index, index]
+            await worker_result_set(client, task['taskId'], sum(task['payload']))
+        results = await task_producer_wait(client, handles)
+        assert results == {
+            'results': {handle: 2 * index for index, handle in enumerate(handles)},
+            'errors': {},
+            'unknownHandles': [],
+        }
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal_path = pathlib.Path(directory) / 'journal'
+        await run_with_restarts(
+            [f'--journal={journal_path}'],
+            [submit, collect],
+        )
+
+
+async def test_journal_compaction():
+    task_type = 'task-type-under-test'
+
+    async def submit(client: aiohttp.ClientSession, state):
+        handles = [
+            await task_producer_submit(client, task_type, [index, index])
+            for index in range(10)
+        ]
+        for _ in range(5):
+            task = await worker_task_get(client, [task_type])
+            await worker_result_set(client, task['taskId'], sum(task['payload']))
+        return handles
+
+    async def collect(client: aiohttp.ClientSession, handles):
+        results = await task_producer_wait(client, handles)
+        assert results['results'] == {
+            handle: 2 * index
+            for index, handle in enumerate(handles[:5])
+        }
+        for index in range(5, 10):
+            task = await worker_task_get(client, [task_type])
+            assert task['payload'] == [index, index]
+        return handles
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal_path = pathlib.Path(directory) / 'journal'
+        await run_with_restarts(
+            [f'--journal={journal_path}', '--journal-compaction-interval=4'],
+            [submit, collect],
+        )
+        # the journal only contains records since the last compaction
+        assert len(journal_path.read_bytes().splitlines()) <= 1 + 4
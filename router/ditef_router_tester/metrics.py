@@ -0,0 +1,87 @@
+import aiohttp
+import asyncio
+import re
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def get_metrics(client: aiohttp.ClientSession) -> typing.Dict[str, float]:
+    async with client.get('http://localhost:8080/metrics') as response:
+        assert response.status == 200
+        assert response.content_type == 'text/plain'
+        samples = {}
+        for line in (await response.text()).splitlines():
+            if line.startswith('#'):
+                continue
+            name, value = re.fullmatch(r'(\S+) (\S+)', line).groups()
+            samples[name] = float(value)
+        return samples
+
+
+async def test_task_lifecycle_metrics():
+    process = subprocess.Popen(['task-router', '--heartbeat-timeout=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/metrics', 'GET')
+
+            task_type = 'task-type-under-test'
+            label = '{task_type="task-type-under-test"}'
+            async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, json=[1, 2]) as response:
+                assert response.status == 200
+            samples = await get_metrics(client)
+            assert samples[f'ditef_router_pending_tasks{label}'] == 1
+            assert samples[f'ditef_router_submitted_tasks_total{label}'] == 1
+
+            # let the first lease expire
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': [task_type]}) as response:
+                assert response.status == 200
+            samples = await get_metrics(client)
+            assert samples[f'ditef_router_pending_tasks{label}'] == 0
+            assert samples[f'ditef_router_running_tasks{label}'] == 1
+            await asyncio.sleep(1.5)
+
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': [task_type]}) as response:
+                assert response.status == 200
+                task = await response.json()
+            async with client.post('http://localhost:8080/result/set', params={'taskId': task['taskId']}, json=3) as response:
+                assert response.status == 200
+
+            samples = await get_metrics(client)
+            assert f'ditef_router_running_tasks{label}' not in samples
+            assert samples[f'ditef_router_expired_heartbeats_total{label}'] == 1
+            assert samples[f'ditef_router_assigned_tasks_total{label}'] == 2
+            assert samples[f'ditef_router_completed_tasks_total{label}'] == 1
+            assert samples['ditef_router_submitted_results'] == 1
+            assert samples[f'ditef_router_queued_seconds_count{label}'] == 2
+            assert samples[f'ditef_router_running_seconds_count{label}'] == 1
+            assert samples['ditef_router_total_seconds_bucket{task_type="task-type-under-test",le="+Inf"}'] == 1
+            assert samples['ditef_router_total_seconds_bucket{task_type="task-type-under-test",le="1"}'] == 0
+            assert samples[f'ditef_router_total_seconds_sum{label}'] > 1
+
+            # waiting long-polls are visible
+            lease_task = asyncio.create_task(
+                client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=2'}, params={'taskType': [task_type]}),
+            )
+            await asyncio.sleep(0.5)
+            samples = await get_metrics(client)
+            assert samples[f'ditef_router_waiting_lease_requests{label}'] == 1
+            async with await lease_task as response:
+                assert response.status == 204
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
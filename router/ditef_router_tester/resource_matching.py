@@ -0,0 +1,97 @@
+import aiohttp
+import asyncio
+import json
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_submit(client: aiohttp.ClientSession, task_type: str, task_payload, requirements: typing.Optional[dict] = None):
+    params = {'taskType': task_type}
+    if requirements is not None:
+        params['requirements'] = json.dumps(requirements)
+    async with client.post('http://localhost:8080/task/submit', params=params, json=task_payload) as response:
+        assert response.status == 200
+
+
+async def worker_register(client: aiohttp.ClientSession, worker_id: str, resources: dict, labels: typing.List[str]):
+    async with client.post('http://localhost:8080/worker/register', json={'workerId': worker_id, 'resources': resources, 'labels': labels}) as response:
+        assert response.status == 200
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str], worker_id: typing.Optional[str], wait: int = 10):
+    params = {'taskType': task_types}
+    if worker_id is not None:
+        params['workerId'] = worker_id
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': f'wait={wait}'}, params=params) as response:
+        if response.status == 204:
+            return None
+        assert response.status == 200
+        return await response.json()
+
+
+async def test_tasks_match_worker_resources():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/worker/register', 'POST')
+
+            task_type = 'task-type-under-test'
+            await worker_register(client, 'small-worker', {'cpus': 4}, [])
+            await worker_register(client, 'large-worker', {'cpus': 64, 'memory': 128e9}, ['gpu'])
+
+            # tasks are skipped by workers not satisfying their requirements
+            await task_producer_submit(client, task_type, 'large', {'resources': {'cpus': 16}})
+            await task_producer_submit(client, task_type, 'gpu', {'labels': ['gpu']})
+            await task_producer_submit(client, task_type, 'any')
+            assert (await worker_task_get(client, [task_type], 'small-worker'))['payload'] == 'any'
+            assert await worker_task_get(client, [task_type], 'small-worker', 1) is None
+            assert await worker_task_get(client, [task_type], None, 1) is None
+            assert (await worker_task_get(client, [task_type], 'large-worker'))['payload'] == 'large'
+            assert (await worker_task_get(client, [task_type], 'large-worker'))['payload'] == 'gpu'
+
+            # tasks are only handed off to waiting workers satisfying their requirements
+            small_worker_task = asyncio.create_task(
+                worker_task_get(client, [task_type], 'small-worker'))
+            await asyncio.sleep(0.5)
+            await task_producer_submit(client, task_type, 'larger', {'resources': {'cpus': 16, 'memory': 64e9}, 'labels': []})
+            assert (await worker_task_get(client, [task_type], 'large-worker'))['payload'] == 'larger'
+            await task_producer_submit(client, task_type, 'small', {'resources': {'cpus': 2}})
+            assert (await small_worker_task)['payload'] == 'small'
+
+            # one requirement per task of a batch
+            batch_task = asyncio.create_task(client.post(
+                'http://localhost:8080/task/run_batch',
+                params=[
+                    ('taskType', task_type),
+                    ('requirements', json.dumps({'labels': ['gpu']})),
+                    ('requirements', 'null'),
+                ],
+                json=['gpu-batch', 'any-batch'],
+            ))
+            assert (await worker_task_get(client, [task_type], 'small-worker'))['payload'] == 'any-batch'
+            assert (await worker_task_get(client, [task_type], 'large-worker'))['payload'] == 'gpu-batch'
+            batch_task.cancel()
+
+            for requirements in ('{', '[]', '{"cpus": 4}', '{"resources": {"cpus": "4"}}', '{"labels": "gpu"}'):
+                async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type, 'requirements': requirements}, json=1) as response:
+                    assert response.status == 400
+            async with client.post('http://localhost:8080/task/run_batch', params=[('taskType', task_type), ('requirements', 'null'), ('requirements', 'null')], json=[1, 2, 3]) as response:
+                assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -0,0 +1,111 @@
+import aiohttp
+import asyncio
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_run(client: aiohttp.ClientSession, task_type: str, task_payload, expect_response: asyncio.Event):
+    async with client.post('http://localhost:8080/task/run', params={'taskType': task_type}, json=task_payload) as response:
+        assert expect_response.is_set()
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str]):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def test_result_set_and_task_get():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/result/set_and_get', 'POST')
+
+            # dispatch task executions
+            task_type = 'task-type-under-test'
+            expect_response1 = asyncio.Event()
+            task_producer_task1 = asyncio.create_task(
+                task_producer_run(
+                    client,
+                    task_type,
+                    [1, 2],
+                    expect_response1,
+                ),
+            )
+            task1 = await worker_task_get(client, [task_type])
+            assert task1['payload'] == [1, 2]
+
+            expect_response2 = asyncio.Event()
+            task_producer_task2 = asyncio.create_task(
+                task_producer_run(
+                    client,
+                    task_type,
+                    [3, 4],
+                    expect_response2,
+                ),
+            )
+
+            # set result of task 1 and get task 2 in one request
+            expect_response1.set()
+            async with client.post('http://localhost:8080/result/set_and_get', headers={'Prefer': 'wait=10'}, params={'taskType': [task_type]}, json={task1['taskId']: sum(task1['payload'])}) as response:
+                assert response.status == 200
+                task2 = await response.json()
+            assert task2['taskType'] == task_type
+            assert task2['payload'] == [3, 4]
+            assert await task_producer_task1 == 3
+
+            # set result of task 2, no further task available
+            expect_response2.set()
+            async with client.post('http://localhost:8080/result/set_and_get', headers={'Prefer': 'wait=1'}, params={'taskType': [task_type]}, json={task2['taskId']: sum(task2['payload'])}) as response:
+                assert response.status == 204
+            assert await task_producer_task2 == 7
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_malformed_result_set_and_task_get():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/result/set_and_get', 'POST')
+
+            async with client.post('http://localhost:8080/result/set_and_get', params={'taskType': ['task-type-under-test']}, json={}) as response:
+                assert response.status == 400
+
+            async with client.post('http://localhost:8080/result/set_and_get', headers={'Prefer': 'wait=1'}, json={}) as response:
+                assert response.status == 400
+
+            async with client.post('http://localhost:8080/result/set_and_get', headers={'Prefer': 'wait=1'}, params={'taskType': ['task-type-under-test']}, json=[42]) as response:
+                assert response.status == 400
+
+            async with client.post('http://localhost:8080/result/set_and_get', headers={'Prefer': 'wait=1'}, params={'taskType': ['task-type-under-test']}, data=b'{"non-existing-task-id": 42') as response:
+                assert response.status == 400
+
+            # unknown task IDs are dropped
+            async with client.post('http://localhost:8080/result/set_and_get', headers={'Prefer': 'wait=1'}, params={'taskType': ['task-type-under-test']}, json={'non-existing-task-id': 42}) as response:
+                assert response.status == 204
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -0,0 +1,95 @@
+import aiohttp
+import asyncio
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_submit(client: aiohttp.ClientSession, task_type: str, task_payload, params: dict = {}):
+    async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type, **params}, json=task_payload) as response:
+        assert response.status == 200
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str]):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def leased_payloads(policy: str, submissions: typing.List[typing.Tuple[str, int, dict]]) -> typing.List[int]:
+    '''Submits (task type, payload, parameters) tuples to a router with the
+    given scheduling policy and returns the payloads in order of leasing.'''
+
+    process = subprocess.Popen(
+        ['task-router', f'--scheduling-policy={policy}'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            for task_type, task_payload, params in submissions:
+                await task_producer_submit(client, task_type, task_payload, params)
+
+            task_types = sorted(set(task_type for task_type, _, _ in submissions))
+            return [
+                (await worker_task_get(client, task_types))['payload']
+                for _ in submissions
+            ]
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_scheduling_policies():
+    task_type = 'task-type-under-test'
+    other_task_type = 'other-task-type'
+    submissions = [
+        (task_type, 1, {'priority': 0, 'estimatedCost': 30}),
+        (task_type, 2, {'priority': 2, 'estimatedCost': 10}),
+        (other_task_type, 3, {'priority': 1, 'estimatedCost': 40}),
+        (task_type, 4, {'priority': 2, 'estimatedCost': 20}),
+    ]
+
+    assert await leased_payloads('priority', submissions) == [2, 4, 3, 1]
+    assert await leased_payloads('sjf', submissions) == [2, 4, 1, 3]
+    assert await leased_payloads('lpt', submissions) == [3, 1, 4, 2]
+
+    # FIFO within each task type
+    payloads = await leased_payloads('fifo', submissions)
+    assert [payload for payload in payloads if payload != 3] == [1, 2, 4]
+
+
+async def test_malformed_scheduling_parameters():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            async with client.post('http://localhost:8080/task/submit', params={'taskType': 'task-type-under-test', 'priority': 'high'}, json=42) as response:
+                assert response.status == 400
+
+            async with client.post('http://localhost:8080/task/submit', params={'taskType': 'task-type-under-test', 'estimatedCost': 'nan'}, json=42) as response:
+                assert response.status == 400
+
+            async with client.post('http://localhost:8080/task/run_batch', params=[('taskType', 'task-type-under-test'), ('estimatedCost', '1'), ('estimatedCost', '2')], json=[1, 2, 3]) as response:
+                assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -0,0 +1,74 @@
+import aiohttp
+import asyncio
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_submit(client: aiohttp.ClientSession, task_type: str, task_payload) -> str:
+    async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, json=task_payload) as response:
+        assert response.status == 200
+        return (await response.json())['handle']
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str], worker_id: str):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types, 'workerId': worker_id}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_result_set(client: aiohttp.ClientSession, task_id: str, result) -> int:
+    async with client.post('http://localhost:8080/result/set', params={'taskId': task_id}, json=result) as response:
+        return response.status
+
+
+async def test_speculative_execution():
+    process = subprocess.Popen(['task-router', '--speculation-budget=100'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            # runtimes of quickly completed tasks
+            task_type = 'task-type-under-test'
+            for index in range(20):
+                await task_producer_submit(client, task_type, index)
+                task = await worker_task_get(client, [task_type], 'fast-worker')
+                assert await worker_result_set(client, task['taskId'], index) == 200
+
+            # a copy of the straggling task is handed to an idle worker
+            handle = await task_producer_submit(client, task_type, 'straggler')
+            straggling_task = await worker_task_get(client, [task_type], 'slow-worker')
+            speculative_task = await worker_task_get(client, [task_type], 'fast-worker')
+            assert speculative_task['payload'] == 'straggler'
+            assert speculative_task['taskId'] != straggling_task['taskId']
+
+            # the first result wins, the other attempt is aborted
+            assert await worker_result_set(client, speculative_task['taskId'], 'fast-result') == 200
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=10'}, json={'handles': [handle]}) as response:
+                assert (await response.json())['results'] == {handle: 'fast-result'}
+            async with client.post('http://localhost:8080/task/heartbeat', params={'taskId': straggling_task['taskId']}) as response:
+                assert response.status == 200
+                assert await response.json() == {'cancelledTaskIds': [straggling_task['taskId']], 'nextDeadline': None}
+            assert await worker_result_set(client, straggling_task['taskId'], 'slow-result') == 404
+
+            async with client.get('http://localhost:8080/metrics') as response:
+                metrics = await response.text()
+                assert f'ditef_router_speculative_tasks_total{{task_type="{task_type}"}} 1' in metrics
+                assert f'ditef_router_speculative_wins_total{{task_type="{task_type}"}} 1' in metrics
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -0,0 +1,152 @@
+import aiohttp
+import asyncio
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_run(client: aiohttp.ClientSession, task_type: str, task_payload, headers: typing.Dict[str, str] = {}):
+    async with client.post('http://localhost:8080/task/run', params={'taskType': task_type}, headers=headers, json=task_payload) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str], wait: int = 10):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': f'wait={wait}'}, params={'taskType': task_types}) as response:
+        if response.status == 204:
+            return None
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_result_set(client: aiohttp.ClientSession, task_id: str, task_result):
+    async with client.post('http://localhost:8080/result/set', params={'taskId': task_id}, json=task_result) as response:
+        assert response.status == 200
+
+
+async def test_identical_payloads_share_task():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run', 'POST')
+
+            # dispatch identical task executions
+            task_type = 'task-type-under-test'
+            task_producer_tasks = [
+                asyncio.create_task(
+                    task_producer_run(client, task_type, [1, 2]),
+                )
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0.5)
+
+            # only one task is leased
+            task = await worker_task_get(client, [task_type])
+            assert await worker_task_get(client, [task_type], 1) is None
+            await worker_result_set(client, task['taskId'], sum(task['payload']))
+            assert await asyncio.gather(*task_producer_tasks) == [3, 3, 3]
+
+            # later duplicates are served from the result cache
+            assert await task_producer_run(client, task_type, [1, 2]) == 3
+            assert await worker_task_get(client, [task_type], 1) is None
+
+            # other task types are not affected
+            other_task_producer_task = asyncio.create_task(
+                task_producer_run(client, 'other-task-type', [1, 2]),
+            )
+            task = await worker_task_get(client, ['other-task-type'])
+            await worker_result_set(client, task['taskId'], 42)
+            assert await other_task_producer_task == 42
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_idempotency_key():
+    process = subprocess.Popen(['task-router', '--result-cache-size=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run', 'POST')
+
+            # submissions with the same key share a task regardless of the payload
+            task_type = 'task-type-under-test'
+            task_producer_task1 = asyncio.create_task(
+                task_producer_run(client, task_type, [1, 2], {'Idempotency-Key': 'key-1'}),
+            )
+            task = await worker_task_get(client, [task_type])
+            task_producer_task2 = asyncio.create_task(
+                task_producer_run(client, task_type, [3, 4], {'Idempotency-Key': 'key-1'}),
+            )
+            await asyncio.sleep(0.5)
+            await worker_result_set(client, task['taskId'], sum(task['payload']))
+            assert await task_producer_task1 == 3
+            assert await task_producer_task2 == 3
+
+            # a new result evicts the least recently used one
+            task_producer_task3 = asyncio.create_task(
+                task_producer_run(client, task_type, [1, 2], {'Idempotency-Key': 'key-2'}),
+            )
+            task = await worker_task_get(client, [task_type])
+            await worker_result_set(client, task['taskId'], 4)
+            assert await task_producer_task3 == 4
+            task_producer_task4 = asyncio.create_task(
+                task_producer_run(client, task_type, [1, 2], {'Idempotency-Key': 'key-1'}),
+            )
+            task = await worker_task_get(client, [task_type])
+            await worker_result_set(client, task['taskId'], 5)
+            assert await task_producer_task4 == 5
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_cancellation_of_shared_task():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run', 'POST')
+
+            task_type = 'task-type-under-test'
+            task_producer_task1 = asyncio.create_task(
+                task_producer_run(client, task_type, [1, 2]),
+            )
+            task_producer_task2 = asyncio.create_task(
+                task_producer_run(client, task_type, [1, 2]),
+            )
+            await asyncio.sleep(0.5)
+
+            # the task survives as long as one producer waits
+            task_producer_task1.cancel()
+            try:
+                await task_producer_task1
+            except asyncio.CancelledError:
+                pass
+            await asyncio.sleep(0.5)
+            task = await worker_task_get(client, [task_type])
+            await worker_result_set(client, task['taskId'], sum(task['payload']))
+            assert await task_producer_task2 == 3
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -0,0 +1,239 @@
+import aiohttp
+import asyncio
+import json
+import pathlib
+import subprocess
+import tempfile
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str]):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_result_error(client: aiohttp.ClientSession, task_id: str, error):
+    async with client.post('http://localhost:8080/result/error', params={'taskId': task_id}, json=error) as response:
+        assert response.status == 200
+
+
+async def test_failed_task_is_requeued():
+    process = subprocess.Popen(['task-router', '--max-attempts=2'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/result/error', 'POST')
+
+            task_type = 'task-type-under-test'
+            task_producer_task = asyncio.create_task(
+                client.post('http://localhost:8080/task/run', params={'taskType': task_type}, json=[1, 2]),
+            )
+
+            # reported errors requeue the task without waiting for the heartbeat timeout
+            task = await worker_task_get(client, [task_type])
+            await worker_result_error(client, task['taskId'], {'exception': 'first'})
+            retried_task = await worker_task_get(client, [task_type])
+            assert retried_task['payload'] == [1, 2]
+            assert retried_task['taskId'] != task['taskId']
+
+            # the task is not running anymore
+            async with client.post('http://localhost:8080/result/error', params={'taskId': task['taskId']}, json={}) as response:
+                assert response.status == 404
+            async with client.post('http://localhost:8080/result/error', params={'taskId': retried_task['taskId']}) as response:
+                assert response.status == 400
+
+            # a successful attempt delivers the result
+            async with client.post('http://localhost:8080/result/set', params={'taskId': retried_task['taskId']}, json=3) as response:
+                assert response.status == 200
+            async with await task_producer_task as response:
+                assert response.status == 200
+                assert await response.json() == 3
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_dead_letter_tasks():
+    process = subprocess.Popen(['task-router', '--max-attempts=2', '--heartbeat-timeout=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/result/error', 'POST')
+
+            task_type = 'task-type-under-test'
+            task_producer_task = asyncio.create_task(
+                client.post('http://localhost:8080/task/run', params={'taskType': task_type}, json=[1, 2]),
+            )
+            async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, json=[1, 2]) as response:
+                assert response.status == 200
+                handle = (await response.json())['handle']
+
+            # missed heartbeats count as failed attempts
+            await worker_task_get(client, [task_type])
+            await asyncio.sleep(1.5)
+            task = await worker_task_get(client, [task_type])
+            await worker_result_error(client, task['taskId'], {'exception': 'second'})
+
+            # producers get the errors of all attempts
+            error = {
+                'message': 'Task failed',
+                'attempts': 2,
+                'errors': [{'message': 'Heartbeat timeout'}, {'exception': 'second'}],
+            }
+            async with await task_producer_task as response:
+                assert response.status == 422
+                assert await response.json() == error
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle]}) as response:
+                assert response.status == 200
+                assert await response.json() == {'results': {}, 'errors': {handle: error}, 'unknownHandles': []}
+
+            # the task is kept in the dead letter tasks for inspection
+            async with client.get('http://localhost:8080/dead_letter/list') as response:
+                assert response.status == 200
+                dead_letter_tasks = await response.json()
+            assert dead_letter_tasks == [{
+                'taskType': task_type,
+                'taskId': dead_letter_tasks[0]['taskId'],
+                'payload': [1, 2],
+                'errors': error['errors'],
+            }]
+
+            async with client.post('http://localhost:8080/dead_letter/drop', json=[dead_letter_tasks[0]['taskId']]) as response:
+                assert response.status == 200
+            async with client.post('http://localhost:8080/dead_letter/drop', json=[dead_letter_tasks[0]['taskId']]) as response:
+                assert response.status == 404
+            for body in (b'', b'["task-id"', b'{}'):
+                async with client.post('http://localhost:8080/dead_letter/drop', data=body) as response:
+                    assert response.status == 400
+            async with client.get('http://localhost:8080/dead_letter/list') as response:
+                assert await response.json() == []
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_batch_errors():
+    process = subprocess.Popen(['task-router', '--max-attempts=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/result/error', 'POST')
+
+            task_type = 'task-type-under-test'
+            batch_task = asyncio.create_task(
+                client.post('http://localhost:8080/task/run_batch', params={'taskType': task_type}, json=[[1, 2], [3, 4]]),
+            )
+            for _ in range(2):
+                task = await worker_task_get(client, [task_type])
+                if task['payload'] == [1, 2]:
+                    await worker_result_error(client, task['taskId'], {'exception': 'first'})
+                else:
+                    async with client.post('http://localhost:8080/result/set', params={'taskId': task['taskId']}, json=7) as response:
+                        assert response.status == 200
+
+            # batch results contain errors of failed tasks
+            async with await batch_task as response:
+                assert response.status == 200
+                lines = sorted(
+                    (await response.text()).splitlines(),
+                    key=lambda line: json.loads(line)['index'],
+                )
+            assert [json.loads(line) for line in lines] == [
+                {'index': 0, 'error': {'message': 'Task failed', 'attempts': 1, 'errors': [{'exception': 'first'}]}},
+                {'index': 1, 'result': 7},
+            ]
+
+            # failures are not cached, the task is created again
+            async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, data=b'[1,2]') as response:
+                assert response.status == 200
+            task = await worker_task_get(client, [task_type])
+            assert task['payload'] == [1, 2]
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_failed_attempts_survive_restart():
+    task_type = 'task-type-under-test'
+    with tempfile.TemporaryDirectory() as directory:
+        journal_path = pathlib.Path(directory) / 'journal'
+
+        process = subprocess.Popen(['task-router', '--max-attempts=2', f'--journal={journal_path}'])
+        try:
+            async with aiohttp.ClientSession() as client:
+                # wait for server to become ready
+                await wait_for_url(client, 'http://localhost:8080/result/error', 'POST')
+
+                async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, json=[1, 2]) as response:
+                    handle = (await response.json())['handle']
+                task = await worker_task_get(client, [task_type])
+                await worker_result_error(client, task['taskId'], {'exception': 'first'})
+        finally:
+            try:
+                assert process.poll() is None  # process is still running
+                process.kill()
+            finally:
+                process.wait()
+
+        error = {
+            'message': 'Task failed',
+            'attempts': 2,
+            'errors': [{'exception': 'first'}, {'exception': 'second'}],
+        }
+        process = subprocess.Popen(['task-router', '--max-attempts=2', f'--journal={journal_path}'])
+        try:
+            async with aiohttp.ClientSession() as client:
+                # wait for server to become ready
+                await wait_for_url(client, 'http://localhost:8080/result/error', 'POST')
+
+                # the failed attempt counts after the restart
+                task = await worker_task_get(client, [task_type])
+                await worker_result_error(client, task['taskId'], {'exception': 'second'})
+                async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle]}) as response:
+                    assert (await response.json())['errors'] == {handle: error}
+        finally:
+            try:
+                assert process.poll() is None  # process is still running
+                process.kill()
+            finally:
+                process.wait()
+
+        process = subprocess.Popen(['task-router', '--max-attempts=2', f'--journal={journal_path}'])
+        try:
+            async with aiohttp.ClientSession() as client:
+                # wait for server to become ready
+                await wait_for_url(client, 'http://localhost:8080/result/error', 'POST')
+
+                # errors and dead letter tasks survive restarts
+                async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle]}) as response:
+                    assert (await response.json())['errors'] == {handle: error}
+                async with client.get('http://localhost:8080/dead_letter/list') as response:
+                    dead_letter_tasks = await response.json()
+                assert [task['errors'] for task in dead_letter_tasks] == [error['errors']]
+        finally:
+            try:
+                assert process.poll() is None  # process is still running
+                process.terminate()
+            finally:
+                process.wait()
@@ -0,0 +1,158 @@
+import aiohttp
+import asyncio
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_run(client: aiohttp.ClientSession, task_type: str, task_payload, expect_response: asyncio.Event):
+    async with client.post('http://localhost:8080/task/run', params={'taskType': task_type}, json=task_payload) as response:
+        assert expect_response.is_set()
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_task_get_many(client: aiohttp.ClientSession, task_types: typing.List[str], count: int):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types, 'count': count}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def test_lease_multiple_tasks():
+    process = subprocess.Popen(['task-router', '--heartbeat-timeout=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run', 'POST')
+
+            # dispatch task executions
+            task_type = 'task-type-under-test'
+            task_payloads = [[1, 2], [3, 4], [5, 6]]
+            expect_response = asyncio.Event()
+            task_producer_tasks = [
+                asyncio.create_task(
+                    task_producer_run(
+                        client,
+                        task_type,
+                        task_payload,
+                        expect_response,
+                    ),
+                )
+                for task_payload in task_payloads
+            ]
+            await asyncio.sleep(0.5)
+
+            # lease more tasks than available
+            tasks = await worker_task_get_many(client, [task_type], 5)
+            assert len(tasks) == len(task_payloads)
+            assert sorted(task['payload'] for task in tasks) == task_payloads
+            assert len(set(task['taskId'] for task in tasks)) == len(tasks)
+
+            # one heartbeat covers the whole lease
+            for _ in range(3):
+                await asyncio.sleep(0.5)
+                async with client.post('http://localhost:8080/task/heartbeat', params=[('taskId', task['taskId']) for task in tasks]) as response:
+                    assert response.status == 200
+            await asyncio.sleep(0.5)
+
+            # set all results at once
+            expect_response.set()
+            async with client.post('http://localhost:8080/result/set_batch', json={task['taskId']: sum(task['payload']) for task in tasks}) as response:
+                assert response.status == 200
+
+            # validate task results
+            task_producer_results = await asyncio.gather(*task_producer_tasks)
+            assert task_producer_results == [
+                sum(task_payload)
+                for task_payload in task_payloads
+            ]
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_malformed_count():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/get', 'GET')
+
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=1'}, params={'taskType': ['task-type-under-test'], 'count': 'abc'}) as response:
+                assert response.status == 400
+
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=1'}, params={'taskType': ['task-type-under-test'], 'count': 0}) as response:
+                assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_non_existing_task_id_in_result_batch():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/result/set_batch', 'POST')
+
+            async with client.post('http://localhost:8080/result/set_batch', json={'non-existing-task-id': 42}) as response:
+                assert response.status == 404
+
+            async with client.post('http://localhost:8080/result/set_batch', json=[42]) as response:
+                assert response.status == 400
+
+            async with client.post('http://localhost:8080/result/set_batch', data=b'{"non-existing-task-id": [42,') as response:
+                assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_release_tasks():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/release', 'POST')
+
+            task_type = 'task-type-under-test'
+            async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, json=[1, 2]) as response:
+                assert response.status == 200
+
+            # released tasks are leased again at once
+            tasks = await worker_task_get_many(client, [task_type], 1)
+            async with client.post('http://localhost:8080/task/release', json=[tasks[0]['taskId']]) as response:
+                assert response.status == 200
+            tasks = await worker_task_get_many(client, [task_type], 1)
+            assert tasks[0]['payload'] == [1, 2]
+
+            async with client.post('http://localhost:8080/task/release', json=['non-existing-task-id']) as response:
+                assert response.status == 404
+            for body in (b'', b'{"foo": ', b'{"foo": "bar"}'):
+                async with client.post('http://localhost:8080/task/release', data=body) as response:
+                    assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -29,3 +29,32 @@ async def test_missing_task_type_from_producer():
             process.terminate()
         finally:
             process.wait()
+
+
+async def test_malformed_payload_from_producer():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run', 'POST')
+
+            for endpoint in ('run', 'submit'):
+                async with client.post(f'http://localhost:8080/task/{endpoint}', params={'taskType': 'task-type-under-test'}, data=b'{"foo": ') as response:
+                    assert response.status == 400
+
+            # malformed results are rejected as well, the task keeps running
+            async with client.post('http://localhost:8080/task/submit', params={'taskType': 'task-type-under-test'}, json=1) as response:
+                assert response.status == 200
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': 'task-type-under-test'}) as response:
+                assert response.status == 200
+                task = await response.json()
+            async with client.post('http://localhost:8080/result/set', params={'taskId': task['taskId']}, data=b'[1, 2') as response:
+                assert response.status == 400
+            async with client.post('http://localhost:8080/result/set', params={'taskId': task['taskId']}, json=[1, 2]) as response:
+                assert response.status == 200
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -130,3 +130,67 @@ async def test_cancellation_after_assignment():
             process.terminate()
         finally:
             process.wait()
+
+
+async def test_cancellation_reported_by_heartbeat():
+    process = subprocess.Popen(['task-router', '--heartbeat-timeout=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run', 'POST')
+
+            task_type = 'task-type-under-test'
+            expect_response = asyncio.Event()
+            task_producer_tasks = [
+                asyncio.create_task(
+                    task_producer_run(
+                        client,
+                        task_type,
+                        task_payload,
+                        expect_response,
+                    ),
+                )
+                for task_payload in (1, 2)
+            ]
+            await asyncio.sleep(0.5)
+
+            # get tasks
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': f'wait=1'}, params={'taskType': [task_type], 'count': 2}) as response:
+                assert response.status == 200
+                tasks = await response.json()
+            task_ids = [task['taskId'] for task in tasks]
+            async with client.post('http://localhost:8080/task/heartbeat', params={'taskId': task_ids}) as response:
+                assert response.status == 200
+                assert await response.json() == {'cancelledTaskIds': [], 'nextDeadline': 1}
+
+            # cancel first task
+            task_producer_tasks[tasks[0]['payload'] - 1].cancel()
+            try:
+                await task_producer_tasks[tasks[0]['payload'] - 1]
+            except asyncio.CancelledError:
+                pass
+
+            # the worker learns about the cancellation with its next heartbeat
+            async with client.post('http://localhost:8080/task/heartbeat', params={'taskId': task_ids}) as response:
+                assert response.status == 200
+                assert await response.json() == {'cancelledTaskIds': [task_ids[0]], 'nextDeadline': 1}
+
+            # the cancellation is forgotten after the heartbeat timeout
+            await asyncio.sleep(0.5)
+            async with client.post('http://localhost:8080/task/heartbeat', params={'taskId': task_ids[1]}) as response:
+                assert response.status == 200
+            await asyncio.sleep(0.8)
+            async with client.post('http://localhost:8080/task/heartbeat', params={'taskId': task_ids}) as response:
+                assert response.status == 404
+                assert await response.json() == {'cancelledTaskIds': [], 'nextDeadline': 1}
+
+            expect_response.set()
+            async with client.post('http://localhost:8080/result/set', params={'taskId': task_ids[1]}, json=3) as response:
+                assert response.status == 200
+            assert await task_producer_tasks[tasks[1]['payload'] - 1] == 3
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -0,0 +1,139 @@
+import aiohttp
+import asyncio
+import json
+import subprocess
+import typing
+
+import ditef_router.api_client
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_run_batch(client: aiohttp.ClientSession, task_type: str, task_payloads: list):
+    async with client.post('http://localhost:8080/task/run_batch', params={'taskType': task_type}, json=task_payloads) as response:
+        assert response.status == 200
+        assert response.headers['Content-Type'] == 'application/x-ndjson'
+        return [
+            json.loads(line)
+            for line in (await response.read()).splitlines()
+        ]
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str]):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_result_set(client: aiohttp.ClientSession, task_id, result_payload):
+    async with client.post('http://localhost:8080/result/set', params={'taskId': task_id}, json=result_payload) as response:
+        assert response.status == 200
+
+
+async def test_batch_results_in_completion_order():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run_batch', 'POST')
+
+            # dispatch batch execution
+            task_type = 'task-type-under-test'
+            task_payloads = [[1, 2], [3, 4], [5, 6]]
+            task_producer_task = asyncio.create_task(
+                task_producer_run_batch(
+                    client,
+                    task_type,
+                    task_payloads,
+                ),
+            )
+
+            # simulate worker processing, set results in reverse order
+            tasks = [
+                await worker_task_get(client, [task_type])
+                for _ in task_payloads
+            ]
+            assert [task['payload'] for task in tasks] == task_payloads
+            for task in reversed(tasks):
+                await worker_result_set(client, task['taskId'], sum(task['payload']))
+                await asyncio.sleep(0.1)
+
+            # validate task results
+            task_producer_results = await task_producer_task
+            assert task_producer_results == [
+                {'index': index, 'result': sum(task_payloads[index])}
+                for index in reversed(range(len(task_payloads)))
+            ]
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_missing_task_type_in_batch():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run_batch', 'POST')
+
+            async with client.post('http://localhost:8080/task/run_batch', json=[1, 2]) as response:
+                assert response.status == 400
+
+            for body in (b'1', b'', b'[1, 2', b'[1, {"foo": ]'):
+                async with client.post('http://localhost:8080/task/run_batch', params={'taskType': 'task-type-under-test'}, data=body) as response:
+                    assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_api_client_run_many():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client, ditef_router.api_client.ApiClient('http://localhost:8080/', 1, 1, 1) as api_client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run_batch', 'POST')
+
+            # dispatch batch execution
+            task_type = 'task-type-under-test'
+            task_payloads = [[1, 2], [3, 4], [5, 6], [7, 8]]
+
+            async def collect_results():
+                return [
+                    index_and_result
+                    async for index_and_result in api_client.run_many(task_type, task_payloads)
+                ]
+            task_producer_task = asyncio.create_task(collect_results())
+
+            # simulate worker processing
+            for _ in task_payloads:
+                task = await worker_task_get(client, [task_type])
+                await worker_result_set(client, task['taskId'], sum(task['payload']))
+
+            # validate task results
+            task_producer_results = await task_producer_task
+            assert sorted(task_producer_results) == [
+                (index, sum(task_payload))
+                for index, task_payload in enumerate(task_payloads)
+            ]
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -0,0 +1,217 @@
+import aiohttp
+import asyncio
+import ditef_router.api_client
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_submit(client: aiohttp.ClientSession, task_type: str, task_payload) -> str:
+    async with client.post('http://localhost:8080/task/submit', params={'taskType': task_type}, json=task_payload) as response:
+        assert response.status == 200
+        return (await response.json())['handle']
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str]):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_result_set(client: aiohttp.ClientSession, task_id: str, task_result):
+    async with client.post('http://localhost:8080/result/set', params={'taskId': task_id}, json=task_result) as response:
+        assert response.status == 200
+
+
+async def test_submit_and_wait():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            # submit tasks, the handles are returned immediately
+            task_type = 'task-type-under-test'
+            handle1 = await task_producer_submit(client, task_type, [1, 2])
+            handle2 = await task_producer_submit(client, task_type, [3, 4])
+
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle1, handle2]}) as response:
+                assert response.status == 204
+
+            # one result ends the long-polling
+            wait_task = asyncio.create_task(
+                client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=10'}, json={'handles': [handle1, handle2]}),
+            )
+            await asyncio.sleep(0.5)
+            assert not wait_task.done()
+            task1 = await worker_task_get(client, [task_type])
+            await worker_result_set(client, task1['taskId'], sum(task1['payload']))
+            async with await wait_task as response:
+                assert response.status == 200
+                results = await response.json()
+            assert results == {'results': {handle1: 3}, 'errors': {}, 'unknownHandles': []}
+
+            # results are kept until they are acknowledged
+            task2 = await worker_task_get(client, [task_type])
+            await worker_result_set(client, task2['taskId'], sum(task2['payload']))
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle1, handle2]}) as response:
+                assert response.status == 200
+                results = await response.json()
+            assert results == {'results': {handle1: 3, handle2: 7}, 'errors': {}, 'unknownHandles': []}
+
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle2], 'collected': [handle1]}) as response:
+                assert response.status == 200
+                results = await response.json()
+            assert results == {'results': {handle2: 7}, 'errors': {}, 'unknownHandles': []}
+
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle1, handle2]}) as response:
+                assert response.status == 200
+                results = await response.json()
+            assert results == {'results': {handle2: 7}, 'errors': {}, 'unknownHandles': [handle1]}
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_result_ttl():
+    process = subprocess.Popen(['task-router', '--result-ttl=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            task_type = 'task-type-under-test'
+            handle = await task_producer_submit(client, task_type, [1, 2])
+            task = await worker_task_get(client, [task_type])
+            await worker_result_set(client, task['taskId'], sum(task['payload']))
+
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle]}) as response:
+                assert response.status == 200
+                assert (await response.json())['results'] == {handle: 3}
+
+            # expired results are unknown
+            await asyncio.sleep(1.5)
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle]}) as response:
+                assert response.status == 200
+                assert (await response.json())['unknownHandles'] == [handle]
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_cancel_submitted_task():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/cancel', 'POST')
+
+            task_type = 'task-type-under-test'
+            handle = await task_producer_submit(client, task_type, [1, 2])
+
+            async with client.post('http://localhost:8080/task/cancel', json=[handle]) as response:
+                assert response.status == 200
+
+            # cancelled tasks are neither leased nor known
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=1'}, params={'taskType': [task_type]}) as response:
+                assert response.status == 204
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json={'handles': [handle]}) as response:
+                assert response.status == 200
+                assert (await response.json())['unknownHandles'] == [handle]
+
+            async with client.post('http://localhost:8080/task/cancel', json={'handle': handle}) as response:
+                assert response.status == 400
+            async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, json=[handle]) as response:
+                assert response.status == 400
+            for body in (b'', b'{"handles": '):
+                async with client.post('http://localhost:8080/task/cancel', data=body) as response:
+                    assert response.status == 400
+                async with client.post('http://localhost:8080/result/wait', headers={'Prefer': 'wait=1'}, data=body) as response:
+                    assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_api_client_run_multiplexed():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client, ditef_router.api_client.ApiClient('http://localhost:8080/', 1, 1, 1, maximum_concurrent_polls=2) as api_client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            # dispatch more task executions than polls
+            task_type = 'task-type-under-test'
+            task_payloads = [[index, index] for index in range(10)]
+            task_producer_tasks = [
+                asyncio.create_task(api_client.run(task_type, task_payload))
+                for task_payload in task_payloads
+            ]
+
+            # simulate worker processing in reverse order
+            tasks = [
+                await worker_task_get(client, [task_type])
+                for _ in task_payloads
+            ]
+            assert len(api_client.poll_tasks) <= 2
+            for task in reversed(tasks):
+                await worker_result_set(client, task['taskId'], sum(task['payload']))
+
+            # validate task results
+            task_producer_results = await asyncio.gather(*task_producer_tasks)
+            assert task_producer_results == [
+                sum(task_payload)
+                for task_payload in task_payloads
+            ]
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_api_client_polls_new_handles():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client, ditef_router.api_client.ApiClient('http://localhost:8080/', 1, 1, 1, maximum_concurrent_polls=1) as api_client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/submit', 'POST')
+
+            # the only poll waits for a long-running task
+            task_type = 'task-type-under-test'
+            long_task = asyncio.create_task(api_client.run(task_type, 'long'))
+            assert (await worker_task_get(client, [task_type]))['payload'] == 'long'
+
+            # results of later tasks do not wait for the poll timeout
+            short_task = asyncio.create_task(api_client.run(task_type, 'short'))
+            task = await worker_task_get(client, [task_type])
+            await worker_result_set(client, task['taskId'], 'short-result')
+            assert await asyncio.wait_for(short_task, 5) == 'short-result'
+            assert not long_task.done()
+            long_task.cancel()
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
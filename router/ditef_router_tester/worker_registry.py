@@ -0,0 +1,137 @@
+import aiohttp
+import asyncio
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_run(client: aiohttp.ClientSession, task_type: str, task_payload):
+    async with client.post('http://localhost:8080/task/run', params={'taskType': task_type}, json=task_payload) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def worker_task_get(client: aiohttp.ClientSession, task_types: typing.List[str], worker_id: str):
+    async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=10'}, params={'taskType': task_types, 'workerId': worker_id}) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def get_workers(client: aiohttp.ClientSession) -> typing.Dict[str, dict]:
+    async with client.get('http://localhost:8080/workers') as response:
+        assert response.status == 200
+        return {
+            worker['workerId']: worker
+            for worker in await response.json()
+        }
+
+
+async def test_worker_registry():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/worker/register', 'POST')
+
+            task_type = 'task-type-under-test'
+            registration = {
+                'workerId': 'worker-under-test',
+                'hostname': 'host-under-test',
+                'taskTypes': [task_type],
+                'concurrency': 2,
+                'resources': {'cpus': 4},
+            }
+            async with client.post('http://localhost:8080/worker/register', json=registration) as response:
+                assert response.status == 200
+                assert await response.json() == {'workerId': 'worker-under-test'}
+
+            # leases are attributed to the worker
+            task_producer_task = asyncio.create_task(
+                task_producer_run(client, task_type, [1, 2]),
+            )
+            task = await worker_task_get(client, [task_type], 'worker-under-test')
+            worker = (await get_workers(client))['worker-under-test']
+            assert {key: worker[key] for key in registration} == registration
+            assert [lease['taskId'] for lease in worker['leases']] == [task['taskId']]
+            assert worker['completedTasks'] == 0
+            assert worker['meanTaskSeconds'] is None
+
+            await asyncio.sleep(0.5)
+            async with client.post('http://localhost:8080/result/set', params={'taskId': task['taskId'], 'workerId': 'worker-under-test'}, json=3) as response:
+                assert response.status == 200
+            assert await task_producer_task == 3
+            worker = (await get_workers(client))['worker-under-test']
+            assert worker['leases'] == []
+            assert worker['completedTasks'] == 1
+            assert worker['meanTaskSeconds'] >= 0.5
+
+            # failed attempts are counted
+            task_producer_task = asyncio.create_task(
+                client.post('http://localhost:8080/task/run', params={'taskType': task_type}, json=[3, 4]),
+            )
+            task = await worker_task_get(client, [task_type], 'worker-under-test')
+            async with client.post('http://localhost:8080/result/error', params={'taskId': task['taskId']}, json={}) as response:
+                assert response.status == 200
+            assert (await get_workers(client))['worker-under-test']['failedTasks'] == 1
+            task_producer_task.cancel()
+
+            # unregistered workers are known by their ID
+            async with client.ws_connect('ws://localhost:8080/worker/websocket?taskType=task-type-under-test&workerId=unregistered-worker'):
+                worker = (await get_workers(client))['unregistered-worker']
+                assert worker['hostname'] is None
+                assert worker['connected']
+            await asyncio.sleep(0.5)
+            assert not (await get_workers(client))['unregistered-worker']['connected']
+
+            async with client.post('http://localhost:8080/worker/register', json={'concurrency': 0}) as response:
+                assert response.status == 400
+            async with client.post('http://localhost:8080/worker/register', json=[]) as response:
+                assert response.status == 400
+            for registration in ({'resources': {'cpus': '4'}}, {'resources': {'gpus': True}}, {'resources': [4]}):
+                async with client.post('http://localhost:8080/worker/register', json=registration) as response:
+                    assert response.status == 400
+            for body in (b'', b'{"workerId": '):
+                async with client.post('http://localhost:8080/worker/register', data=body) as response:
+                    assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_worker_expiry():
+    process = subprocess.Popen(['task-router', '--worker-expiry=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/worker/register', 'POST')
+
+            async with client.post('http://localhost:8080/worker/register', json={}) as response:
+                assert response.status == 200
+                worker_id = (await response.json())['workerId']
+
+            async with client.ws_connect('ws://localhost:8080/worker/websocket?taskType=task-type-under-test&workerId=connected-worker'):
+                # connected workers are kept while idle
+                await asyncio.sleep(1.5)
+                assert list(await get_workers(client)) == ['connected-worker']
+            await asyncio.sleep(1.5)
+            assert worker_id not in await get_workers(client)
+            assert await get_workers(client) == {}
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
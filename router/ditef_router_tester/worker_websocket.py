@@ -0,0 +1,139 @@
+import aiohttp
+import asyncio
+import json
+import subprocess
+import typing
+
+
+async def wait_for_url(client: aiohttp.ClientSession, url: str, method: str):
+    while True:
+        try:
+            async with client.options(url) as response:
+                if method in response.headers['Allow']:
+                    return
+        except aiohttp.ClientConnectorError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def task_producer_run(client: aiohttp.ClientSession, task_type: str, task_payload):
+    async with client.post('http://localhost:8080/task/run', params={'taskType': task_type}, json=task_payload) as response:
+        assert response.status == 200
+        return await response.json()
+
+
+async def receive_tasks(websocket: aiohttp.ClientWebSocketResponse, timeout: float) -> typing.List[dict]:
+    try:
+        message = await websocket.receive(timeout)
+    except asyncio.TimeoutError:
+        return []
+    assert message.type == aiohttp.WSMsgType.BINARY
+    return json.loads(message.data)['tasks']
+
+
+async def test_websocket_worker():
+    process = subprocess.Popen(['task-router', '--heartbeat-timeout=1'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run', 'POST')
+
+            # dispatch task executions
+            task_type = 'task-type-under-test'
+            task_payloads = [[1, 2], [3, 4], [5, 6]]
+            task_producer_tasks = [
+                asyncio.create_task(
+                    task_producer_run(client, task_type, task_payload),
+                )
+                for task_payload in task_payloads
+            ]
+            await asyncio.sleep(0.5)
+
+            async with client.ws_connect('ws://localhost:8080/worker/websocket?taskType=task-type-under-test&count=2') as websocket:
+                # the router sends at most count tasks
+                tasks = await receive_tasks(websocket, 1)
+                assert len(tasks) == 2
+                assert await receive_tasks(websocket, 0.5) == []
+
+                # heartbeats keep the leases alive
+                for _ in range(3):
+                    await websocket.send_json({'type': 'heartbeat', 'taskIds': [task['taskId'] for task in tasks]})
+                    await asyncio.sleep(0.5)
+
+                # results free the capacity for the next task
+                await websocket.send_json({'type': 'results', 'results': {task['taskId']: sum(task['payload']) for task in tasks}})
+                tasks += await receive_tasks(websocket, 1)
+                assert len(tasks) == 3
+                await websocket.send_json({'type': 'results', 'results': {tasks[2]['taskId']: sum(tasks[2]['payload'])}})
+
+                # validate task results
+                task_producer_results = await asyncio.gather(*task_producer_tasks)
+                assert sorted(task_producer_results) == sorted(
+                    sum(task_payload)
+                    for task_payload in task_payloads
+                )
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
+
+
+async def test_websocket_disconnect_requeues_tasks():
+    process = subprocess.Popen(['task-router'])
+    try:
+        async with aiohttp.ClientSession() as client:
+            # wait for server to become ready
+            await wait_for_url(client, 'http://localhost:8080/task/run', 'POST')
+
+            task_type = 'task-type-under-test'
+            task_producer_task = asyncio.create_task(
+                task_producer_run(client, task_type, [1, 2]),
+            )
+
+            async with client.ws_connect('ws://localhost:8080/worker/websocket?taskType=task-type-under-test') as websocket:
+                tasks = await receive_tasks(websocket, 1)
+                assert len(tasks) == 1
+
+            # the task is available again without waiting for the heartbeat timeout
+            async with client.get('http://localhost:8080/task/get', headers={'Prefer': 'wait=1'}, params={'taskType': [task_type]}) as response:
+                assert response.status == 200
+                task = await response.json()
+            assert task['payload'] == [1, 2]
+            assert task['taskId'] != tasks[0]['taskId']
+            async with client.post('http://localhost:8080/result/set', params={'taskId': task['taskId']}, json=3) as response:
+                assert response.status == 200
+            assert await task_producer_task == 3
+
+            # cancelled tasks are reported in response to heartbeats
+            task_producer_task = asyncio.create_task(
+                task_producer_run(client, task_type, [3, 4]),
+            )
+            async with client.ws_connect('ws://localhost:8080/worker/websocket?taskType=task-type-under-test') as websocket:
+                tasks = await receive_tasks(websocket, 1)
+                assert len(tasks) == 1
+                task_producer_task.cancel()
+                try:
+                    await task_producer_task
+                except asyncio.CancelledError:
+                    pass
+                await asyncio.sleep(0.5)
+                await websocket.send_json({'type': 'heartbeat', 'taskIds': [tasks[0]['taskId']]})
+                message = await websocket.receive(1)
+                assert json.loads(message.data) == {'cancelledTaskIds': [tasks[0]['taskId']]}
+
+            # malformed messages close the connection
+            async with client.ws_connect('ws://localhost:8080/worker/websocket?taskType=task-type-under-test') as websocket:
+                await websocket.send_str('42')
+                message = await websocket.receive(1)
+                assert message.type == aiohttp.WSMsgType.CLOSE
+
+            async with client.get('http://localhost:8080/worker/websocket') as response:
+                assert response.status == 400
+    finally:
+        try:
+            assert process.poll() is None  # process is still running
+            process.terminate()
+        finally:
+            process.wait()
@@ -11,6 +11,7 @@ setuptools.setup(
         'console_scripts': [
             'ditef-router = ditef_router:main',
             'ditef-router-tester = ditef_router_tester:main',
+            'ditef-router-bench = ditef_router_tester.bench:main',
         ],
     },
     install_requires=[
@@ -1,12 +1,27 @@
+import aiohttp
+import asyncio
 import click
+import copy
 import datetime
+import functools
 import importlib
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
 import pathlib
 import requests
+import socket
 import threading
 import time
+import traceback
 import typing
 import urllib.parse
+import uuid
+
+# lease duration assumed if the router does not tell it (its default
+# heartbeat timeout)
+default_lease_duration = 60
 
 
 def append_to_server_url(router_url: str, object_type: str, operation: str):
@@ -22,29 +37,380 @@ def append_to_server_url(router_url: str, object_type: str, operation: str):
     ))
 
 
+def get_blob(url: str, connect_timeout: int, blob_hash: str):
+    blob_response = requests.get(
+        url,
+        params={
+            'hash': blob_hash,
+        },
+        timeout=(
+            connect_timeout,
+            60,
+        ),
+    )
+    assert blob_response.status_code == 200
+    return blob_response.json()
+
+
+def resolve_blobs(payload, fetch_blob: typing.Callable[[str], typing.Any]):
+    '''Replaces blob references ({'$blob': hash}) in the payload by the
+    referenced sub-documents.'''
+
+    if isinstance(payload, dict):
+        if len(payload) == 1 and '$blob' in payload:
+            # cached blobs are shared between tasks, evaluation gets a copy
+            return copy.deepcopy(fetch_blob(payload['$blob']))
+        return {
+            key: resolve_blobs(value, fetch_blob)
+            for key, value in payload.items()
+        }
+    if isinstance(payload, list):
+        return [
+            resolve_blobs(value, fetch_blob)
+            for value in payload
+        ]
+    return payload
+
+
+def task_error(error: Exception) -> dict:
+    '''Describes a failed evaluation for the router and the task producer.'''
+
+    return {
+        'exception': repr(error),
+        'traceback': ''.join(traceback.format_exception(
+            type(error), error, error.__traceback__)),
+    }
+
+
+class EvaluationError(Exception):
+    '''Evaluation failed in the evaluation process, error is its task_error.'''
+
+    def __init__(self, error: dict):
+        super().__init__(error['exception'])
+        self.error = error
+
+
+class EvaluationCancelled(Exception):
+    pass
+
+
+def run_evaluations(connection: multiprocessing.connection.Connection):
+    '''Main of the evaluation process, runs the received evaluations one after
+    another.'''
+
+    while True:
+        try:
+            task_type, payload = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send(
+                ('result', importlib.import_module(task_type).run(payload)))
+        except Exception as error:
+            traceback.print_exc()
+            connection.send(('error', task_error(error)))
+
+
+class EvaluationProcess:
+    '''Runs evaluations in a child process which is killed to abort an
+    evaluation. The process is kept between evaluations, task modules are
+    therefore only imported once.'''
+
+    def __init__(self, poll_interval: float = 0.5):
+        self.poll_interval = poll_interval
+        self.process: typing.Optional[multiprocessing.Process] = None
+        self.connection: typing.Optional[multiprocessing.connection.Connection] = None
+
+    def start(self):
+        # forking the multi-threaded worker is not safe
+        context = multiprocessing.get_context('spawn')
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=run_evaluations,
+            args=(child_connection,),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+        self.process = None
+        self.connection = None
+
+    def run(self, task_type: str, payload, is_cancelled: typing.Callable[[], bool]):
+        '''Runs the evaluation and returns its result. Raises
+        EvaluationCancelled if is_cancelled returns True before the evaluation
+        finished and EvaluationError if it failed.'''
+
+        if is_cancelled():
+            raise EvaluationCancelled()
+        if self.process is None:
+            self.start()
+        self.connection.send((task_type, payload))
+
+        while not self.connection.poll(self.poll_interval):
+            if is_cancelled():
+                self.stop()
+                raise EvaluationCancelled()
+            if not self.process.is_alive() and not self.connection.poll():
+                exit_code = self.process.exitcode
+                self.stop()
+                raise EvaluationError({
+                    'exception': f'Evaluation process exited with code {exit_code}',
+                    'traceback': '',
+                })
+
+        try:
+            status, value = self.connection.recv()
+        except EOFError:
+            self.stop()
+            raise EvaluationError({
+                'exception': 'Evaluation process exited',
+                'traceback': '',
+            })
+        if status == 'error':
+            raise EvaluationError(value)
+        return value
+
+
+def run_task(task: dict, fetch_blob: typing.Callable[[str], typing.Any], evaluation_process: EvaluationProcess, is_cancelled: typing.Callable[[], bool]):
+    '''Runs the task in the evaluation process. Raises EvaluationError with the
+    error to report to the router if the task failed.'''
+
+    try:
+        payload = resolve_blobs(task['payload'], fetch_blob)
+    except Exception as error:
+        traceback.print_exc()
+        raise EvaluationError(task_error(error))
+    return evaluation_process.run(task['taskType'], payload, is_cancelled)
+
+
+def worker_registration(arguments: dict) -> dict:
+    '''Details of this worker shown by the router, resources and labels are
+    matched against the requirements of tasks, warm keys against their
+    affinity keys.'''
+
+    return {
+        'workerId': arguments['worker_id'],
+        'hostname': socket.gethostname(),
+        'taskTypes': list(arguments['task_type']),
+        'concurrency': arguments['batch_size'],
+        'resources': dict(arguments['resource']),
+        'labels': list(arguments['label']),
+        'warmKeys': list(arguments['warm_key']),
+    }
+
+
+def lease_duration_params(arguments: dict) -> typing.List[typing.Tuple[str, float]]:
+    '''Query parameters requesting the lease duration of leased tasks.'''
+
+    if arguments['lease_duration'] is None:
+        return []
+    return [('leaseDuration', arguments['lease_duration'])]
+
+
+def heartbeat_interval(arguments: dict, lease_duration: float) -> float:
+    '''Seconds between heartbeats, half of the granted lease duration unless
+    an interval is given.'''
+
+    if arguments['heartbeat_interval'] is not None:
+        return arguments['heartbeat_interval']
+    return lease_duration / 2
+
+
+async def run_websocket_worker(arguments: dict, fetch_blob: typing.Callable[[str], typing.Any], evaluation_process: EvaluationProcess):
+    '''Receives tasks, sends heartbeats and returns results over one
+    persistent WebSocket connection to the router. Tasks are run from a
+    thread so that the connection stays responsive.'''
+
+    parsed_router_url = urllib.parse.urlparse(
+        append_to_server_url(arguments['router_url'], 'worker', 'websocket'))
+    url_worker_websocket = urllib.parse.urlunparse(parsed_router_url._replace(
+        scheme='wss' if parsed_router_url.scheme == 'https' else 'ws',
+        query=urllib.parse.urlencode([
+            *(('taskType', task_type) for task_type in arguments['task_type']),
+            ('count', arguments['batch_size']),
+            ('workerId', arguments['worker_id']),
+            *lease_duration_params(arguments),
+        ]),
+    ))
+    url_worker_register = append_to_server_url(
+        arguments['router_url'], 'worker', 'register')
+    retry_count = 0
+    retry_first_timestamp = None
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(connect=arguments['connect_timeout'])) as session:
+        while True:
+            try:
+                # the router may have been restarted since the last connection
+                async with session.post(url_worker_register, json=worker_registration(arguments), raise_for_status=True):
+                    pass
+                async with session.ws_connect(url_worker_websocket) as websocket:
+                    retry_count = 0
+                    retry_first_timestamp = None
+                    await process_websocket_tasks(
+                        websocket, arguments, fetch_blob, evaluation_process)
+                print('Connection to router closed, reconnecting...')
+            except aiohttp.ClientError:
+                retry_output = '' if retry_count == 0 else f' (retried {retry_count} times since {datetime.datetime.now() - retry_first_timestamp})'
+                print(
+                    f'Failed to connect while getting task, retrying...{retry_output}')
+                # store timestamp
+                if retry_first_timestamp is None:
+                    retry_first_timestamp = datetime.datetime.now()
+                # exponential back-off
+                await asyncio.sleep(
+                    min(
+                        arguments['maximum_retry_timeout'],
+                        arguments['initial_retry_timeout'] * 2**retry_count,
+                    ),
+                )
+                retry_count += 1
+
+
+async def process_websocket_tasks(websocket: aiohttp.ClientWebSocketResponse, arguments: dict, fetch_blob: typing.Callable[[str], typing.Any], evaluation_process: EvaluationProcess):
+    loop = asyncio.get_running_loop()
+    received_tasks = asyncio.Queue()
+    # IDs of received tasks without result
+    current_task_ids = []
+    # IDs of received tasks cancelled by their producers
+    cancelled_task_ids = set()
+    # all tasks of the connection are leased for the same duration
+    lease_duration = arguments['lease_duration'] or default_lease_duration
+    # loop time of the next heartbeat, brought forward by received tasks
+    next_heartbeat = loop.time() + heartbeat_interval(arguments, lease_duration)
+    next_heartbeat_changed = asyncio.Event()
+
+    async def receive_tasks():
+        nonlocal lease_duration, next_heartbeat
+        # reading keeps answering the pings of the router
+        async for message in websocket:
+            if message.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                try:
+                    data = json.loads(message.data)
+                except ValueError:
+                    # like a broken connection, the router requeues the
+                    # tasks of the connection
+                    print('Got malformed message while getting task, reconnecting...')
+                    break
+                cancelled_task_ids.update(data.get('cancelledTaskIds', []))
+                for task in data.get('tasks', []):
+                    assert task['taskType'] in arguments['task_type']
+                    lease_duration = task.get('leaseDuration', lease_duration)
+                    current_task_ids.append(task['taskId'])
+                    received_tasks.put_nowait(task)
+                    # the lease of the task starts now
+                    next_heartbeat = min(
+                        next_heartbeat,
+                        loop.time() + heartbeat_interval(arguments, lease_duration),
+                    )
+                    next_heartbeat_changed.set()
+        # connection closed
+        received_tasks.put_nowait(None)
+
+    async def send_heartbeats():
+        nonlocal next_heartbeat
+        while True:
+            next_heartbeat_changed.clear()
+            try:
+                await asyncio.wait_for(next_heartbeat_changed.wait(), next_heartbeat - loop.time())
+                continue
+            except asyncio.TimeoutError:
+                pass
+            next_heartbeat = loop.time() + heartbeat_interval(arguments, lease_duration)
+            await websocket.send_json({
+                'type': 'heartbeat',
+                'taskIds': current_task_ids,
+            })
+
+    receive_tasks_task = asyncio.create_task(receive_tasks())
+    send_heartbeats_task = asyncio.create_task(send_heartbeats())
+    # task ID -> result/error of tasks which are sent with the next message
+    results = {}
+    errors = {}
+    try:
+        while True:
+            task = await received_tasks.get()
+            if task is None:
+                return
+            try:
+                results[task['taskId']] = await loop.run_in_executor(
+                    None,
+                    run_task,
+                    task,
+                    fetch_blob,
+                    evaluation_process,
+                    functools.partial(
+                        cancelled_task_ids.__contains__, task['taskId']),
+                )
+            except EvaluationCancelled:
+                print('Task got cancelled by its producer')
+                cancelled_task_ids.discard(task['taskId'])
+                current_task_ids.remove(task['taskId'])
+            except EvaluationError as error:
+                errors[task['taskId']] = error.error
+            # results of a batch of tasks are sent at once, finished tasks
+            # stay heartbeated until then
+            if received_tasks.empty():
+                if len(errors) > 0:
+                    await websocket.send_json({
+                        'type': 'errors',
+                        'errors': errors,
+                    })
+                await websocket.send_json({
+                    'type': 'results',
+                    'results': results,
+                })
+                for task_id in itertools.chain(errors, results):
+                    current_task_ids.remove(task_id)
+                results = {}
+                errors = {}
+    finally:
+        receive_tasks_task.cancel()
+        send_heartbeats_task.cancel()
+
+
 class HeartbeatThread(threading.Thread):
 
-    def __init__(self, url, interval: int):
+    def __init__(self, url, arguments: dict):
         super().__init__()
         self.url = url
-        self.interval = interval
+        self.arguments = arguments
+        self.worker_id = arguments['worker_id']
         self.start_event = threading.Event()
         self.stop_event = threading.Event()
         self.cancel_event = threading.Event()
-        self.current_task_id: typing.Optional[str] = None
+        self.current_task_ids: typing.List[str] = []
+        # tasks of the current lease cancelled by their producers
+        self.cancelled_task_ids: typing.Set[str] = set()
+        # seconds until the earliest lease of the current tasks expires,
+        # updated by the heartbeat responses
+        self.lease_duration: float = default_lease_duration
 
     def run(self):
         while not self.cancel_event.is_set():
             self.start_event.wait()
             self.start_event.clear()
-            while not self.stop_event.wait(self.interval):
-                # send heartbeat
-                requests.post(
+            while not self.stop_event.wait(heartbeat_interval(self.arguments, self.lease_duration)):
+                # send heartbeat for all tasks of the current lease
+                heartbeat_response = requests.post(
                     self.url,
                     params={
-                        'taskId': self.current_task_id,
+                        'taskId': self.current_task_ids,
+                        'workerId': self.worker_id,
                     },
                 )
+                if heartbeat_response.status_code in [200, 404]:
+                    heartbeat_body = heartbeat_response.json()
+                    self.cancelled_task_ids.update(
+                        heartbeat_body['cancelledTaskIds'])
+                    if heartbeat_body.get('nextDeadline') is not None:
+                        self.lease_duration = heartbeat_body['nextDeadline']
             self.stop_event.clear()
 
 
@@ -53,41 +419,124 @@ class HeartbeatThread(threading.Thread):
 @click.option('--long-polling-interval', default=60, help='Long polling interval in seconds', show_default=True)
 @click.option('--initial-retry-timeout', default=1, help='Initial retry timeout in seconds at beginning of back-off', show_default=True)
 @click.option('--maximum-retry-timeout', default=16, help='Upper bound of back-off retry timeout in seconds', show_default=True)
-@click.option('--heartbeat-interval', default=30, help='Heartbeat interval in seconds', show_default=True)
+@click.option('--heartbeat-interval', type=float, default=None, help='Heartbeat interval in seconds (default: half of the lease duration granted by the router)')
+@click.option('--lease-duration', type=float, default=None, help='Lease duration in seconds requested for leased tasks, the router requeues tasks whose lease is not renewed by a heartbeat in time. Long tasks may request long leases to send fewer heartbeats (default: heartbeat timeout of the router)')
+@click.option('--blob-cache-size', default=64, help='Amount of payload blobs cached by the worker', show_default=True)
+@click.option('--batch-size', default=1, type=click.IntRange(min=1), help='Maximum amount of tasks leased at once', show_default=True)
+@click.option('--worker-id', default=lambda: str(uuid.uuid4()), help='ID identifying this worker at the router (default: random)')
+@click.option('--resource', type=(str, float), multiple=True, help='Resource hint reported to the router as name and amount (e.g. --resource cpus 4), may be given multiple times')
+@click.option('--label', multiple=True, help='Capability reported to the router which tasks may require (e.g. --label gpu), may be given multiple times')
+@click.option('--warm-key', multiple=True, help='Affinity key of data already cached by this worker (e.g. a preloaded dataset), may be given multiple times')
+@click.option('--websocket', is_flag=True, help='Use one persistent WebSocket connection to the router instead of long-polling', show_default=True)
 @click.argument('router_url', type=str)
 @click.argument('task_type', type=str, required=True, nargs=-1)
 def main(**arguments):
     url_task_get = append_to_server_url(arguments['router_url'], 'task', 'get')
     url_task_heartbeat = append_to_server_url(
         arguments['router_url'], 'task', 'heartbeat')
-    url_task_result = append_to_server_url(
-        arguments['router_url'], 'result', 'set')
+    url_result_set_and_task_get = append_to_server_url(
+        arguments['router_url'], 'result', 'set_and_get')
+    url_result_error = append_to_server_url(
+        arguments['router_url'], 'result', 'error')
+    url_worker_register = append_to_server_url(
+        arguments['router_url'], 'worker', 'register')
+    url_blob_get = append_to_server_url(arguments['router_url'], 'blob', 'get')
+    fetch_blob = functools.lru_cache(maxsize=arguments['blob_cache_size'])(
+        functools.partial(get_blob, url_blob_get, arguments['connect_timeout']),
+    )
+
+    evaluation_process = EvaluationProcess()
+
+    if arguments['websocket']:
+        try:
+            asyncio.run(run_websocket_worker(
+                arguments, fetch_blob, evaluation_process))
+        finally:
+            evaluation_process.stop()
+        return
+
     retry_count = 0
     retry_first_timestamp = None
 
-    heartbeat_thread = HeartbeatThread(
-        url_task_heartbeat, arguments['heartbeat_interval'])
+    # reuse connections to the router
+    session = requests.Session()
+
+    # task ID -> result of tasks whose results are sent with the next request
+    results = {}
+
+    def report_error(task_id: str, error: dict):
+        # the router requeues the task at once instead of waiting for the
+        # heartbeat timeout
+        try:
+            session.post(
+                url_result_error,
+                params={
+                    'taskId': task_id,
+                    'workerId': arguments['worker_id'],
+                },
+                json=error,
+                timeout=(
+                    arguments['connect_timeout'],
+                    60,
+                ),
+            )
+        except requests.exceptions.RequestException:
+            print('Failed to report error of task')
+
+    heartbeat_thread = HeartbeatThread(url_task_heartbeat, arguments)
+
+    # registered again after connection failures, the router may have been restarted
+    registered = False
     heartbeat_thread.start()
 
     try:
         while True:
+            # results are only sent once, even if the request fails
+            results_to_set = results
+            results = {}
             try:
                 try:
-                    task_response = requests.get(
-                        url_task_get,
-                        params={
+                    if not registered:
+                        register_response = session.post(
+                            url_worker_register,
+                            json=worker_registration(arguments),
+                            timeout=(
+                                arguments['connect_timeout'],
+                                60,
+                            ),
+                        )
+                        registered = register_response.status_code == 200
+                    task_request_arguments = {
+                        'params': {
                             'taskType': list(arguments['task_type']),
+                            'workerId': arguments['worker_id'],
+                            **({'count': arguments['batch_size']} if arguments['batch_size'] > 1 else {}),
+                            **dict(lease_duration_params(arguments)),
                         },
-                        headers={
+                        'headers': {
                             # RFC 7240
                             'Prefer': f'wait={arguments["long_polling_interval"]}',
                         },
-                        timeout=(
+                        'timeout': (
                             arguments['connect_timeout'],
                             arguments['long_polling_interval'] + 5,
                         ),
-                    )
+                    }
+                    if len(results_to_set) > 0:
+                        # set results of previous tasks and get next tasks in one request
+                        task_response = session.post(
+                            url_result_set_and_task_get,
+                            json=results_to_set,
+                            **task_request_arguments,
+                        )
+                    else:
+                        task_response = session.get(
+                            url_task_get,
+                            **task_request_arguments,
+                        )
                     assert task_response.status_code in [200, 204]
+                    if task_response.status_code == 200:
+                        tasks = task_response.json()
                 except AssertionError:
                     retry_output = '' if retry_count == 0 else f' (retried {retry_count} times since {datetime.datetime.now() - retry_first_timestamp})'
                     print(
@@ -98,7 +547,13 @@ def main(**arguments):
                     print(
                         f'Failed to connect while getting task, retrying...{retry_output}')
                     raise
-            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout, AssertionError):
+                except ValueError:
+                    retry_output = '' if retry_count == 0 else f' (retried {retry_count} times since {datetime.datetime.now() - retry_first_timestamp})'
+                    print(
+                        f'Got malformed response while getting task, retrying...{retry_output}')
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout, AssertionError, ValueError):
+                registered = False
                 # store timestamp
                 if retry_first_timestamp is None:
                     retry_first_timestamp = datetime.datetime.now()
@@ -120,46 +575,38 @@ def main(**arguments):
                 print('Got 204 while getting task, retrying...')
                 continue
 
-            task = task_response.json()
+            # without batching the router responds with a single task
+            if arguments['batch_size'] == 1:
+                tasks = [tasks]
 
-            assert task['taskType'] in arguments['task_type']
+            assert all(task['taskType'] in arguments['task_type'] for task in tasks)
 
-            heartbeat_thread.current_task_id = task['taskId']
+            heartbeat_thread.current_task_ids = [task['taskId'] for task in tasks]
+            heartbeat_thread.cancelled_task_ids = set()
+            heartbeat_thread.lease_duration = min(
+                task.get('leaseDuration', default_lease_duration)
+                for task in tasks
+            )
             heartbeat_thread.start_event.set()
             try:
-                result = importlib.import_module(
-                    task['taskType']).run(task['payload'])
-            except KeyboardInterrupt:
-                raise
-            except:
-                heartbeat_thread.stop_event.set()
-                import traceback
-                traceback.print_exc()
-                continue
-
-            try:
-                result_response = requests.post(
-                    url_task_result,
-                    params={
-                        'taskId': task['taskId'],
-                    },
-                    json=result,
-                    timeout=(
-                        arguments['connect_timeout'],
-                        1,
-                    ),
-                )
-                assert result_response.status_code == 200
-            except AssertionError:
-                print(
-                    f'Got {result_response.status_code} while setting task result, continuing...')
-            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout):
-                print(
-                    f'Failed to connect while setting task result, continuing...')
+                for task in tasks:
+                    try:
+                        results[task['taskId']] = run_task(
+                            task,
+                            fetch_blob,
+                            evaluation_process,
+                            functools.partial(
+                                heartbeat_thread.cancelled_task_ids.__contains__, task['taskId']),
+                        )
+                    except EvaluationCancelled:
+                        print('Task got cancelled by its producer')
+                    except EvaluationError as error:
+                        report_error(task['taskId'], error.error)
             finally:
                 heartbeat_thread.stop_event.set()
 
     finally:
+        evaluation_process.stop()
         heartbeat_thread.cancel_event.set()
         heartbeat_thread.start_event.set()
         heartbeat_thread.stop_event.set()
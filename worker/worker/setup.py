@@ -12,6 +12,7 @@ setuptools.setup(
         ],
     },
     install_requires=[
+        'aiohttp>=3.6.2',
         'click>=7.1.2',
         'requests>=2.24.0',
     ],